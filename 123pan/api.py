@@ -1,61 +1,227 @@
 import json
 import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import http_transport
 from pan123 import Pan123
+from uploader import BatchProgress, ChunkedUpload, MultipartUpload
+from path_index import PathIndex, MissingPathCache
+from link_cache import LinkCache
+from file_entry import FileEntry
+from mirror import MetadataMirror
 
-# 全局实例
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'business_logic'))
+from validators.upload_validator import UploadValidator
+
+# 全局实例，登录会话在所有请求间共享；目录位置与列表结果按调用各自持有
 _pan_instance = None
+_pan_instance_lock = threading.Lock()
+
+# 路径解析索引，(parent_id, 名称) -> 文件信息
+_path_index = PathIndex(ttl=300)
+
+# 不存在路径的短期缓存，按规范化后的路径记录，重复查询时不再请求123pan
+_missing_paths = MissingPathCache(ttl=30)
+
+# 下载链接缓存，按 (FileId, Etag) 保存到签名链接失效前
+_link_cache = LinkCache()
+
+# 本地元数据镜像，调用start_mirror()后启用
+_mirror = None
+
+# 浏览器分块上传的会话，upload_id -> (ChunkedUpload, 目标文件夹ID, 文件名)
+# 会话及其缓冲的块只保存在当前进程中，多进程部署时同一upload_id的请求须由同一进程处理
+_chunked_uploads = {}
+_chunked_uploads_lock = threading.Lock()
+
+# 分块上传会话闲置多少秒后丢弃
+CHUNKED_UPLOAD_TTL = 3600
+
+# 批量上传共用的线程池，限制所有批次同时上传的文件总数
+_upload_pool = None
+_upload_pool_lock = threading.Lock()
+
+# 批量上传创建目录结构时同时创建的文件夹数
+FOLDER_WORKERS = 4
+
+# list_page()每页的最大条数，与123pan单页可返回的条数一致
+MAX_PAGE_SIZE = 100
 
 def _get_pan_instance():
     """获取Pan123实例，如果未初始化则初始化"""
     global _pan_instance
     if _pan_instance is None:
-        # 读取settings.json配置文件
-        settings_path = "settings.json"
-        if os.path.exists(settings_path):
-            with open(settings_path, 'r', encoding='utf-8') as f:
-                settings = json.load(f)
-        else:
-            settings = {}
-        
-        # 创建Pan123实例
-        _pan_instance = Pan123()
+        with _pan_instance_lock:
+            if _pan_instance is None:
+                # 读取settings.json配置文件
+                settings_path = "settings.json"
+                if os.path.exists(settings_path):
+                    with open(settings_path, 'r', encoding='utf-8') as f:
+                        settings = json.load(f)
+                else:
+                    settings = {}
+                
+                # 创建Pan123实例
+                _configure_transport(settings)
+                _pan_instance = Pan123(**_client_options(settings))
     return _pan_instance
 
+def _configure_transport(settings):
+    """按settings.json配置共享连接池的大小"""
+    http_transport.configure(
+        pool_connections=settings.get("pool-connections", 10),
+        pool_maxsize=settings.get("pool-maxsize", 32)
+    )
+
+def _client_options(settings):
+    """从settings.json读取Pan123的可选参数"""
+    return {
+        "page_size": settings.get("page-size", 100),
+        "dir_workers": settings.get("dir-workers", 4),
+        "upload_mmap": settings.get("upload-mmap", False),
+        "download_workers": settings.get("download-workers", 4),
+    }
+
+def _list_dir(parent_id):
+    """列出目录内容，并用结果刷新路径索引"""
+    pan = _get_pan_instance()
+    res_code, items = pan.fetch_dir(parent_id)
+    if res_code != 0:
+        raise Exception("获取目录列表失败")
+    _path_index.put_listing(parent_id, items)
+    return items
+
+def _default_path():
+    """读取settings.json中的default-path"""
+    settings_path = "settings.json"
+    if os.path.exists(settings_path):
+        with open(settings_path, 'r', encoding='utf-8') as f:
+            return json.load(f).get("default-path")
+    return None
+
+def _format_listing(items):
+    """把远程列表条目整理为 {"folder": [...], "file": [...]} 结构，文件大小保持为字节数"""
+    folders = []
+    files = []
+    
+    for item in items:
+        entry = FileEntry.from_item(item)
+        if entry.is_folder:
+            folders.append(entry.to_dict())
+        else:
+            files.append(entry.to_dict())
+    
+    return {
+        "folder": folders,
+        "file": files
+    }
+
+def _invalidate(parent_id, name, removed_id=None):
+    """
+    本地修改远程目录后，失效路径索引与元数据镜像中受影响的条目
+    
+    参数:
+        parent_id: 被修改的目录ID
+        name: 新建、覆盖或删除的条目名称
+        removed_id: 被删除条目的FileId，删除操作时提供
+    """
+    _path_index.invalidate(parent_id, name)
+    if removed_id is not None:
+        _path_index.invalidate_tree(removed_id)
+        _link_cache.discard(removed_id)
+    else:
+        _missing_paths.invalidate_parent(parent_id)
+    
+    if _mirror is not None:
+        if removed_id is not None:
+            _mirror.remove(removed_id)
+        else:
+            _mirror.mark_dirty(parent_id)
+
 def _find_folder_by_name(name, parent_id=0):
     """根据文件夹名称查找文件夹ID"""
-    pan = _get_pan_instance()
-    pan.parent_file_id = parent_id
-    pan.get_dir()
+    item = _path_index.get(parent_id, name)
+    if item is None or item["Type"] != 1:
+        for entry in _list_dir(parent_id):
+            if entry["Type"] == 1 and entry["FileName"] == name:
+                return entry["FileId"]
+        return None
+    return item["FileId"]
+
+def _normalize_path(path):
+    """
+    合并重复的"/"并去掉首尾的"/"，返回以"/"开头的路径，用作不存在路径缓存的键
     
-    for item in pan.list:
-        if item["Type"] == 1 and item["FileName"] == name:
-            return item["FileId"]
-    return None
+    路径段本身保持不变，文件名中可以包含".."（如"notes..txt"）。
+    """
+    return "/" + "/".join(part for part in path.split("/") if part)
 
-def _get_file_by_path(path):
-    """根据路径获取文件或文件夹信息"""
-    if not path.startswith("/"):
-        path = "/" + path
+def _resolve_path(path):
+    """
+    根据路径解析文件或文件夹信息
+    
+    已索引的路径段直接命中，只列出缺失的路径段所在目录；近期确认不存在的路径
+    直接返回未找到。
+    
+    返回:
+        (父目录ID, 文件信息)，未找到时文件信息为None（命中不存在路径缓存时父目录ID也为None）
+    """
+    path = _normalize_path(path)
+    if _missing_paths.contains(path):
+        return None, None
     
     parts = path.strip("/").split("/")
     current_id = 0
+    item = None
+    resolved = ""
     
     for part in parts:
-        found = False
-        pan = _get_pan_instance()
-        pan.parent_file_id = current_id
-        pan.get_dir()
+        parent_id = current_id
+        resolved = f"{resolved}/{part}"
+        item = _path_index.get(parent_id, part)
+        if item is None:
+            for entry in _list_dir(parent_id):
+                if entry["FileName"] == part:
+                    item = entry
+                    break
         
-        for item in pan.list:
-            if item["FileName"] == part:
-                current_id = item["FileId"]
-                found = True
-                break
-        
-        if not found:
-            return None
+        if item is None:
+            _missing_paths.add(resolved, parent_id)
+            return parent_id, None
+        current_id = item["FileId"]
     
-    return current_id
+    return parent_id, item
+
+def _get_file_by_path(path):
+    """根据路径获取文件或文件夹ID"""
+    _, item = _resolve_path(path)
+    if item is None:
+        return None
+    return item["FileId"]
+
+def _resolve_folder(path):
+    """
+    解析目录路径对应的文件夹ID，"/"表示主目录（settings.json中的default-path）
+    
+    返回:
+        (文件夹ID, None)，解析失败时为 (None, 错误信息)
+    """
+    if path == "/":
+        default_path = _default_path()
+        if not default_path:
+            return 0, None
+        folder_id = _find_folder_by_name(default_path)
+        if folder_id is None:
+            return None, "主目录不合法"
+        return folder_id, None
+    
+    folder_id = _get_file_by_path(path)
+    if folder_id is None:
+        return None, "没有找到对应文件夹或文件"
+    return folder_id, None
 
 def login(username=None, password=None):
     """
@@ -92,7 +258,18 @@ def login(username=None, password=None):
         
         # 创建新的Pan123实例并登录
         global _pan_instance
-        _pan_instance = Pan123(readfile=False, user_name=use_username, pass_word=use_password)
+        _configure_transport(settings)
+        _pan_instance = Pan123(
+            readfile=False,
+            user_name=use_username,
+            pass_word=use_password,
+            **_client_options(settings)
+        )
+        _path_index.clear()
+        _missing_paths.clear()
+        _link_cache.clear()
+        if _mirror is not None:
+            _mirror.clear()
         
         return {"status": "success"}
     except Exception as e:
@@ -105,62 +282,25 @@ def list():
     返回:
         {
             "folder": [{"id": "1", "name": "镜像文件夹"}, ...],
-            "file": [{"id": "4", "name": "win11镜像.iso", "size": "3.5GB"}, ...]
+            "file": [{"id": "4", "name": "win11镜像.iso", "size": 3758096384, ...}, ...]
         }
         或 {"error": "主目录不合法"}
     """
     try:
-        pan = _get_pan_instance()
-        
         # 检查settings.json中的default-path
-        settings_path = "settings.json"
-        default_path = None
-        if os.path.exists(settings_path):
-            with open(settings_path, 'r', encoding='utf-8') as f:
-                settings = json.load(f)
-                default_path = settings.get("default-path")
+        default_path = _default_path()
         
         if default_path:
             # 查找默认路径对应的文件夹ID
             folder_id = _find_folder_by_name(default_path)
             if folder_id is None:
                 return {"error": "主目录不合法"}
-            pan.parent_file_id = folder_id
         else:
-            pan.parent_file_id = 0
-        
-        pan.get_dir()
-        
-        folders = []
-        files = []
-        
-        for item in pan.list:
-            if item["Type"] == 1:  # 文件夹
-                folders.append({
-                    "id": str(item["FileId"]),
-                    "name": item["FileName"]
-                })
-            else:  # 文件
-                size = item["Size"]
-                if size > 1024 * 1024 * 1024:
-                    size_str = f"{size / (1024 * 1024 * 1024):.1f}GB"
-                elif size > 1024 * 1024:
-                    size_str = f"{size / (1024 * 1024):.1f}MB"
-                elif size > 1024:
-                    size_str = f"{size / 1024:.1f}KB"
-                else:
-                    size_str = f"{size}B"
-                
-                files.append({
-                    "id": str(item["FileId"]),
-                    "name": item["FileName"],
-                    "size": size_str
-                })
+            folder_id = 0
         
-        return {
-            "folder": folders,
-            "file": files
-        }
+        items = _list_dir(folder_id)
+        
+        return _format_listing(items)
     except Exception as e:
         return {"error": str(e)}
 
@@ -174,7 +314,7 @@ def list_folder(path):
     返回:
         {
             "folder": [{"id": "1", "name": "第三季"}, ...],
-            "file": [{"id": "4", "name": "1.mp4", "size": "3.5GB"}, ...]
+            "file": [{"id": "4", "name": "1.mp4", "size": 3758096384, ...}, ...]
         }
         或 {"error": "没有找到对应文件夹或文件"}
     """
@@ -183,40 +323,81 @@ def list_folder(path):
         if folder_id is None:
             return {"error": "没有找到对应文件夹或文件"}
         
-        pan = _get_pan_instance()
-        pan.parent_file_id = folder_id
-        pan.get_dir()
-        
-        folders = []
-        files = []
-        
-        for item in pan.list:
-            if item["Type"] == 1:  # 文件夹
-                folders.append({
-                    "id": str(item["FileId"]),
-                    "name": item["FileName"]
-                })
-            else:  # 文件
-                size = item["Size"]
-                if size > 1024 * 1024 * 1024:
-                    size_str = f"{size / (1024 * 1024 * 1024):.1f}GB"
-                elif size > 1024 * 1024:
-                    size_str = f"{size / (1024 * 1024):.1f}MB"
-                elif size > 1024:
-                    size_str = f"{size / 1024:.1f}KB"
-                else:
-                    size_str = f"{size}B"
-                
-                files.append({
-                    "id": str(item["FileId"]),
-                    "name": item["FileName"],
-                    "size": size_str
-                })
+        items = _list_dir(folder_id)
         
-        return {
-            "folder": folders,
-            "file": files
+        return _format_listing(items)
+    except Exception as e:
+        return {"error": str(e)}
+
+def stream_list(path="/"):
+    """
+    流式列出目录内容，每收到123pan的一页就产出该页的条目
+    
+    参数:
+        path: 文件夹路径，"/"表示主目录
+    
+    返回:
+        {"entries": 生成器，逐条产出 {"type": "folder", "id": "1", "name": "第三季"}
+                    或 {"type": "file", "id": "4", "name": "1.mp4", "size": 3758096384, ...}}
+        或 {"error": "没有找到对应文件夹或文件"}
+    """
+    try:
+        folder_id, error = _resolve_folder(path)
+        if folder_id is None:
+            return {"error": error}
+        
+        pan = _get_pan_instance()
+        return {"entries": _iter_entries(pan.iter_dir(folder_id))}
+    except Exception as e:
+        return {"error": str(e)}
+
+def _iter_entries(pages):
+    for items in pages:
+        listing = _format_listing(items)
+        for folder in listing["folder"]:
+            yield {"type": "folder", **folder}
+        for file in listing["file"]:
+            yield {"type": "file", **file}
+
+def list_page(path="/", page=1, page_size=20, folder_id=None):
+    """
+    分页列出目录内容，每页只向123pan请求对应的一页
+    
+    参数:
+        path: 文件夹路径，"/"表示主目录
+        page: 页码，从1开始
+        page_size: 每页条数，最大为MAX_PAGE_SIZE
+        folder_id: 已知的文件夹ID（如上一页返回的folder_id），提供时不再解析路径
+    
+    返回:
+        {
+            "folder": [...], "file": [...],
+            "total": 目录总条数, "page": 1, "page_size": 20, "folder_id": 文件夹ID
         }
+        或 {"error": "没有找到对应文件夹或文件"}
+    """
+    try:
+        if folder_id is None:
+            folder_id, error = _resolve_folder(path)
+            if folder_id is None:
+                return {"error": error}
+        
+        page = max(1, page)
+        page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+        
+        pan = _get_pan_instance()
+        res_code, items, total = pan.fetch_dir_page(folder_id, page, page_size)
+        if res_code != 0:
+            return {"error": "获取目录列表失败"}
+        
+        result = _format_listing(items)
+        result.update({
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "folder_id": folder_id
+        })
+        return result
     except Exception as e:
         return {"error": str(e)}
 
@@ -232,24 +413,148 @@ def parsing(path):
         或 {"error": "没有找到对应文件夹或文件"}
     """
     try:
-        file_id = _get_file_by_path(path)
-        if file_id is None:
+        _, file_info = _resolve_path(path)
+        if file_info is None or file_info["Type"] == 1:
             return {"error": "没有找到对应文件夹或文件"}
         
-        pan = _get_pan_instance()
+        return {"url": _download_url(file_info)}
+    except Exception as e:
+        return {"error": str(e)}
+
+def parsing_batch(paths, max_workers=8):
+    """
+    批量获取下载链接
+    
+    路径按父目录分组，每个父目录只解析并列出一次；链接由有界线程池并发解析，优先使用缓存。
+    
+    参数:
+        paths: 文件路径列表
+        max_workers: 同时解析链接的线程数
+    
+    返回:
+        {"results": [{"path": "/a/1.mp4", "url": "..."} 或 {"path": "/a/2.mp4", "error": "错误信息"}, ...]}
+        （与paths顺序一致）或 {"error": "错误信息"}
+    """
+    try:
+        groups = {}
+        for index, path in enumerate(paths):
+            parent, _, name = _normalize_path(path).rpartition("/")
+            groups.setdefault(parent, []).append((index, name))
+        
+        results = [None] * len(paths)
+        pending = []
+        for parent, names in groups.items():
+            try:
+                items = _folder_items(parent, [name for _, name in names])
+            except Exception as e:
+                for index, _ in names:
+                    results[index] = {"path": paths[index], "error": str(e)}
+                continue
+            for index, name in names:
+                item = items.get(name)
+                if item is None or item["Type"] == 1:
+                    results[index] = {"path": paths[index], "error": "没有找到对应文件夹或文件"}
+                else:
+                    pending.append((index, item))
         
-        # 找到对应的文件索引
-        file_index = None
-        for i, item in enumerate(pan.list):
-            if item["FileId"] == file_id and item["Type"] != 1:
-                file_index = i
-                break
+        def resolve(job):
+            index, item = job
+            try:
+                return index, {"path": paths[index], "url": _download_url(item)}
+            except Exception as e:
+                return index, {"path": paths[index], "error": str(e)}
         
-        if file_index is None:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending) or 1))) as pool:
+            for index, result in pool.map(resolve, pending):
+                results[index] = result
+        
+        return {"results": results}
+    except Exception as e:
+        return {"error": str(e)}
+
+def _folder_items(folder_path, names):
+    """
+    返回folder_path（""为根目录）下names对应的条目 {名称: 文件信息}，找不到的名称不在结果中
+    
+    各名称都在路径索引中时不发起请求，否则列出该目录一次
+    """
+    if folder_path:
+        _, folder = _resolve_path(folder_path)
+        if folder is None or folder["Type"] != 1:
+            return {}
+        folder_id = folder["FileId"]
+    else:
+        folder_id = 0
+    
+    items = {name: _path_index.get(folder_id, name) for name in names}
+    if any(item is None for item in items.values()):
+        listing = {}
+        for entry in _list_dir(folder_id):
+            listing.setdefault(entry["FileName"], entry)
+        items = {name: listing.get(name) for name in names}
+    return {name: item for name, item in items.items() if item is not None}
+
+def _download_url(file_info):
+    """解析文件的下载地址，优先使用缓存的链接"""
+    file_id, etag = file_info["FileId"], file_info.get("Etag", "")
+    url = _link_cache.get(file_id, etag)
+    if url is None:
+        url = _get_pan_instance().link_detail(file_info, showlink=False)
+        if not isinstance(url, str):
+            raise Exception("获取下载链接失败，错误码: " + str(url))
+        _link_cache.put(file_id, etag, url)
+    return url
+
+# 下载链接过期或失效时CDN返回的状态码
+EXPIRED_LINK_STATUS = (401, 403, 410)
+
+def stat(path):
+    """
+    获取文件信息
+    
+    返回:
+        {"file": {"FileId": ..., "FileName": ..., "Size": ..., "Etag": ..., ...}}
+        或 {"error": "没有找到对应文件夹或文件"}
+    """
+    try:
+        _, file_info = _resolve_path(path)
+        if file_info is None or file_info["Type"] == 1:
             return {"error": "没有找到对应文件夹或文件"}
+        return {"file": file_info}
+    except Exception as e:
+        return {"error": str(e)}
+
+def open_stream(path, headers=None, timeout=(10, 60), file_info=None):
+    """
+    打开文件内容的上游响应，用于由服务端转发下载
+    
+    通过共享连接池以流式方式请求下载地址，不读取响应体；缓存的链接已失效时重新获取一次。
+    
+    参数:
+        path: 文件路径
+        headers: 转发给下载地址的请求头，如Range、If-Range
+        timeout: (连接超时, 读取超时)秒数
+        file_info: 已通过stat()获取的文件信息，提供时不再解析path
+    
+    返回:
+        {"response": 上游响应, "file": 文件信息}，调用方读取完后需关闭response
+        或 {"error": "错误信息"}
+    """
+    try:
+        if file_info is None:
+            result = stat(path)
+            if "error" in result:
+                return result
+            file_info = result["file"]
         
-        download_url = pan.link(file_index, showlink=False)
-        return {"url": download_url}
+        # 要求上游不压缩，转发的Content-Length与Content-Range才与响应体一致
+        headers = dict(headers or {}, **{"Accept-Encoding": "identity"})
+        res = http_transport.get(_download_url(file_info), headers=headers, stream=True, timeout=timeout)
+        if res.status_code in EXPIRED_LINK_STATUS:
+            res.close()
+            _link_cache.discard(file_info["FileId"])
+            res = http_transport.get(_download_url(file_info), headers=headers, stream=True, timeout=timeout)
+        return {"response": res, "file": file_info}
     except Exception as e:
         return {"error": str(e)}
 
@@ -265,22 +570,13 @@ def share(path):
         或 {"error": "错误信息"}
     """
     try:
-        file_id = _get_file_by_path(path)
-        if file_id is None:
+        _, file_info = _resolve_path(path)
+        if file_info is None:
             return {"error": "没有找到对应文件夹或文件"}
         
+        file_id = file_info["FileId"]
         pan = _get_pan_instance()
         
-        # 找到对应的文件
-        file_info = None
-        for item in pan.list:
-            if item["FileId"] == file_id:
-                file_info = item
-                break
-        
-        if not file_info:
-            return {"error": "没有找到对应文件夹或文件"}
-        
         data = {
             "driveId": 0,
             "expiration": "2099-12-12T08:00:00+08:00",
@@ -290,10 +586,7 @@ def share(path):
             "event": "shareCreate"
         }
         
-        import requests
-        import json
-        
-        share_res = requests.post(
+        share_res = http_transport.post(
             "https://www.123pan.com/a/api/share/create",
             headers=pan.header_logined,
             data=json.dumps(data),
@@ -315,7 +608,7 @@ def share(path):
     except Exception as e:
         return {"error": str(e)}
 
-def upload(local_path, remote_path="/", file_name=None):
+def upload(local_path, remote_path="/", file_name=None, max_concurrent=None, md5=None, progress=None, duplicate=2):
     """
     上传文件
     
@@ -323,27 +616,281 @@ def upload(local_path, remote_path="/", file_name=None):
         local_path: 本地文件路径
         remote_path: 远程路径，默认为根目录
         file_name: 指定文件名（可选），如果不指定则从路径提取
+        max_concurrent: 同时上传的分片数（可选），默认3
+        md5: 文件的MD5（可选），调用方已计算时传入，避免再读一遍文件
+        progress: 进度回调（可选），progress(已上传字节数, 文件大小)
+        duplicate: 存在同名文件时的处理方式，1覆盖，2保留两者（默认），不会等待输入
     
     返回:
         {"status": "success"}
         或 {"error": "错误信息"}
     """
     try:
-        if remote_path != "/":
-            folder_id = _get_file_by_path(remote_path)
-            if folder_id is None:
-                return {"error": "远程路径不存在"}
-        else:
-            folder_id = 0
+        if duplicate not in (1, 2):
+            return {"error": "同名文件处理方式无效"}
+        
+        folder_id = _upload_folder(remote_path)
+        if folder_id is None:
+            return {"error": "远程路径不存在"}
+        
+        if file_name is None:
+            file_name = local_path.replace("\\", "/").split("/")[-1]
+        
+        pan = _get_pan_instance()
+        pan.up_load(local_path, file_name, parent_file_id=folder_id, workers=max_concurrent, md5=md5,
+                    duplicate=duplicate, progress=progress)
+        # 覆盖上传可能改变同名文件的FileId
+        _invalidate(folder_id, file_name)
+        
+        return {"status": "success"}
+    except Exception as e:
+        return {"error": str(e)}
+
+def _upload_folder(remote_path):
+    """上传目标目录的文件夹ID，"/"为根目录，不存在时返回None"""
+    if remote_path == "/":
+        return 0
+    return _get_file_by_path(remote_path)
+
+def begin_upload(remote_path, file_name, size, md5, chunk_size):
+    """
+    开始分块上传，客户端随后按chunk_size分块调用upload_chunk()，最后调用complete_upload()
+    
+    参数:
+        remote_path: 远程目录路径
+        file_name: 文件名，存在同名文件时保留两者
+        size: 文件大小
+        md5: 文件的MD5
+        chunk_size: 客户端每块的大小
+    
+    返回:
+        {"upload_id": "...", "chunk_size": 1048576, "chunk_count": 5}
+        或 {"reuse": True}（文件已MD5复用，无需上传）
+        或 {"error": "错误信息"}
+    """
+    try:
+        if not isinstance(chunk_size, int) or chunk_size <= 0:
+            return {"error": "块大小必须是正整数"}
+        folder_id = _upload_folder(remote_path)
+        if folder_id is None:
+            return {"error": "远程路径不存在"}
         
         pan = _get_pan_instance()
-        pan.parent_file_id = folder_id
-        pan.up_load(local_path, file_name)
+        session = pan.request_upload(file_name, folder_id, size, md5, duplicate=2)
+        if session is None:
+            _invalidate(folder_id, file_name)
+            return {"reuse": True}
         
+        chunked = ChunkedUpload(MultipartUpload(pan.header_logined, session), size, chunk_size)
+        upload_id = uuid.uuid4().hex
+        with _chunked_uploads_lock:
+            _prune_chunked_uploads()
+            _chunked_uploads[upload_id] = (chunked, folder_id, file_name)
+        return {"upload_id": upload_id, "chunk_size": chunk_size, "chunk_count": chunked.chunk_count}
+    except Exception as e:
+        return {"error": str(e)}
+
+def upload_chunk(upload_id, index, data):
+    """
+    上传一块，所在分片的块到齐时转发到123pan；失败时客户端只需重发该块
+    
+    返回:
+        {"status": "success"}
+        或 {"error": "错误信息"}
+    """
+    try:
+        entry = _get_chunked_upload(upload_id)
+        if entry is None:
+            return {"error": "上传会话不存在或已过期"}
+        entry[0].put_chunk(index, data)
+        return {"status": "success"}
+    except Exception as e:
+        return {"error": str(e)}
+
+def complete_upload(upload_id):
+    """
+    完成分块上传
+    
+    返回:
+        {"status": "success"}
+        或 {"error": "错误信息"}（例如仍有块未上传，补传后可再次调用）
+    """
+    try:
+        entry = _get_chunked_upload(upload_id)
+        if entry is None:
+            return {"error": "上传会话不存在或已过期"}
+        chunked, folder_id, file_name = entry
+        chunked.complete()
+        with _chunked_uploads_lock:
+            _chunked_uploads.pop(upload_id, None)
+        _invalidate(folder_id, file_name)
         return {"status": "success"}
     except Exception as e:
         return {"error": str(e)}
 
+def _get_chunked_upload(upload_id):
+    """查找分块上传会话，顺带丢弃闲置过久的会话"""
+    with _chunked_uploads_lock:
+        _prune_chunked_uploads()
+        return _chunked_uploads.get(upload_id)
+
+def _prune_chunked_uploads():
+    """丢弃闲置超过CHUNKED_UPLOAD_TTL的会话，释放其缓冲的块；需持有_chunked_uploads_lock"""
+    now = time.time()
+    for key in [k for k, v in _chunked_uploads.items() if v[0].updated_at + CHUNKED_UPLOAD_TTL <= now]:
+        del _chunked_uploads[key]
+
+def upload_batch(files, remote_path="/", max_concurrent=None, progress=None, upload_config=None):
+    """
+    批量上传多个文件，按相对路径在远程目录下重建目录结构
+    
+    先校验全部文件（任一不通过则不上传），再逐层创建缺失的文件夹，最后由共享线程池
+    并发上传文件，同时上传的文件总数由settings.json中的upload-batch-workers限制。
+    
+    参数:
+        files: [{"local_path": "本地路径", "path": "相对路径，如 相册/2024/1.jpg", "md5": "可选"}]
+        remote_path: 远程目标目录，默认为根目录
+        max_concurrent: 每个文件同时上传的分片数（可选）
+        progress: 汇总进度回调，progress({"total_files", "done_files", "failed_files",
+                  "total_bytes", "uploaded_bytes"})
+        upload_config: 校验使用的上传配置（max_file_size、allowed_types），默认不限类型、单文件2GB
+    
+    返回:
+        {"status": "success", "uploaded": 3000, "failed": [], "total_size": 123456}
+        （部分文件失败时status为"partial"，failed为 [{"path": "...", "error": "..."}]）
+        或 {"error": "错误信息"}（校验不通过时附带 "results"）
+    """
+    try:
+        folder_id = _upload_folder(remote_path)
+        if folder_id is None:
+            return {"error": "远程路径不存在"}
+        
+        entries = []
+        for file_info in files:
+            parts = [p for p in file_info["path"].replace("\\", "/").split("/") if p]
+            if not parts or any(p in (".", "..") for p in parts):
+                return {"error": "非法的相对路径: " + file_info["path"]}
+            if not os.path.isfile(file_info["local_path"]):
+                return {"error": "文件不存在: " + file_info["path"]}
+            entries.append({
+                "local_path": file_info["local_path"],
+                "path": "/".join(parts),
+                "folder": "/".join(parts[:-1]),
+                "name": parts[-1],
+                "size": os.path.getsize(file_info["local_path"]),
+                "md5": file_info.get("md5"),
+            })
+        
+        validation = UploadValidator({"upload": upload_config or {}}).validate_batch_upload(entries)
+        if not validation["valid"]:
+            return {
+                "error": "部分文件未通过校验",
+                "results": [r for r in validation["results"] if not r["valid"]]
+            }
+        
+        folder_ids = _create_folders(folder_id, {e["folder"] for e in entries})
+        
+        pan = _get_pan_instance()
+        tracker = BatchProgress([e["size"] for e in entries], progress)
+        failed = []
+        
+        def upload_one(index, entry):
+            parent_id = folder_ids[entry["folder"]]
+            try:
+                pan.up_load(entry["local_path"], entry["name"], parent_file_id=parent_id,
+                            workers=max_concurrent, md5=entry["md5"], duplicate=2,
+                            progress=lambda uploaded, total: tracker.update(index, uploaded))
+                _invalidate(parent_id, entry["name"])
+                tracker.finish(index)
+            except Exception as e:
+                tracker.finish(index, success=False)
+                failed.append({"path": entry["path"], "error": str(e)})
+        
+        pool = _get_upload_pool()
+        futures = [pool.submit(upload_one, i, entry) for i, entry in enumerate(entries)]
+        for future in futures:
+            future.result()
+        
+        return {
+            "status": "partial" if failed else "success",
+            "uploaded": len(entries) - len(failed),
+            "failed": failed,
+            "total_size": validation["total_size"]
+        }
+    except Exception as e:
+        return {"error": str(e)}
+
+def upload_directory(local_dir, remote_path="/", max_concurrent=None, progress=None, upload_config=None):
+    """
+    上传本地文件夹，在remote_path下创建同名文件夹并保留目录结构
+    
+    参数与返回值同upload_batch()
+    """
+    if not os.path.isdir(local_dir):
+        return {"error": "本地文件夹不存在"}
+    
+    root = os.path.abspath(local_dir)
+    base = os.path.basename(root)
+    files = []
+    for dir_path, _, file_names in os.walk(root):
+        for file_name in file_names:
+            local_path = os.path.join(dir_path, file_name)
+            relative = os.path.relpath(local_path, root).replace(os.sep, "/")
+            files.append({"local_path": local_path, "path": base + "/" + relative})
+    return upload_batch(files, remote_path, max_concurrent, progress, upload_config)
+
+def _create_folders(root_id, folders):
+    """
+    在root_id下逐层创建相对目录（及其上级目录），返回 {相对目录: 文件夹ID}，""对应root_id
+    
+    已存在的目录每个父目录只列出一次；新建目录下的子目录必然不存在，无需再列出。
+    同一层的文件夹并发创建。
+    """
+    needed = set()
+    for folder in folders:
+        parts = folder.split("/") if folder else []
+        for depth in range(1, len(parts) + 1):
+            needed.add("/".join(parts[:depth]))
+    
+    folder_ids = {"": root_id}
+    created = set()
+    existing = {}
+    
+    with ThreadPoolExecutor(max_workers=FOLDER_WORKERS) as pool:
+        for depth in sorted({f.count("/") for f in needed}):
+            missing = []
+            for folder in sorted(f for f in needed if f.count("/") == depth):
+                parent, _, name = folder.rpartition("/")
+                parent_id = folder_ids[parent]
+                if parent not in created:
+                    if parent_id not in existing:
+                        existing[parent_id] = {
+                            e["FileName"]: e["FileId"] for e in _list_dir(parent_id) if e["Type"] == 1
+                        }
+                    if name in existing[parent_id]:
+                        folder_ids[folder] = existing[parent_id][name]
+                        continue
+                missing.append((folder, parent_id, name))
+            
+            new_ids = pool.map(lambda item: _create_folder(item[1], item[2]), missing)
+            for (folder, _, _), folder_id in zip(missing, new_ids):
+                folder_ids[folder] = folder_id
+                created.add(folder)
+    
+    return folder_ids
+
+def _get_upload_pool():
+    """批量上传共用的线程池，大小为settings.json中的upload-batch-workers（默认4）"""
+    global _upload_pool
+    with _upload_pool_lock:
+        if _upload_pool is None:
+            settings = {}
+            if os.path.exists("settings.json"):
+                with open("settings.json", 'r', encoding='utf-8') as f:
+                    settings = json.load(f)
+            _upload_pool = ThreadPoolExecutor(max_workers=settings.get("upload-batch-workers", 4))
+    return _upload_pool
+
 def delete(path):
     """
     删除文件或文件夹（包括空文件夹和非空文件夹）
@@ -356,23 +903,14 @@ def delete(path):
         或 {"error": "错误信息"}
     """
     try:
-        file_id = _get_file_by_path(path)
-        if file_id is None:
+        parent_id, file_info = _resolve_path(path)
+        if file_info is None:
             return {"error": "没有找到对应文件夹或文件"}
         
         pan = _get_pan_instance()
+        pan.trash_file(file_info, operation=True)
         
-        # 找到对应的文件索引
-        file_index = None
-        for i, item in enumerate(pan.list):
-            if item["FileId"] == file_id:
-                file_index = i
-                break
-        
-        if file_index is None:
-            return {"error": "没有找到对应文件夹或文件"}
-        
-        pan.delete_file(file_index, by_num=True, operation=True)
+        _invalidate(parent_id, file_info["FileName"], removed_id=file_info["FileId"])
         return {"status": "success"}
     except Exception as e:
         return {"error": str(e)}
@@ -389,41 +927,32 @@ def delete_folder(path):
         或 {"error": "错误信息"}
     """
     try:
-        folder_id = _get_file_by_path(path)
-        if folder_id is None:
+        parent_id, folder_info = _resolve_path(path)
+        if folder_info is None:
             return {"error": "没有找到对应文件夹"}
         
-        pan = _get_pan_instance()
-        
         # 检查是否是文件夹
-        is_folder = False
-        for item in pan.list:
-            if item["FileId"] == folder_id and item["Type"] == 1:
-                is_folder = True
-                break
-        
-        if not is_folder:
+        if folder_info["Type"] != 1:
             return {"error": "指定路径不是文件夹"}
         
-        # 删除文件夹及其内容
-        import requests
-        import json
+        folder_id = folder_info["FileId"]
+        pan = _get_pan_instance()
         
+        # 删除文件夹及其内容
         # 获取文件夹内容
-        pan.parent_file_id = folder_id
-        pan.get_dir()
+        items = _list_dir(folder_id)
         
         deleted_count = 0
         
         # 删除文件夹内的所有文件和子文件夹
-        for item in pan.list:
+        for item in items:
             data_delete = {
                 "driveId": 0,
                 "fileTrashInfoList": [item],
                 "operation": True,
             }
             
-            delete_res = requests.post(
+            delete_res = http_transport.post(
                 "https://www.123pan.com/a/api/file/trash",
                 data=json.dumps(data_delete),
                 headers=pan.header_logined,
@@ -434,26 +963,11 @@ def delete_folder(path):
                 deleted_count += 1
         
         # 最后删除文件夹本身
-        # 找到文件夹在父目录中的索引
-        parent_path = "/".join(path.strip("/").split("/")[:-1])
-        if parent_path:
-            parent_id = _get_file_by_path("/" + parent_path)
-        else:
-            parent_id = 0
-        
-        pan.parent_file_id = parent_id
-        pan.get_dir()
-        
-        folder_index = None
-        for i, item in enumerate(pan.list):
-            if item["FileId"] == folder_id and item["Type"] == 1:
-                folder_index = i
-                break
-        
-        if folder_index is not None:
-            pan.delete_file(folder_index, by_num=True, operation=True)
+        if pan.trash_file(folder_info, operation=True).get("code") == 0:
             deleted_count += 1
         
+        _invalidate(parent_id, folder_info["FileName"], removed_id=folder_id)
+        
         return {"status": "success", "deleted_files": deleted_count}
     except Exception as e:
         return {"error": str(e)}
@@ -478,36 +992,39 @@ def create_folder(path, folder_name):
             if parent_id is None:
                 return {"error": "父目录不存在"}
         
-        pan = _get_pan_instance()
-        
-        import requests
-        import json
-        
-        data = {
-            "driveId": 0,
-            "etag": "",
-            "fileName": folder_name,
-            "parentFileId": parent_id,
-            "size": 0,
-            "type": 1,
-            "duplicate": 0
-        }
-        
-        create_res = requests.post(
-            "https://www.123pan.com/b/api/file/upload_request",
-            headers=pan.header_logined,
-            data=json.dumps(data),
-            timeout=10
-        )
-        
-        create_res_json = create_res.json()
-        if create_res_json["code"] != 0:
-            return {"error": create_res_json["message"]}
-        
-        return {"status": "success", "folder_id": str(create_res_json["data"]["FileId"])}
+        folder_id = _create_folder(parent_id, folder_name)
+        return {"status": "success", "folder_id": str(folder_id)}
     except Exception as e:
         return {"error": str(e)}
 
+def _create_folder(parent_id, folder_name):
+    """在parent_id下创建文件夹并返回其FileId，失败时抛出异常"""
+    pan = _get_pan_instance()
+    
+    data = {
+        "driveId": 0,
+        "etag": "",
+        "fileName": folder_name,
+        "parentFileId": parent_id,
+        "size": 0,
+        "type": 1,
+        "duplicate": 0
+    }
+    
+    create_res = http_transport.post(
+        "https://www.123pan.com/b/api/file/upload_request",
+        headers=pan.header_logined,
+        data=json.dumps(data),
+        timeout=10
+    )
+    
+    create_res_json = create_res.json()
+    if create_res_json["code"] != 0:
+        raise Exception(create_res_json["message"])
+    
+    _invalidate(parent_id, folder_name)
+    return create_res_json["data"]["FileId"]
+
 def reload_session():
     """
     重新加载会话
@@ -519,7 +1036,115 @@ def reload_session():
     try:
         global _pan_instance
         _pan_instance = None
+        _path_index.clear()
+        _missing_paths.clear()
+        _link_cache.clear()
         _get_pan_instance()
         return {"status": "success"}
     except Exception as e:
         return {"error": str(e)}
+
+def start_mirror(db_path="mirror.db", sync_interval=600):
+    """
+    启用本地元数据镜像，并启动后台同步线程
+    
+    参数:
+        db_path: SQLite数据库文件路径
+        sync_interval: 目录同步后多少秒视为过期，过期后由后台线程重新列出
+    
+    返回:
+        {"status": "success"} 或 {"error": "错误信息"}
+    """
+    try:
+        global _mirror
+        if _mirror is None:
+            _mirror = MetadataMirror(
+                db_path,
+                lambda parent_id: _get_pan_instance().fetch_dir(parent_id),
+                sync_interval=sync_interval
+            )
+        _mirror.start()
+        return {"status": "success"}
+    except Exception as e:
+        return {"error": str(e)}
+
+def sync_mirror(progress=None):
+    """
+    立即同步一遍元数据镜像中过期或未同步的目录
+    
+    参数:
+        progress: 进度回调（可选），progress({"folders": 已遍历目录数, "refreshed": 重新列出的目录数})
+    
+    返回:
+        {"status": "success", "refreshed": 12} 或 {"error": "错误信息"}
+    """
+    if _mirror is None:
+        return {"error": "元数据镜像未启用"}
+    try:
+        return {"status": "success", "refreshed": _mirror.sync_once(progress=progress)}
+    except Exception as e:
+        return {"error": str(e)}
+
+def mirror_list(path="/"):
+    """
+    从本地元数据镜像读取目录内容，不发起远程请求
+    
+    参数:
+        path: 文件夹路径，"/"表示主目录（settings.json中的default-path）
+    
+    返回:
+        与list()/list_folder()相同的结构；
+        镜像未启用或路径上的目录尚未同步时返回None，由调用方回退到实时请求
+    """
+    if _mirror is None:
+        return None
+    try:
+        folder_id = _mirror_folder_id(path)
+        if folder_id is None or isinstance(folder_id, dict):
+            return folder_id
+        
+        items = _mirror.list_dir(folder_id)
+        if items is None:
+            return None
+        return _format_listing(items)
+    except Exception as e:
+        print(f"读取镜像失败: {e}")
+        return None
+
+def _mirror_folder_id(path):
+    """在镜像中解析文件夹ID；路径上有目录尚未同步时返回None，路径不合法时返回{"error": ...}"""
+    if path == "/":
+        default_path = _default_path()
+        if not default_path:
+            return 0
+        folder_info = _mirror.resolve("/" + default_path)
+        if folder_info is None:
+            return None
+        if not folder_info or folder_info["Type"] != 1:
+            return {"error": "主目录不合法"}
+        return folder_info["FileId"]
+    folder_info = _mirror.resolve(path)
+    if folder_info is None:
+        return None
+    if not folder_info:
+        return {"error": "没有找到对应文件夹或文件"}
+    return folder_info["FileId"]
+
+def listing_version(path="/"):
+    """
+    镜像中目录内容的版本号，不发起远程请求，可在读取目录之前判断客户端缓存的结果是否仍然有效
+    
+    只有镜像能回答该目录（mirror_list()不返回None）时才有版本号，取镜像中该目录的同步时间；
+    目录由实时请求读取时返回None，此时123pan上的修改只能通过响应内容判断。
+    """
+    if _mirror is None:
+        return None
+    try:
+        folder_id = _mirror_folder_id(path)
+        if isinstance(folder_id, int):
+            synced_at = _mirror.synced_at(folder_id)
+            if synced_at is not None:
+                return f"m{folder_id}-{synced_at:.6f}"
+    except Exception as e:
+        print(f"获取目录版本失败: {e}")
+    return None
@@ -0,0 +1,203 @@
+import hashlib
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+
+# 只缓存Etag为MD5的文件，写入时按MD5校验内容
+_ETAG_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+# 缓存文件名：<FileId>_<Etag>
+_ENTRY_PATTERN = re.compile(r"(\d+)_([0-9a-f]{32})")
+
+
+class ContentCache:
+    """
+    下载内容的本地磁盘缓存
+
+    按 (FileId, Etag) 保存完整的文件内容，文件内容变化后Etag不同，不会命中旧内容。
+    第一次转发下载时边发送边写入临时文件，传输完整且MD5与Etag一致后才加入缓存；
+    之后的完整或Range请求直接由本地文件响应。缓存总大小不超过max_bytes，超出时淘汰最久
+    未使用的文件。使用顺序记录在文件的修改时间中，重启后按修改时间恢复。
+    """
+
+    def __init__(self, root, max_bytes):
+        """
+        参数:
+            root: 缓存目录
+            max_bytes: 缓存文件的总大小上限（包括正在写入的文件）
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (file_id, etag) -> 文件大小
+        self._total = 0
+        self._reserved = 0  # 正在写入的文件预留的大小
+        self._filling = set()
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._load()
+
+    def get(self, file_id, etag):
+        """返回缓存文件的路径，未命中时返回None"""
+        key = (int(file_id), (etag or "").lower())
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            # 文件被外部删除
+            with self._lock:
+                self._total -= self._entries.pop(key, 0)
+            return None
+        return path
+
+    def fill(self, file_id, etag, size):
+        """
+        开始写入一个文件，返回CacheFill；文件不可缓存、已缓存或正在由其他请求写入时返回None
+        """
+        key = (int(file_id), (etag or "").lower())
+        if not _ETAG_PATTERN.fullmatch(key[1]) or size is None or size > self.max_bytes:
+            return None
+        with self._lock:
+            if key in self._entries or key in self._filling:
+                return None
+            self._filling.add(key)
+            self._reserved += size
+            evicted = self._evict()
+        self._remove_files(evicted)
+        tmp_path = "%s.%s.tmp" % (self._path(key), uuid.uuid4().hex)
+        try:
+            f = open(tmp_path, "wb")
+        except OSError:
+            self._release(key, size)
+            return None
+        return CacheFill(self, key, size, tmp_path, f)
+
+    def clear(self):
+        with self._lock:
+            evicted = [*self._entries]
+            self._entries.clear()
+            self._total = 0
+        self._remove_files(evicted)
+
+    def _load(self):
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.endswith(".tmp"):
+                # 上次运行中断时未写完的文件
+                self._remove(path)
+                continue
+            match = _ENTRY_PATTERN.fullmatch(name)
+            if match is None:
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, (int(match.group(1)), match.group(2)), stat.st_size))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._total += size
+        with self._lock:
+            evicted = self._evict()
+        self._remove_files(evicted)
+
+    def _commit(self, key, size, tmp_path):
+        try:
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            self._remove(tmp_path)
+            self._release(key, size)
+            return False
+        with self._lock:
+            self._filling.discard(key)
+            self._reserved -= size
+            self._entries[key] = size
+            self._total += size
+            evicted = self._evict()
+        self._remove_files(evicted)
+        return True
+
+    def _release(self, key, size):
+        with self._lock:
+            self._filling.discard(key)
+            self._reserved -= size
+
+    def _evict(self):
+        """淘汰最久未使用的文件直到不超过上限，返回被淘汰的键；需持有锁"""
+        evicted = []
+        while self._entries and self._total + self._reserved > self.max_bytes:
+            key, size = self._entries.popitem(last=False)
+            self._total -= size
+            evicted.append(key)
+        return evicted
+
+    def _remove_files(self, keys):
+        for key in keys:
+            self._remove(self._path(key))
+
+    def _path(self, key):
+        return os.path.join(self.root, "%d_%s" % key)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class CacheFill:
+    """写入中的缓存文件，由ContentCache.fill()创建；写入失败时放弃缓存，不影响调用方"""
+
+    def __init__(self, cache, key, size, tmp_path, f):
+        self.cache = cache
+        self.key = key
+        self.size = size
+        self.tmp_path = tmp_path
+        self._file = f
+        self._md5 = hashlib.md5()
+        self._written = 0
+
+    def write(self, data):
+        if self._file is None:
+            return
+        try:
+            self._file.write(data)
+        except OSError:
+            self.abort()
+            return
+        self._md5.update(data)
+        self._written += len(data)
+
+    def commit(self):
+        """内容完整且MD5与Etag一致时加入缓存，否则放弃"""
+        if self._file is None:
+            return False
+        try:
+            self._file.close()
+        except OSError:
+            self._file = None
+            self._discard()
+            return False
+        self._file = None
+        if self._written != self.size or self._md5.hexdigest() != self.key[1]:
+            self._discard()
+            return False
+        return self.cache._commit(self.key, self.size, self.tmp_path)
+
+    def abort(self):
+        if self._file is None:
+            return
+        try:
+            self._file.close()
+        except OSError:
+            pass
+        self._file = None
+        self._discard()
+
+    def _discard(self):
+        self.cache._remove(self.tmp_path)
+        self.cache._release(self.key, self.size)
@@ -0,0 +1,281 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+import http_transport
+
+# 每个Range分段的大小
+DEFAULT_SEGMENT_SIZE = 8 * 1024 * 1024
+
+# 每次从响应读取并写入文件的大小
+READ_SIZE = 1024 * 1024
+
+# 下载链接过期或失效时CDN返回的状态码，遇到时重新获取链接
+EXPIRED_STATUS = (401, 403, 410)
+
+
+class DownloadError(Exception):
+    """下载失败或校验不通过"""
+
+
+class RangedDownload:
+    """
+    分段并发下载一个文件
+
+    文件按segment_size拆成HTTP Range分段，由有界线程池并发获取，按偏移直接写入预先分配好
+    大小的临时文件（<目标>.part）。已完成的分段记录在分段映射（<目标>.part.json）中，
+    中断后再次下载同一文件时只获取未完成的分段。主线程按顺序读取已连续完成的分段计算MD5，
+    与下载同时进行，全部完成后与Etag比对，一致时才替换为目标文件。
+    服务端不支持Range时退回单连接顺序下载。
+    """
+
+    def __init__(self, get_url, file_path, size=None, etag=None, segment_size=DEFAULT_SEGMENT_SIZE, workers=4,
+                 max_retries=3, timeout=30):
+        """
+        参数:
+            get_url: 获取下载链接的函数，链接过期时会再次调用
+            file_path: 目标文件路径
+            size: 文件大小（字节），未知时为None，以服务端返回为准
+            etag: 文件的MD5，为None或不是MD5时不校验
+            segment_size: 每个分段的大小
+            workers: 同时下载的分段数
+            max_retries: 单个分段失败后的重试次数
+            timeout: 连接与读取的超时秒数
+        """
+        self.get_url = get_url
+        self.file_path = file_path
+        self.part_path = file_path + ".part"
+        self.map_path = file_path + ".part.json"
+        self.size = size
+        self.etag = etag.lower() if etag and re.fullmatch(r"[0-9a-fA-F]{32}", etag) else None
+        self.segment_size = segment_size
+        self.workers = max(1, workers)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self._url = None
+        self._url_lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._progress_lock = threading.Lock()
+        self._downloaded = 0
+        self._progress = None
+
+    def url(self, stale=None):
+        """当前的下载链接；stale为已失效的链接时重新获取（其他线程已刷新过则直接返回新链接）"""
+        with self._url_lock:
+            if self._url is None or self._url == stale:
+                self._url = self.get_url()
+                if not isinstance(self._url, str):
+                    raise DownloadError("获取下载链接失败: " + str(self._url))
+            return self._url
+
+    def run(self, progress=None):
+        """
+        下载文件，返回目标文件路径
+
+        参数:
+            progress: 进度回调，progress(已下载字节数, 文件大小)，大小未知时文件大小为None
+        """
+        self._progress = progress
+        res = self._get({"Range": "bytes=0-0"})
+        if res.status_code == 200:
+            return self._download_stream(res)
+        with res:
+            if res.status_code == 416:
+                total = 0
+            elif res.status_code == 206:
+                match = re.match(r"bytes 0-0/(\d+)", res.headers.get("Content-Range", ""))
+                if match is None:
+                    raise DownloadError("无法获取文件大小")
+                total = int(match.group(1))
+            else:
+                raise DownloadError("HTTP " + str(res.status_code))
+        if self.size is not None and total != self.size:
+            raise DownloadError("文件大小与服务端不一致: %d != %d" % (total, self.size))
+        self.size = total
+        return self._download_ranged()
+
+    def _download_ranged(self):
+        count = (self.size + self.segment_size - 1) // self.segment_size
+        done = self._load_map()
+        if done is None:
+            done = set()
+            self._preallocate()
+        self._downloaded = sum(self._segment_length(i) for i in done)
+        self._report(0)
+
+        md5 = hashlib.md5()
+        hashed = 0  # 已计入MD5的连续分段数
+        fd = os.open(self.part_path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                pending = {pool.submit(self._fetch, fd, i): i for i in range(count) if i not in done}
+                try:
+                    while True:
+                        # 已连续完成的分段在等待其余分段时计入MD5
+                        while hashed < count and hashed in done:
+                            self._hash_segment(fd, hashed, md5)
+                            hashed += 1
+                        if not pending:
+                            break
+                        finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        errors = []
+                        for future in finished:
+                            index = pending.pop(future)
+                            if future.exception() is None:
+                                done.add(index)
+                            else:
+                                errors.append(future.exception())
+                        self._save_map(done)
+                        if errors:
+                            raise errors[0]
+                finally:
+                    # 任一分段最终失败时，取消尚未开始的分段；已完成的分段保留在映射中
+                    for future in pending:
+                        future.cancel()
+        finally:
+            os.close(fd)
+
+        self._finish(md5)
+        return self.file_path
+
+    def _download_stream(self, res):
+        """服务端不支持Range时，单连接顺序下载并同时计算MD5"""
+        md5 = hashlib.md5()
+        self._remove(self.map_path)
+        with res, open(self.part_path, "wb") as f:
+            length = res.headers.get("Content-Length")
+            if self.size is None and length is not None:
+                self.size = int(length)
+            self._downloaded = 0
+            for chunk in res.iter_content(READ_SIZE):
+                f.write(chunk)
+                md5.update(chunk)
+                self._report(len(chunk))
+        self._finish(md5)
+        return self.file_path
+
+    def _fetch(self, fd, index):
+        """下载一个分段，失败时退避后重试，链接过期时重新获取链接"""
+        start = index * self.segment_size
+        end = start + self._segment_length(index) - 1
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(min(2 ** (attempt - 1), 10))
+            received = 0
+            try:
+                with self._get({"Range": "bytes=%d-%d" % (start, end)}) as res:
+                    content_range = res.headers.get("Content-Range", "")
+                    if res.status_code != 206 or not content_range.startswith("bytes %d-%d/" % (start, end)):
+                        error = "HTTP %d %s" % (res.status_code, content_range)
+                        continue
+                    for chunk in res.iter_content(READ_SIZE):
+                        if received + len(chunk) > end - start + 1:
+                            raise DownloadError("分段数据超出范围")
+                        self._write_at(fd, chunk, start + received)
+                        received += len(chunk)
+                        self._report(len(chunk))
+                if received == end - start + 1:
+                    return
+                error = "数据不完整"
+            except (requests.RequestException, DownloadError) as e:
+                error = e
+            # 本次尝试收到的数据不计入进度，重试时重新下载
+            self._report(-received)
+        raise DownloadError("分段%d下载失败（已重试%d次）: %s" % (index, self.max_retries, error))
+
+    def _get(self, headers):
+        url = self.url()
+        res = http_transport.get(url, headers=headers, stream=True, timeout=self.timeout)
+        if res.status_code in EXPIRED_STATUS:
+            res.close()
+            res = http_transport.get(self.url(stale=url), headers=headers, stream=True, timeout=self.timeout)
+        return res
+
+    def _segment_length(self, index):
+        return min(self.segment_size, self.size - index * self.segment_size)
+
+    def _write_at(self, fd, data, offset):
+        if hasattr(os, "pwrite"):
+            os.pwrite(fd, data, offset)
+            return
+        with self._io_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            os.write(fd, data)
+
+    def _read_at(self, fd, length, offset):
+        if hasattr(os, "pread"):
+            return os.pread(fd, length, offset)
+        with self._io_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            return os.read(fd, length)
+
+    def _hash_segment(self, fd, index, md5):
+        offset = index * self.segment_size
+        end = offset + self._segment_length(index)
+        while offset < end:
+            data = self._read_at(fd, min(READ_SIZE, end - offset), offset)
+            if not data:
+                raise DownloadError("临时文件不完整")
+            md5.update(data)
+            offset += len(data)
+
+    def _preallocate(self):
+        """创建与文件等大的临时文件，支持时直接分配磁盘空间"""
+        with open(self.part_path, "wb") as f:
+            if self.size and hasattr(os, "posix_fallocate"):
+                try:
+                    os.posix_fallocate(f.fileno(), 0, self.size)
+                    return
+                except OSError:
+                    pass
+            f.truncate(self.size)
+
+    def _load_map(self):
+        """返回可续传的已完成分段，分段映射与本次下载不匹配或临时文件不完整时返回None"""
+        try:
+            with open(self.map_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if os.path.getsize(self.part_path) != self.size:
+                return None
+        except (OSError, ValueError):
+            return None
+        if (state.get("size"), state.get("etag"), state.get("segment_size")) != \
+                (self.size, self.etag, self.segment_size):
+            return None
+        return set(state.get("done", []))
+
+    def _save_map(self, done):
+        # 先写临时文件再替换，中断时不会留下不完整的分段映射
+        state = {"size": self.size, "etag": self.etag, "segment_size": self.segment_size, "done": sorted(done)}
+        tmp_path = "%s.%d.tmp" % (self.map_path, os.getpid())
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.map_path)
+
+    def _finish(self, md5):
+        if self.etag is not None and md5.hexdigest() != self.etag:
+            self._remove(self.part_path)
+            self._remove(self.map_path)
+            raise DownloadError("MD5校验失败: %s != %s" % (md5.hexdigest(), self.etag))
+        os.replace(self.part_path, self.file_path)
+        self._remove(self.map_path)
+
+    def _report(self, size):
+        with self._progress_lock:
+            self._downloaded += size
+            if self._progress is not None:
+                self._progress(self._downloaded, self.size)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,59 @@
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class FileEntry:
+    """
+    目录列表中的一个条目
+
+    保留远程返回的原始数值（字节数、Etag、时间），大小只在展示时格式化，
+    过滤与统计直接使用整数，不再从"3.5GB"这样的字符串反解析。
+    """
+    id: int
+    name: str
+    is_folder: bool
+    size: int = 0
+    etag: str = ""
+    created_at: Optional[str] = None
+    updated_at: Optional[str] = None
+
+    @classmethod
+    def from_item(cls, item):
+        """由远程列表条目（FileId/FileName/Type/Size...）构造"""
+        return cls(
+            id=item["FileId"],
+            name=item["FileName"],
+            is_folder=item["Type"] == 1,
+            size=item.get("Size") or 0,
+            etag=item.get("Etag") or "",
+            created_at=item.get("CreateAt"),
+            updated_at=item.get("UpdateAt"),
+        )
+
+    def to_dict(self):
+        if self.is_folder:
+            return {
+                "id": str(self.id),
+                "name": self.name,
+                "updated_at": self.updated_at
+            }
+        return {
+            "id": str(self.id),
+            "name": self.name,
+            "size": self.size,
+            "etag": self.etag,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at
+        }
+
+
+def format_size(size):
+    """把字节数格式化为"3.5GB"形式，仅用于展示"""
+    if size > 1024 * 1024 * 1024:
+        return f"{size / (1024 * 1024 * 1024):.1f}GB"
+    elif size > 1024 * 1024:
+        return f"{size / (1024 * 1024):.1f}MB"
+    elif size > 1024:
+        return f"{size / 1024:.1f}KB"
+    return f"{size}B"
@@ -0,0 +1,84 @@
+import hashlib
+import mmap
+import os
+import sqlite3
+import threading
+import time
+
+
+def file_md5(file_path, block_size=64 * 1024, use_mmap=False):
+    """读取整个文件计算MD5，use_mmap为True时将文件映射到内存直接计算，不再逐块复制"""
+    md5 = hashlib.md5()
+    with open(file_path, "rb") as f:
+        if use_mmap and os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mm, "madvise"):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                md5.update(mm)
+            return md5.hexdigest()
+        while True:
+            data = f.read(block_size)
+            if not data:
+                break
+            md5.update(data)
+    return md5.hexdigest()
+
+
+class HashCache:
+    """
+    本地文件MD5缓存
+
+    按 (路径, 大小, 修改时间, inode) 保存在SQLite中，文件未变化时直接返回上次的MD5，
+    不必重新读取整个文件；上传请求据此可由123pan按MD5秒传。
+    """
+
+    def __init__(self, db_path="hash_cache.db", use_mmap=False):
+        self.use_mmap = use_mmap
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS hashes (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    inode INTEGER NOT NULL,
+                    md5 TEXT NOT NULL,
+                    hashed_at REAL NOT NULL
+                )
+            """)
+
+    def get(self, file_path):
+        """文件自上次计算后未变化时返回缓存的MD5，否则返回None"""
+        stat = os.stat(file_path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT md5 FROM hashes WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ?",
+                (self._key(file_path), stat.st_size, stat.st_mtime_ns, stat.st_ino)
+            ).fetchone()
+        return row[0] if row else None
+
+    def md5(self, file_path):
+        """返回文件的MD5，缓存未命中时计算并写入缓存"""
+        cached = self.get(file_path)
+        if cached is not None:
+            return cached
+        before = os.stat(file_path)
+        md5 = file_md5(file_path, use_mmap=self.use_mmap)
+        after = os.stat(file_path)
+        # 计算期间文件被修改时不写入缓存
+        if (before.st_size, before.st_mtime_ns, before.st_ino) == (after.st_size, after.st_mtime_ns, after.st_ino):
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO hashes (path, size, mtime_ns, inode, md5, hashed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (self._key(file_path), after.st_size, after.st_mtime_ns, after.st_ino, md5, time.time())
+                )
+        return md5
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM hashes")
+
+    @staticmethod
+    def _key(file_path):
+        return os.path.abspath(file_path)
@@ -0,0 +1,119 @@
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 所有访问123pan的请求共用一个连接池会话，复用TCP/TLS连接
+_session = None
+_session_lock = threading.Lock()
+
+# 请求计时回调，hook(method, url, status_code, elapsed)，请求异常时status_code为None
+_timing_hooks = []
+
+# 按接口路径汇总的计时统计
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def configure(pool_connections=10, pool_maxsize=32, max_retries=0):
+    """
+    创建（或重建）共享的连接池会话
+
+    参数:
+        pool_connections: 缓存连接池的主机数
+        pool_maxsize: 每个主机保持的最大连接数，应不小于并发请求的线程数
+        max_retries: 连接建立失败时的重试次数
+    """
+    global _session
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        max_retries=max_retries,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    # 与单独调用requests.get/post一致，不在请求之间保存Cookie
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    with _session_lock:
+        old_session, _session = _session, session
+    if old_session is not None:
+        old_session.close()
+    return session
+
+
+def get_session():
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                configure()
+    return _session
+
+
+def add_timing_hook(hook):
+    """注册请求计时回调"""
+    _timing_hooks.append(hook)
+
+
+def remove_timing_hook(hook):
+    if hook in _timing_hooks:
+        _timing_hooks.remove(hook)
+
+
+def get_stats():
+    """
+    返回按接口路径汇总的请求计时
+
+    返回:
+        {"/b/api/file/list/new": {"count": 3, "errors": 0, "total": 0.42, "max": 0.2}, ...}
+    """
+    with _stats_lock:
+        return {path: dict(stat) for path, stat in _stats.items()}
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def _record(method, url, status_code, elapsed):
+    path = urlsplit(url).path
+    with _stats_lock:
+        stat = _stats.setdefault(path, {"count": 0, "errors": 0, "total": 0.0, "max": 0.0})
+        stat["count"] += 1
+        if status_code is None or status_code >= 400:
+            stat["errors"] += 1
+        stat["total"] += elapsed
+        stat["max"] = max(stat["max"], elapsed)
+    for hook in _timing_hooks:
+        try:
+            hook(method, url, status_code, elapsed)
+        except Exception as e:
+            print(f"计时回调出错: {e}")
+
+
+def request(method, url, **kwargs):
+    """通过共享会话发送请求，参数与requests.request相同"""
+    start = time.perf_counter()
+    try:
+        response = get_session().request(method, url, **kwargs)
+    except Exception:
+        _record(method, url, None, time.perf_counter() - start)
+        raise
+    _record(method, url, response.status_code, time.perf_counter() - start)
+    return response
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def put(url, **kwargs):
+    return request("PUT", url, **kwargs)
@@ -0,0 +1,128 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    """一个后台任务的状态，status依次为 queued -> running -> succeeded / failed"""
+
+    def __init__(self, job_type, name=""):
+        self.id = uuid.uuid4().hex
+        self.type = job_type
+        self.name = name
+        self.status = "queued"
+        self.progress = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.version = 0  # 每次状态或进度变化加一，用于等待更新
+
+    @property
+    def finished(self):
+        return self.status in ("succeeded", "failed")
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "type": self.type,
+            "name": self.name,
+            "status": self.status,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """
+    进程内的后台任务队列
+
+    每种任务类型一个有界线程池，提交后立即返回Job，调用方通过snapshot()查询状态，
+    或用wait()等待下一次进度变化。已结束的任务保留keep_finished秒后丢弃。
+    """
+
+    def __init__(self, limits=None, default_limit=2, keep_finished=3600):
+        """
+        参数:
+            limits: {任务类型: 同时运行的任务数}
+            default_limit: 未在limits中列出的任务类型同时运行的任务数
+            keep_finished: 已结束的任务保留的秒数
+        """
+        self.limits = dict(limits or {})
+        self.default_limit = default_limit
+        self.keep_finished = keep_finished
+        self._jobs = {}
+        self._pools = {}
+        self._changed = threading.Condition()
+
+    def submit(self, job_type, func, *args, name="", **kwargs):
+        """
+        提交任务，在job_type对应的线程池中调用 func(*args, progress=回调, **kwargs)
+
+        func返回含"error"键的字典或抛出异常时任务失败，否则返回值作为任务结果；
+        progress回调的参数作为任务当前进度。
+        """
+        job = Job(job_type, name)
+        with self._changed:
+            self._prune()
+            self._jobs[job.id] = job
+            pool = self._pools.get(job_type)
+            if pool is None:
+                pool = ThreadPoolExecutor(max_workers=self.limits.get(job_type, self.default_limit),
+                                          thread_name_prefix="job-" + job_type)
+                self._pools[job_type] = pool
+        pool.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._changed:
+            return self._jobs.get(job_id)
+
+    def snapshot(self, job_id):
+        """返回 (version, 任务状态字典)，任务不存在时返回None；状态与version在同一时刻读取"""
+        with self._changed:
+            job = self._jobs.get(job_id)
+            return (job.version, job.to_dict()) if job is not None else None
+
+    def wait(self, job_id, version, timeout=None):
+        """等待任务的version不再等于传入的值（或超时），返回snapshot()"""
+        with self._changed:
+            self._changed.wait_for(
+                lambda: job_id not in self._jobs or self._jobs[job_id].version != version,
+                timeout
+            )
+            return self.snapshot(job_id)
+
+    def shutdown(self, wait=True):
+        for pool in self._pools.values():
+            pool.shutdown(wait=wait)
+
+    def _run(self, job, func, args, kwargs):
+        self._update(job, status="running", started_at=time.time())
+        try:
+            result = func(*args, progress=lambda progress: self._update(job, progress=progress), **kwargs)
+        except Exception as e:
+            self._update(job, status="failed", error=str(e), finished_at=time.time())
+            return
+        if isinstance(result, dict) and "error" in result:
+            self._update(job, status="failed", error=result["error"], result=result, finished_at=time.time())
+        else:
+            self._update(job, status="succeeded", result=result, finished_at=time.time())
+
+    def _update(self, job, **fields):
+        with self._changed:
+            for key, value in fields.items():
+                setattr(job, key, value)
+            job.version += 1
+            self._changed.notify_all()
+
+    def _prune(self):
+        expire = time.time() - self.keep_finished
+        for job_id in [k for k, job in self._jobs.items() if job.finished and job.finished_at < expire]:
+            del self._jobs[job_id]
@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlsplit
+
+# 表示失效时间（Unix秒）的签名参数，按顺序取第一个存在的
+EXPIRY_PARAMS = ("t", "expires", "Expires", "e", "deadline")
+
+
+def url_expiry(url):
+    """
+    从签名下载链接的参数推算失效时间（Unix秒），无法推算时返回None
+
+    支持S3签名（X-Amz-Date + X-Amz-Expires）、以Unix秒表示失效时间的参数（t、expires、e等）
+    以及CDN鉴权参数auth_key（"失效时间-随机数-uid-签名"）。
+    """
+    params = parse_qs(urlsplit(url).query)
+
+    def first(name):
+        values = params.get(name)
+        return values[0] if values else None
+
+    amz_date, amz_expires = first("X-Amz-Date"), first("X-Amz-Expires")
+    if amz_date and amz_expires and amz_expires.isdigit():
+        try:
+            signed_at = datetime.strptime(amz_date, "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+        except ValueError:
+            return None
+        return signed_at.timestamp() + int(amz_expires)
+
+    candidates = [first(name) for name in EXPIRY_PARAMS]
+    auth_key = first("auth_key")
+    if auth_key:
+        candidates.append(auth_key.split("-", 1)[0])
+    for value in candidates:
+        # 只接受10位的Unix秒，避免把其他用途的同名参数当作时间
+        if value and value.isdigit() and len(value) == 10:
+            return int(value)
+    return None
+
+
+class LinkCache:
+    """
+    下载链接缓存
+
+    按 (FileId, Etag) 缓存解析出的下载地址，文件内容变化后Etag不同，自然不会命中旧链接。
+    有效期取自链接签名参数中的失效时间并提前margin秒过期；无法推算或推算结果早于当前时间时
+    使用default_ttl。超过max_entries时淘汰最久未使用的条目。
+    """
+
+    def __init__(self, default_ttl=300, margin=60, max_entries=10000):
+        self.default_ttl = default_ttl
+        self.margin = margin
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (file_id, etag) -> (url, expire_at)
+        self._lock = threading.Lock()
+
+    def get(self, file_id, etag):
+        """返回仍然有效的缓存链接，未命中或已过期时返回None"""
+        key = (file_id, etag)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            url, expire_at = entry
+            if expire_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return url
+
+    def put(self, file_id, etag, url):
+        now = time.time()
+        expire_at = url_expiry(url)
+        if expire_at is None or expire_at <= now:
+            # 参数不是失效时间（例如签发时间）时按默认有效期缓存
+            expire_at = now + self.default_ttl
+        else:
+            expire_at -= self.margin
+        with self._lock:
+            self._entries[(file_id, etag)] = (url, expire_at)
+            self._entries.move_to_end((file_id, etag))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, file_id):
+        """删除某个文件的全部缓存链接，例如文件被删除后"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == file_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
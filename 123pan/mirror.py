@@ -0,0 +1,260 @@
+import sqlite3
+import threading
+import time
+
+
+class MetadataMirror:
+    """
+    远程目录树的本地元数据镜像
+
+    文件信息保存在SQLite中，后台线程列出尚未同步（新发现或被标记为脏）的目录，
+    并只重新列出最近被查询过且已过期的目录，只把差异写回数据库；长期无人查询的目录
+    不再定期请求。目录只有在sync_interval的两倍时间内同步过才会被用来回答查询，
+    否则查询返回None，由调用方回退到实时请求，该目录随后被重新同步。
+    """
+
+    def __init__(self, db_path, fetch_dir, sync_interval=600, poll_interval=5, active_period=3600,
+                 max_refresh=50):
+        """
+        参数:
+            db_path: SQLite数据库文件路径
+            fetch_dir: 列目录函数，fetch_dir(parent_id) -> (code, 文件列表)
+            sync_interval: 目录同步后多少秒视为过期
+            poll_interval: 后台线程检查过期目录的间隔秒数
+            active_period: 目录在最近多少秒内被查询过时，过期后才重新列出
+            max_refresh: 每轮同步最多列出的目录数
+        """
+        self.fetch_dir = fetch_dir
+        self.sync_interval = sync_interval
+        self.poll_interval = poll_interval
+        self.active_period = active_period
+        self.max_refresh = max_refresh
+        self._read_at = {}  # folder_id -> 最近一次被查询的时间
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        with self._lock, self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS files (
+                    file_id INTEGER PRIMARY KEY,
+                    parent_id INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    type INTEGER NOT NULL,
+                    size INTEGER NOT NULL DEFAULT 0,
+                    etag TEXT,
+                    created_at TEXT,
+                    updated_at TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_files_parent_name ON files (parent_id, name);
+                CREATE TABLE IF NOT EXISTS folders (
+                    folder_id INTEGER PRIMARY KEY,
+                    synced_at REAL NOT NULL
+                );
+            """)
+
+    def start(self):
+        """启动后台同步线程"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="metadata-mirror", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sync_once()
+            except Exception as e:
+                print(f"镜像同步失败: {e}")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def sync_once(self, root_id=0, progress=None):
+        """
+        列出尚未同步的目录与最近被查询过且已过期的目录，最多max_refresh个
+
+        新列出的目录中的子目录在同一轮内继续同步。
+        progress({"folders": 已处理目录数, "refreshed": 重新列出的目录数})在每个目录处理后调用；
+        返回重新列出的目录数
+        """
+        attempted = set()
+        refreshed = 0
+        while len(attempted) < self.max_refresh and not self._stop.is_set():
+            candidates = [i for i in self._refresh_candidates(root_id) if i not in attempted]
+            if not candidates:
+                break
+            for folder_id in candidates[:self.max_refresh - len(attempted)]:
+                if self._stop.is_set():
+                    break
+                attempted.add(folder_id)
+                code, items = self.fetch_dir(folder_id)
+                if code == 0:
+                    self.apply_listing(folder_id, items)
+                    refreshed += 1
+                if progress is not None:
+                    progress({"folders": len(attempted), "refreshed": refreshed})
+        return refreshed
+
+    def _refresh_candidates(self, root_id):
+        """需要列出的目录：最近被查询且未同步或已过期的目录（按查询时间从近到远），其余未同步的目录"""
+        now = time.time()
+        with self._lock:
+            for folder_id in [k for k, t in self._read_at.items() if t + self.active_period <= now]:
+                del self._read_at[folder_id]
+            synced = dict(self._conn.execute("SELECT folder_id, synced_at FROM folders"))
+            active = [
+                folder_id for folder_id, _ in sorted(self._read_at.items(), key=lambda x: x[1], reverse=True)
+                if synced.get(folder_id, 0) + self.sync_interval <= now
+            ]
+            unsynced = [
+                row[0] for row in self._conn.execute("""
+                    SELECT files.file_id FROM files LEFT JOIN folders ON folders.folder_id = files.file_id
+                    WHERE files.type = 1 AND folders.folder_id IS NULL
+                """)
+                if row[0] not in self._read_at
+            ]
+        if root_id not in synced and root_id not in active:
+            unsynced.insert(0, root_id)
+        return active + unsynced
+
+    def apply_listing(self, folder_id, items):
+        """把一次完整的目录列表写入镜像，只更新有变化的行并删除已不存在的条目"""
+        rows = [
+            (
+                item["FileId"],
+                folder_id,
+                item["FileName"],
+                item["Type"],
+                item.get("Size", 0),
+                item.get("Etag", ""),
+                item.get("CreateAt"),
+                item.get("UpdateAt"),
+            )
+            for item in items
+        ]
+        with self._lock, self._conn:
+            existing = {
+                row[0] for row in self._conn.execute(
+                    "SELECT file_id FROM files WHERE parent_id = ?", (folder_id,)
+                )
+            }
+            self._conn.executemany("""
+                INSERT INTO files (file_id, parent_id, name, type, size, etag, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (file_id) DO UPDATE SET
+                    parent_id = excluded.parent_id, name = excluded.name, type = excluded.type,
+                    size = excluded.size, etag = excluded.etag,
+                    created_at = excluded.created_at, updated_at = excluded.updated_at
+                WHERE files.parent_id IS NOT excluded.parent_id OR files.name IS NOT excluded.name
+                    OR files.size IS NOT excluded.size OR files.etag IS NOT excluded.etag
+                    OR files.updated_at IS NOT excluded.updated_at
+            """, rows)
+            for file_id in existing - {row[0] for row in rows}:
+                self._delete_tree(file_id)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO folders (folder_id, synced_at) VALUES (?, ?)",
+                (folder_id, time.time())
+            )
+
+    def mark_dirty(self, folder_id):
+        """目录内容在本地被修改，在重新同步之前不再用它回答查询"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM folders WHERE folder_id = ?", (folder_id,))
+        self._wake.set()
+
+    def remove(self, file_id):
+        """删除文件或文件夹（含所有子项）的镜像记录"""
+        with self._lock, self._conn:
+            self._delete_tree(file_id)
+
+    def clear(self):
+        """清空镜像，例如切换账号后"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM files")
+            self._conn.execute("DELETE FROM folders")
+        self._wake.set()
+
+    def resolve(self, path, root_id=0):
+        """
+        根据路径在镜像中查找文件信息
+
+        返回:
+            文件信息；路径不存在时返回{}；路径上有目录尚未同步时返回None
+        """
+        parts = path.strip("/").split("/")
+        current_id = root_id
+        item = None
+        with self._lock:
+            for part in parts:
+                self._read_at[current_id] = time.time()
+                if not self._is_synced(current_id):
+                    return None
+                row = self._conn.execute(
+                    "SELECT * FROM files WHERE parent_id = ? AND name = ? ORDER BY file_id DESC LIMIT 1",
+                    (current_id, part)
+                ).fetchone()
+                if row is None:
+                    return {}
+                item = self._to_item(row)
+                current_id = item["FileId"]
+        return item
+
+    def list_dir(self, folder_id):
+        """列出镜像中的目录内容，目录尚未同步时返回None"""
+        with self._lock:
+            self._read_at[folder_id] = time.time()
+            if not self._is_synced(folder_id):
+                return None
+            rows = self._conn.execute(
+                "SELECT * FROM files WHERE parent_id = ? ORDER BY file_id DESC", (folder_id,)
+            ).fetchall()
+        return [self._to_item(row) for row in rows]
+
+    def synced_at(self, folder_id):
+        """目录的同步时间，可作为目录内容的版本号；目录不能用来回答查询时返回None"""
+        with self._lock:
+            if not self._is_synced(folder_id):
+                return None
+            return self._conn.execute(
+                "SELECT synced_at FROM folders WHERE folder_id = ?", (folder_id,)
+            ).fetchone()[0]
+
+    def _is_synced(self, folder_id):
+        # 长期无人查询的目录不再定期同步，过旧时不用来回答查询
+        row = self._conn.execute(
+            "SELECT synced_at FROM folders WHERE folder_id = ?", (folder_id,)
+        ).fetchone()
+        return row is not None and row[0] + 2 * self.sync_interval > time.time()
+
+    def _delete_tree(self, file_id):
+        ids = [
+            row[0] for row in self._conn.execute("""
+                WITH RECURSIVE tree (id) AS (
+                    SELECT ?
+                    UNION ALL
+                    SELECT files.file_id FROM files JOIN tree ON files.parent_id = tree.id
+                )
+                SELECT id FROM tree
+            """, (file_id,))
+        ]
+        self._conn.executemany("DELETE FROM files WHERE file_id = ?", [(i,) for i in ids])
+        self._conn.executemany("DELETE FROM folders WHERE folder_id = ?", [(i,) for i in ids])
+
+    @staticmethod
+    def _to_item(row):
+        # 与远程列表条目使用相同的字段名
+        return {
+            "FileId": row[0],
+            "ParentFileId": row[1],
+            "FileName": row[2],
+            "Type": row[3],
+            "Size": row[4],
+            "Etag": row[5],
+            "CreateAt": row[6],
+            "UpdateAt": row[7],
+        }
@@ -1,12 +1,38 @@
-import hashlib
 import json
 import os
 import re
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import uuid
 import requests
 
+import http_transport
+from downloader import DownloadError, RangedDownload
+from hash_cache import HashCache
+from uploader import MultipartUpload, ThroughputMeter, UploadError, UploadSessionStore, choose_part_size
+
+
+# 目录分页线程池与本地MD5缓存在所有Pan123实例间共享，重新登录创建新实例时不会再创建一份
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def _shared_resource(key, factory):
+    with _shared_lock:
+        if key not in _shared:
+            _shared[key] = factory()
+        return _shared[key]
+
+
+class DirListError(Exception):
+    """获取目录分页失败，code为123pan返回的错误码（连接失败时为-1）"""
+
+    def __init__(self, code):
+        super().__init__("获取目录列表失败: " + str(code))
+        self.code = code
 
 
 class Pan123:
@@ -17,10 +43,16 @@ class Pan123:
             pass_word="",
             authorization="",
             input_pwd=True,
+            page_size=100,
+            dir_workers=4,
+            upload_workers=3,
+            upload_mmap=False,
+            download_workers=4,
     ):
         self.cookies = None
         self.recycle_list = None
         self.list = []
+        self._login_lock = threading.Lock()
         if readfile:
             self.read_ini(user_name, pass_word, input_pwd, authorization)
         else:
@@ -53,12 +85,28 @@ class Pan123:
         }
         self.parent_file_id = 0  # 路径，文件夹的id,0为根目录
         self.parent_file_list = [0]
+        self.page_size = page_size  # 目录列表每页请求的条数，服务端限制更小时自动跟随
+        self.dir_workers = dir_workers  # 并发获取目录分页的线程数
+        self._dir_pool = _shared_resource(("dir_pool", dir_workers),
+                                          lambda: ThreadPoolExecutor(max_workers=dir_workers))
+        self.upload_workers = upload_workers  # 并发上传的分片数
+        self.upload_sessions = UploadSessionStore("upload_sessions.json")  # 未完成的上传会话，用于续传
+        self.upload_throughput = ThroughputMeter()  # 最近分片的上传速度，用于选择之后上传的分片大小
+        self.upload_mmap = upload_mmap  # 上传时将文件映射到内存，计算MD5和上传分片不再逐块复制
+        self.download_workers = download_workers  # 并发下载的分段数
+        self.hash_cache = _shared_resource(("hash_cache", upload_mmap),
+                                           lambda: HashCache("hash_cache.db", use_mmap=upload_mmap))  # 本地文件MD5缓存，文件未变化时不重新计算
         res_code_getdir = self.get_dir()
         if res_code_getdir != 0:
             self.login()
             self.get_dir()
 
     def login(self, max_retries=3):
+        # 多个线程共享同一个会话，刷新令牌时串行执行
+        with self._login_lock:
+            return self._login(max_retries)
+
+    def _login(self, max_retries):
         data = {"type": 1, "passport": self.user_name, "password": self.password}
         url = "https://www.123pan.com/b/api/user/sign_in"
         headers = {
@@ -70,7 +118,7 @@ class Pan123:
         retry_count = 0
         while retry_count < max_retries:
             try:
-                login_res = requests.post(
+                login_res = http_transport.post(
                     url,
                     headers=headers,
                     data=data,
@@ -123,7 +171,9 @@ class Pan123:
         return -1  # 所有重试失败后返回 -1
 
     def save_file(self):
-        with open("123pan.txt", "w", encoding="utf_8") as f:
+        # 先写临时文件再替换，避免多个进程同时保存时读到不完整的内容
+        tmp_path = "123pan.txt.%d.tmp" % os.getpid()
+        with open(tmp_path, "w", encoding="utf_8") as f:
             save_list = {
                 "userName": self.user_name,
                 "passWord": self.password,
@@ -131,57 +181,107 @@ class Pan123:
             }
 
             f.write(json.dumps(save_list))
+        os.replace(tmp_path, "123pan.txt")
 
     def get_dir(self):
-        res_code_getdir = 0
-        page = 1
+        res_code_getdir, lists = self.fetch_dir(self.parent_file_id)
+        if res_code_getdir != 0:
+            return res_code_getdir
+        self.list = lists
+        return res_code_getdir
+
+    def fetch_dir(self, parent_file_id):
         lists = []
-        lenth_now = 0
-        total = -1
-        while lenth_now < total or total == -1:
-            base_url = "https://www.123pan.com/b/api/file/list/new"
-            # print(self.headerLogined)
-            # sign = getSign("/b/api/file/list/new")
-            # print(sign)
-            params = {
-                # sign[0]: sign[1],
-                "driveId": 0,
-                "limit": 100,
-                "next": 0,
-                "orderBy": "file_id",
-                "orderDirection": "desc",
-                "parentFileId": str(self.parent_file_id),
-                "trashed": False,
-                "SearchData": "",
-                "Page": str(page),
-                "OnlyLookAbnormalFile": 0,
-            }
-            try:
-                a = requests.get(base_url, headers=self.header_logined, params=params, timeout=10)  # , verify=False)
-            except:
-                print("连接失败")
-                return -1
-            # print(a.text)
-            # print(a.headers)
-            text = a.json()
-            res_code_getdir = text["code"]
-            if res_code_getdir != 0:
-                #print(a.text)
-                #print(a.headers)
-                print("code = 2 Error:" + str(res_code_getdir))
-                return res_code_getdir
-            lists_page = text["data"]["InfoList"]
-            lists += lists_page
-            total = text["data"]["Total"]
-            lenth_now += len(lists_page)
-            page += 1
+        try:
+            for lists_page in self.iter_dir(parent_file_id):
+                lists += lists_page
+        except DirListError as e:
+            return e.code, []
+
         file_num = 0
         for i in lists:
             i["FileNum"] = file_num
             file_num += 1
+        return 0, lists
 
-        self.list = lists
-        return res_code_getdir
+    def iter_dir(self, parent_file_id):
+        # 按页码顺序逐页产出目录条目。先取第一页得到Total，其余分页在线程池中并发预取，
+        # 预取窗口有上限，调用方消费得慢时不会在内存中堆积分页
+        res_code_getdir, data = self._get_dir_page(parent_file_id, 1, self.page_size)
+        if res_code_getdir != 0:
+            raise DirListError(res_code_getdir)
+        total = data["Total"]
+        count = len(data["InfoList"])
+        yield data["InfoList"]
+
+        # 服务端实际返回的条数小于请求的条数时，以实际条数作为分页大小
+        limit = self.page_size
+        if 0 < count < min(limit, total):
+            limit = count
+        page_count = -(-total // limit)
+
+        window = deque()
+        next_page = 2
+        try:
+            while next_page <= page_count or window:
+                while next_page <= page_count and len(window) < self.dir_workers * 2:
+                    window.append(self._dir_pool.submit(self._get_dir_page, parent_file_id, next_page, limit))
+                    next_page += 1
+                res_code_getdir, data = window.popleft().result()
+                if res_code_getdir != 0:
+                    raise DirListError(res_code_getdir)
+                count += len(data["InfoList"])
+                yield data["InfoList"]
+        finally:
+            for future in window:
+                future.cancel()
+
+        # 获取期间目录有新增时，顺序补齐剩余分页
+        page = page_count + 1
+        while count < total:
+            res_code_getdir, data = self._get_dir_page(parent_file_id, page, limit)
+            if res_code_getdir != 0:
+                raise DirListError(res_code_getdir)
+            if not data["InfoList"]:
+                break
+            count += len(data["InfoList"])
+            total = data["Total"]
+            yield data["InfoList"]
+            page += 1
+
+    def fetch_dir_page(self, parent_file_id, page, limit):
+        # 只获取目录的某一页，返回 (code, 本页条目, 目录总条数)
+        res_code_getdir, data = self._get_dir_page(parent_file_id, page, limit)
+        if res_code_getdir != 0:
+            return res_code_getdir, [], 0
+        return res_code_getdir, data["InfoList"], data["Total"]
+
+    def _get_dir_page(self, parent_file_id, page, limit):
+        base_url = "https://www.123pan.com/b/api/file/list/new"
+        # sign = getSign("/b/api/file/list/new")
+        params = {
+            # sign[0]: sign[1],
+            "driveId": 0,
+            "limit": limit,
+            "next": 0,
+            "orderBy": "file_id",
+            "orderDirection": "desc",
+            "parentFileId": str(parent_file_id),
+            "trashed": False,
+            "SearchData": "",
+            "Page": str(page),
+            "OnlyLookAbnormalFile": 0,
+        }
+        try:
+            a = http_transport.get(base_url, headers=self.header_logined, params=params, timeout=10)  # , verify=False)
+            text = a.json()
+        except Exception:
+            print("连接失败")
+            return -1, None
+        res_code_getdir = text["code"]
+        if res_code_getdir != 0:
+            print("code = 2 Error:" + str(res_code_getdir))
+        return res_code_getdir, text.get("data")
 
     def show(self):
         for i in self.list:
@@ -194,7 +294,9 @@ class Pan123:
 
     # fileNumber 从0开始，0为第一个文件，传入时需要减一 ！！！
     def link(self, file_number, showlink=True):
-        file_detail = self.list[file_number]
+        return self.link_detail(self.list[file_number], showlink)
+
+    def link_detail(self, file_detail, showlink=True):
         type_detail = file_detail["Type"]
         if type_detail == 1:
             down_request_url = "https://www.123pan.com/a/api/file/batch_download_info"
@@ -215,7 +317,7 @@ class Pan123:
 
         # sign = getSign("/a/api/file/download_info")
 
-        link_res = requests.post(
+        link_res = http_transport.post(
             down_request_url,
             headers=self.header_logined,
             # params={sign[0]: sign[1]},
@@ -229,7 +331,7 @@ class Pan123:
             # print(linkRes.json())
             return res_code_download
         down_load_url = link_res.json()["data"]["DownloadUrl"]
-        next_to_get = requests.get(down_load_url, timeout=10, allow_redirects=False).text
+        next_to_get = http_transport.get(down_load_url, timeout=10, allow_redirects=False).text
         url_pattern = re.compile(r"href='(https?://[^']+)'")
         redirect_url = url_pattern.findall(next_to_get)[0]
         if showlink:
@@ -237,14 +339,17 @@ class Pan123:
 
         return redirect_url
 
-    def download(self, file_number,download_path="download/"):
+    def download(self, file_number, download_path="download/", workers=None):
+        # workers为None时使用download_workers；中断后再次下载同一文件会从已完成的分段继续
         file_detail = self.list[file_number]
         if file_detail["Type"] == 1:
             print("打包下载")
             file_name = file_detail["FileName"] + ".zip"
+            # 打包下载的大小与MD5在服务端生成压缩包后才能确定
+            size, etag = None, None
         else:
             file_name = file_detail["FileName"]  # 文件名
-        down_load_url = self.link(file_number, showlink=False)
+            size, etag = file_detail["Size"], file_detail["Etag"]
 
         if os.path.exists(download_path+file_name):
             print("文件 " + file_name + " 已存在，是否要覆盖？")
@@ -255,53 +360,45 @@ class Pan123:
         if not os.path.exists(download_path):
             print("文件夹不存在，创建文件夹")
             os.makedirs(download_path)
-        down = requests.get(down_load_url, stream=True, timeout=10)
 
-        file_size = int(down.headers["Content-Length"])  # 文件大小
-        content_size = int(file_size)  # 文件总大小
-        data_count = 0  # 当前已传输的大小
-        if file_size > 1048576:
-            size_print_download = str(round(file_size / 1048576, 2)) + "M"
+        if size is not None:
+            print(file_name + "    " + self._format_size(size))
         else:
-            size_print_download = str(round(file_size / 1024, 2)) + "K"
-        print(file_name + "    " + size_print_download)
-        time1 = time.time()
-        time_temp = time1
-        data_count_temp = 0
-        with open(download_path+file_name, "wb") as f:
-            for i in down.iter_content(1024):
-                f.write(i)
-                done_block = int((data_count / content_size) * 50)
-                data_count = data_count + len(i)
-                # 实时进度条进度
-                now_jd = (data_count / content_size) * 100
-                # %% 表示%
-                # 测速
-                time1 = time.time()
-                pass_time = time1 - time_temp
-                if pass_time > 1:
-                    time_temp = time1
-                    pass_data = int(data_count) - int(data_count_temp)
-                    data_count_temp = data_count
-                    speed = pass_data / int(pass_time)
-                    speed_m = speed / 1048576
-                    if speed_m > 1:
-                        speed_print = str(round(speed_m, 2)) + "M/S"
-                    else:
-                        speed_print = str(round(speed_m * 1024, 2)) + "K/S"
-                    print(
-                        "\r [%s%s] %d%%  %s"
-                        % (
-                            done_block * "█",
-                            " " * (50 - 1 - done_block),
-                            now_jd,
-                            speed_print,
-                        ),
-                        end="",
-                    )
-                elif data_count == content_size:
-                    print("\r [%s%s] %d%%  %s" % (50 * "█", "", 100, ""), end="")
-            print("\nok")
+            print(file_name)
+        task = RangedDownload(
+            lambda: self.link_detail(file_detail, showlink=False),
+            download_path + file_name,
+            size=size,
+            etag=etag,
+            workers=workers or self.download_workers,
+        )
+        speed = {"time": time.time(), "count": 0, "print": ""}
+
+        def progress(data_count, content_size):
+            # 每秒更新一次速度
+            now = time.time()
+            if now - speed["time"] > 1:
+                speed["print"] = self._format_size((data_count - speed["count"]) / (now - speed["time"])) + "/S"
+                speed["time"], speed["count"] = now, data_count
+            if not content_size:
+                print("\r %s  %s" % (self._format_size(data_count), speed["print"]), end="")
+                return
+            done_block = int((data_count / content_size) * 50)
+            print("\r [%s%s] %d%%  %s" % (done_block * "█", " " * (50 - done_block), data_count * 100 // content_size,
+                                          speed["print"]), end="")
+
+        try:
+            task.run(progress)
+        except DownloadError as e:
+            print("\n下载失败: " + str(e))
+            return
+        print("\nok")
+
+    @staticmethod
+    def _format_size(size):
+        if size > 1048576:
+            return str(round(size / 1048576, 2)) + "M"
+        return str(round(size / 1024, 2)) + "K"
 
     def recycle(self):
         recycle_id = 0
@@ -311,7 +408,7 @@ class Pan123:
                 + str(recycle_id)
                 + "&trashed=true&&Page=1"
         )
-        recycle_res = requests.get(url, headers=self.header_logined, timeout=10)
+        recycle_res = http_transport.get(url, headers=self.header_logined, timeout=10)
         json_recycle = recycle_res.json()
         recycle_list = json_recycle["data"]["InfoList"]
         self.recycle_list = recycle_list
@@ -335,21 +432,25 @@ class Pan123:
             else:
                 print("文件不存在")
                 return
+        dele_json = self.trash_file(file_detail, operation)
+        print(dele_json)
+        message = dele_json["message"]
+        print(message)
+
+    def trash_file(self, file_detail, operation=True):
+        # 直接按文件信息删除/恢复，不依赖当前目录列表
         data_delete = {
             "driveId": 0,
             "fileTrashInfoList": file_detail,
             "operation": operation,
         }
-        delete_res = requests.post(
+        delete_res = http_transport.post(
             "https://www.123pan.com/a/api/file/trash",
             data=json.dumps(data_delete),
             headers=self.header_logined,
             timeout=10
         )
-        dele_json = delete_res.json()
-        print(dele_json)
-        message = dele_json["message"]
-        print(message)
+        return delete_res.json()
 
     def share(self):
         file_id_list = ""
@@ -381,7 +482,7 @@ class Pan123:
                 "sharePwd": share_pwd,
                 "event": "shareCreate"
             }
-            share_res = requests.post(
+            share_res = http_transport.post(
                 "https://www.123pan.com/a/api/share/create",
                 headers=self.header_logined,
                 data=json.dumps(data),
@@ -400,7 +501,13 @@ class Pan123:
         else:
             print("退出分享")
 
-    def up_load(self, file_path, file_name=None):
+    def up_load(self, file_path, file_name=None, parent_file_id=None, workers=None, md5=None, duplicate=None,
+                progress=None):
+        # parent_file_id为None时上传到当前目录，workers为None时使用upload_workers
+        # md5为调用方已计算好的文件MD5，为None时从缓存读取或计算
+        # duplicate为同名文件的处理方式（见request_upload），progress(已上传字节数, 文件大小)替代进度输出
+        if parent_file_id is None:
+            parent_file_id = self.parent_file_id
         file_path = file_path.replace('"', "")
         file_path = file_path.replace("\\", "/")
         if file_name is None:
@@ -413,27 +520,92 @@ class Pan123:
             print("暂不支持文件夹上传")
             return
         fsize = os.path.getsize(file_path)
-        with open(file_path, "rb") as f:
-            md5 = hashlib.md5()
-            while True:
-                data = f.read(64 * 1024)
-                if not data:
-                    break
-                md5.update(data)
-            readable_hash = md5.hexdigest()
+        if md5 is not None:
+            readable_hash = md5
+        else:
+            readable_hash = self.hash_cache.md5(file_path)
+        workers = workers or self.upload_workers
+
+        # 同一文件上传到同一文件夹的未完成会话，按原分片大小继续上传服务端尚未保存的分块
+        upload = None
+        resumable = True
+        entry = self.upload_sessions.get(readable_hash, parent_file_id)
+        if entry is not None:
+            upload = MultipartUpload(
+                self.header_logined,
+                entry["session"],
+                part_size=entry["part_size"],
+                workers=workers,
+                use_mmap=self.upload_mmap,
+                throughput=self.upload_throughput,
+            )
+            try:
+                done_parts = upload.completed_parts()
+                print("继续上次未完成的上传，已上传%d块" % len(done_parts))
+            except (UploadError, requests.RequestException, ValueError):
+                # 会话已失效，重新发起上传
+                self.upload_sessions.remove(readable_hash, parent_file_id)
+                upload = None
+
+        if upload is None:
+            session = self.request_upload(file_name, parent_file_id, fsize, readable_hash, duplicate=duplicate)
+            if session is None:
+                return
+            # 分片大小按文件大小和最近测得的上传速度选择
+            upload = MultipartUpload(
+                self.header_logined,
+                session,
+                part_size=choose_part_size(fsize, self.upload_throughput.rate, workers),
+                workers=workers,
+                use_mmap=self.upload_mmap,
+                throughput=self.upload_throughput,
+            )
+            if fsize <= upload.part_size:
+                # 只有一个分片的小文件：不保存续传会话，也不查询已上传的分块
+                resumable = False
+                done_parts = set()
+            else:
+                self.upload_sessions.save(readable_hash, parent_file_id, upload.session, upload.part_size)
+                # 获取已经上传的分块
+                done_parts = upload.completed_parts()
+        print("上传文件的fileId:", upload.file_id)  # 完成上传后需要用到
+
+        # 分块并发上传，跳过已上传的块，每上传一块记录一次进度
+        def show_progress(put_size, total):
+            print("\r已上传：" + str(round(put_size / total * 100, 2)) + "%", end="")
+
+        def save_part(part_number):
+            self.upload_sessions.add_part(readable_hash, parent_file_id, part_number)
+
+        try:
+            upload.upload_file(file_path, progress=progress or show_progress, skip=done_parts,
+                               on_part=save_part if resumable else None)
+        finally:
+            if resumable:
+                self.upload_sessions.flush()
+        print()
+
+        # 合并分块并报告完成上传，服务端处理完成前轮询
+        upload.complete()
+        if resumable:
+            self.upload_sessions.remove(readable_hash, parent_file_id)
+        print("上传成功")
 
+    def request_upload(self, file_name, parent_file_id, fsize, md5, duplicate=None):
+        # 发起上传请求，返回分块上传会话信息；MD5复用或取消上传时返回None
+        # duplicate为存在同名文件时的处理方式，1覆盖，2保留两者，为None时询问
         list_up_request = {
             "driveId": 0,
-            "etag": readable_hash,
+            "etag": md5,
             "fileName": file_name,
-            "parentFileId": self.parent_file_id,
+            "parentFileId": parent_file_id,
             "size": fsize,
             "type": 0,
             "duplicate": 0,
         }
 
         # sign = getSign("/b/api/file/upload_request")
-        up_res = requests.post(
+        up_res = http_transport.post(
             "https://www.123pan.com/b/api/file/upload_request",
             headers=self.header_logined,
             # params={sign[0]: sign[1]},
@@ -443,7 +615,10 @@ class Pan123:
         up_res_json = up_res.json()
         res_code_up = up_res_json["code"]
         if res_code_up == 5060:
-            sure_upload = input("检测到1个同名文件,输入1覆盖，2保留两者，0取消：")
+            if duplicate is not None:
+                sure_upload = str(duplicate)
+            else:
+                sure_upload = input("检测到1个同名文件,输入1覆盖，2保留两者，0取消：")
             if sure_upload == "1":
                 list_up_request["duplicate"] = 1
 
@@ -451,9 +626,9 @@ class Pan123:
                 list_up_request["duplicate"] = 2
             else:
                 print("取消上传")
-                return
+                return None
             # sign = getSign("/b/api/file/upload_request")
-            up_res = requests.post(
+            up_res = http_transport.post(
                 "https://www.123pan.com/b/api/file/upload_request",
                 headers=self.header_logined,
                 # params={sign[0]: sign[1]},
@@ -468,142 +643,12 @@ class Pan123:
             reuse = up_res_json["data"]["Reuse"]
             if reuse:
                 print("上传成功，文件已MD5复用")
-                return
+                return None
         else:
             print(up_res_json)
-            print("上传请求失败")
-            return
+            raise UploadError("上传请求失败: " + str(up_res_json.get("message")), res_code_up)
 
-        bucket = up_res_json["data"]["Bucket"]
-        storage_node = up_res_json["data"]["StorageNode"]
-        upload_key = up_res_json["data"]["Key"]
-        upload_id = up_res_json["data"]["UploadId"]
-        up_file_id = up_res_json["data"]["FileId"]  # 上传文件的fileId,完成上传后需要用到
-        print("上传文件的fileId:", up_file_id)
-
-        # 获取已将上传的分块
-        start_data = {
-            "bucket": bucket,
-            "key": upload_key,
-            "uploadId": upload_id,
-            "storageNode": storage_node,
-        }
-        start_res = requests.post(
-            "https://www.123pan.com/b/api/file/s3_list_upload_parts",
-            headers=self.header_logined,
-            data=json.dumps(start_data),
-            timeout=10
-        )
-        start_res_json = start_res.json()
-        res_code_up = start_res_json["code"]
-        if res_code_up == 0:
-            # print(startResJson)
-            pass
-        else:
-            print(start_data)
-            print(start_res_json)
-
-            print("获取传输列表失败")
-            return
-
-        # 分块，每一块取一次链接，依次上传
-        block_size = 5242880
-        with open(file_path, "rb") as f:
-            part_number_start = 1
-            put_size = 0
-            while True:
-                data = f.read(block_size)
-
-                precent = round(put_size / fsize, 2)
-                print("\r已上传：" + str(precent * 100) + "%", end="")
-                put_size = put_size + len(data)
-
-                if not data:
-                    break
-                get_link_data = {
-                    "bucket": bucket,
-                    "key": upload_key,
-                    "partNumberEnd": part_number_start + 1,
-                    "partNumberStart": part_number_start,
-                    "uploadId": upload_id,
-                    "StorageNode": storage_node,
-                }
-
-                get_link_url = (
-                    "https://www.123pan.com/b/api/file/s3_repare_upload_parts_batch"
-                )
-                get_link_res = requests.post(
-                    get_link_url,
-                    headers=self.header_logined,
-                    data=json.dumps(get_link_data),
-                    timeout=10
-                )
-                get_link_res_json = get_link_res.json()
-                res_code_up = get_link_res_json["code"]
-                if res_code_up == 0:
-                    # print("获取链接成功")
-                    pass
-                else:
-                    # print(getLinkResJson)
-                    return
-                # print(getLinkResJson)
-                upload_url = get_link_res_json["data"]["presignedUrls"][
-                    str(part_number_start)
-                ]
-                # print("上传链接",uploadUrl)
-                requests.put(upload_url, data=data, timeout=10)
-                # print("put")
-
-                part_number_start = part_number_start + 1
-
-        print()
-        # 完成标志
-        # 1.获取已上传的块
-        uploaded_list_url = "https://www.123pan.com/b/api/file/s3_list_upload_parts"
-        uploaded_comp_data = {
-            "bucket": bucket,
-            "key": upload_key,
-            "uploadId": upload_id,
-            "storageNode": storage_node,
-        }
-        # print(uploadedCompData)
-        requests.post(
-            uploaded_list_url,
-            headers=self.header_logined,
-            data=json.dumps(uploaded_comp_data),
-            timeout=10
-        )
-        compmultipart_up_url = (
-            "https://www.123pan.com/b/api/file/s3_complete_multipart_upload"
-        )
-        requests.post(
-            compmultipart_up_url,
-            headers=self.header_logined,
-            data=json.dumps(uploaded_comp_data),
-            timeout=10
-        )
-
-        # 3.报告完成上传，关闭upload session
-        if fsize > 64 * 1024 * 1024:
-            time.sleep(3)
-        close_up_session_url = "https://www.123pan.com/b/api/file/upload_complete"
-        close_up_session_data = {"fileId": up_file_id}
-        # print(closeUpSessionData)
-        close_up_session_res = requests.post(
-            close_up_session_url,
-            headers=self.header_logined,
-            data=json.dumps(close_up_session_data),
-            timeout=10
-        )
-        close_res_json = close_up_session_res.json()
-        # print(closeResJson)
-        res_code_up = close_res_json["code"]
-        if res_code_up == 0:
-            print("上传成功")
-        else:
-            print("上传失败")
-            print(close_res_json)
-            return
+        return up_res_json["data"]
 
     # dirId 就是 fileNumber，从0开始，0为第一个文件，传入时需要减一 ！！！（好像文件夹都排在前面）
     def cd(self, dir_num):
@@ -694,7 +739,7 @@ class Pan123:
             "operateType": 1,
         }
         # sign = getSign("/a/api/file/upload_request")
-        res_mk = requests.post(
+        res_mk = http_transport.post(
             url,
             headers=self.header_logined,
             data=json.dumps(data_mk),
@@ -790,7 +835,10 @@ if __name__ == "__main__":
                 print("输入错误")
         elif command == "upload":
             filepath = input("请输入文件路径：")
-            pan.up_load(filepath)
+            try:
+                pan.up_load(filepath)
+            except UploadError as e:
+                print(e)
             pan.get_dir()
             pan.show()
         elif command == "share":
@@ -0,0 +1,168 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class PathIndex:
+    """
+    路径解析索引
+
+    缓存 (parent_id, 名称) -> 文件信息，解析路径时命中的路径段无需再列目录。
+    条目带TTL过期，本地的新建、删除、上传操作会定向失效相关条目。条目数超过
+    max_entries时淘汰最久未使用的条目。
+    """
+
+    def __init__(self, ttl=300, max_entries=100000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (parent_id, name) -> (item, expire_at)，按使用顺序
+        self._children = {}  # parent_id -> {name, ...}
+        self._expiry = OrderedDict()  # parent_id -> 该目录列表的过期时间，按写入顺序即过期顺序
+        self._lock = threading.RLock()
+
+    def get(self, parent_id, name):
+        """查询某目录下指定名称的条目，未命中或已过期返回None"""
+        key = (parent_id, name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            item, expire_at = entry
+            if expire_at <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return item
+
+    def put_listing(self, parent_id, items):
+        """用一次完整的目录列表刷新该目录下的全部条目"""
+        now = time.time()
+        expire_at = now + self.ttl
+        with self._lock:
+            self._purge_expired(now)
+            self.invalidate(parent_id)
+            names = set()
+            for item in items:
+                name = item["FileName"]
+                # 同名条目保留列表中的第一个，与逐项查找的结果一致
+                if name in names:
+                    continue
+                names.add(name)
+                self._entries[(parent_id, name)] = (item, expire_at)
+            self._children[parent_id] = names
+            self._expiry[parent_id] = expire_at
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, parent_id, name=None):
+        """失效某目录下的指定条目，name为None时失效该目录下的全部条目"""
+        with self._lock:
+            if name is not None:
+                self._remove((parent_id, name))
+                return
+            self._expiry.pop(parent_id, None)
+            for child in self._children.pop(parent_id, set()):
+                self._entries.pop((parent_id, child), None)
+
+    def invalidate_tree(self, folder_id):
+        """失效某文件夹下所有层级的条目，用于文件夹被删除后"""
+        with self._lock:
+            pending = [folder_id]
+            while pending:
+                parent_id = pending.pop()
+                self._expiry.pop(parent_id, None)
+                for child in self._children.pop(parent_id, set()):
+                    entry = self._entries.pop((parent_id, child), None)
+                    if entry is not None and entry[0].get("Type") == 1:
+                        pending.append(entry[0]["FileId"])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._children.clear()
+            self._expiry.clear()
+
+    def _purge_expired(self, now):
+        # 同一目录的条目一起写入、一起过期，从最早写入的目录开始清除
+        while self._expiry:
+            parent_id, expire_at = next(iter(self._expiry.items()))
+            if expire_at > now:
+                break
+            self.invalidate(parent_id)
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        names = self._children.get(key[0])
+        if names is not None:
+            names.discard(key[1])
+
+
+class MissingPathCache:
+    """
+    不存在路径的短期缓存
+
+    记录解析失败的路径（截至第一个不存在的路径段），在TTL内重复查询该路径
+    或其下级路径时直接判定不存在，不再请求123pan。在对应父目录下新建条目后
+    由调用方失效。
+    """
+
+    def __init__(self, ttl=30, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._misses = {}  # 路径 -> (parent_id, expire_at)
+        self._by_parent = {}  # parent_id -> {路径, ...}
+        self._lock = threading.Lock()
+
+    def contains(self, path):
+        """路径本身或任一上级路径在缓存中记录为不存在时返回True"""
+        parts = path.strip("/").split("/")
+        now = time.time()
+        with self._lock:
+            prefix = ""
+            for part in parts:
+                prefix = f"{prefix}/{part}"
+                entry = self._misses.get(prefix)
+                if entry is None:
+                    continue
+                if entry[1] > now:
+                    return True
+                self._remove(prefix)
+        return False
+
+    def add(self, path, parent_id):
+        """记录不存在的路径，parent_id为该路径最后一段所在的目录ID"""
+        with self._lock:
+            if path not in self._misses and len(self._misses) >= self.max_entries:
+                self._evict()
+            self._remove(path)
+            self._misses[path] = (parent_id, time.time() + self.ttl)
+            self._by_parent.setdefault(parent_id, set()).add(path)
+
+    def invalidate_parent(self, parent_id):
+        """失效某目录下记录的全部不存在路径，用于在该目录下新建条目后"""
+        with self._lock:
+            for path in self._by_parent.pop(parent_id, set()):
+                self._misses.pop(path, None)
+
+    def clear(self):
+        with self._lock:
+            self._misses.clear()
+            self._by_parent.clear()
+
+    def _evict(self):
+        # 先清除过期条目，仍然已满时丢弃最早加入的条目
+        now = time.time()
+        for path in [p for p, (_, expire_at) in self._misses.items() if expire_at <= now]:
+            self._remove(path)
+        if len(self._misses) >= self.max_entries:
+            self._remove(next(iter(self._misses)))
+
+    def _remove(self, path):
+        entry = self._misses.pop(path, None)
+        if entry is None:
+            return
+        paths = self._by_parent.get(entry[0])
+        if paths is not None:
+            paths.discard(path)
+            if not paths:
+                del self._by_parent[entry[0]]
@@ -0,0 +1,618 @@
+import json
+import mmap
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+import http_transport
+
+FILE_API = "https://www.123pan.com/b/api/file/"
+
+# 分片大小，与123pan客户端一致，也是自适应选择的下限（S3分片的最小值）
+DEFAULT_PART_SIZE = 5242880
+
+# 自适应分片大小的上限：123pan未公开分片大小限制，取保守值，同时限制预读分片占用的内存
+MAX_PART_SIZE = 32 * 1024 * 1024
+
+# S3单次分片上传的分片数上限
+MAX_PART_COUNT = 10000
+
+# 大文件期望的分片数，超过时增大分片以减少每个分片获取链接、发起请求的固定开销
+TARGET_PART_COUNT = 1000
+
+# 已测得上传速度时，每个分片期望的传输秒数
+TARGET_PART_SECONDS = 4
+
+# 上传链接的有效期按保守值估计，超过后重新获取
+PRESIGNED_URL_TTL = 600
+
+
+class UploadError(Exception):
+    """分片上传失败，code为123pan返回的错误码（网络错误时为-1）"""
+
+    def __init__(self, message, code=-1):
+        super().__init__(message)
+        self.code = code
+
+
+def choose_part_size(file_size, throughput=None, workers=1):
+    """
+    按文件大小和测得的单连接上传速度选择分片大小
+
+    分片不小于DEFAULT_PART_SIZE；大文件的分片数尽量不超过TARGET_PART_COUNT，测得速度时
+    每个分片约传输TARGET_PART_SECONDS秒；同时保证能拆出workers个分片并发上传，
+    且不超过MAX_PART_SIZE（分片数超过MAX_PART_COUNT时除外）。结果按MiB向上取整。
+
+    参数:
+        file_size: 文件大小（字节）
+        throughput: 单个连接的上传速度（字节/秒），未知时为None
+        workers: 同时上传的分片数
+    """
+    size = max(DEFAULT_PART_SIZE, -(-file_size // TARGET_PART_COUNT))
+    if throughput:
+        size = max(size, int(throughput * TARGET_PART_SECONDS))
+    size = min(size, max(DEFAULT_PART_SIZE, -(-file_size // max(1, workers))), MAX_PART_SIZE)
+    size = max(size, -(-file_size // MAX_PART_COUNT))
+    mib = 1024 * 1024
+    return -(-size // mib) * mib
+
+
+class ThroughputMeter:
+    """按已上传的分片估计单个连接的上传速度（字节/秒），取指数加权平均"""
+
+    # 小于该大小的请求主要受延迟影响，不计入速度
+    MIN_SAMPLE_SIZE = 1024 * 1024
+
+    def __init__(self, alpha=0.3):
+        self.alpha = alpha
+        self._rate = None
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        """估计的上传速度，尚无样本时为None"""
+        return self._rate
+
+    def record(self, size, elapsed):
+        if size < self.MIN_SAMPLE_SIZE or elapsed <= 0:
+            return
+        with self._lock:
+            sample = size / elapsed
+            self._rate = sample if self._rate is None else self.alpha * sample + (1 - self.alpha) * self._rate
+
+
+class MultipartUpload:
+    """
+    一次分片上传会话
+
+    由upload_request返回的Bucket、Key、UploadId、StorageNode、FileId构造。
+    分片由有界线程池并发上传，读取下一批分片与已提交分片的传输同时进行；
+    上传链接按批获取，读取线程在上传线程用到之前补充。单个分片失败时
+    重新获取该分片的链接并只重试该分片，重试用尽后整个上传失败。
+    """
+
+    def __init__(self, headers, session, part_size=DEFAULT_PART_SIZE, workers=3, max_retries=3, timeout=60,
+                 url_batch=16, url_ttl=PRESIGNED_URL_TTL, use_mmap=False, throughput=None):
+        """
+        参数:
+            headers: 已登录的请求头，刷新令牌后原地更新
+            session: upload_request返回的data
+            part_size: 分片大小（字节）
+            workers: 同时上传的分片数
+            max_retries: 单个分片失败后的重试次数
+            timeout: 单个分片PUT的超时秒数
+            url_batch: 每次获取上传链接的分片数
+            url_ttl: 上传链接获取后视为有效的秒数
+            use_mmap: 将文件映射到内存，以memoryview切片作为分片请求体，不再为每个分片复制数据
+            throughput: ThroughputMeter，记录每个分片的上传速度（可选）
+        """
+        self.headers = headers
+        self.bucket = session["Bucket"]
+        self.key = session["Key"]
+        self.upload_id = session["UploadId"]
+        self.storage_node = session["StorageNode"]
+        self.file_id = session["FileId"]
+        self.part_size = part_size
+        self.workers = max(1, workers)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.url_batch = max(1, url_batch)
+        self.url_ttl = url_ttl
+        self.use_mmap = use_mmap
+        self.throughput = throughput
+        self.part_count = None
+        self._urls = {}  # 分片号 -> (上传链接, 过期时间)
+        self._url_lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+
+    def _post(self, endpoint, data):
+        res = http_transport.post(
+            FILE_API + endpoint,
+            headers=self.headers,
+            data=json.dumps(data),
+            timeout=10
+        )
+        res_json = res.json()
+        if res_json["code"] != 0:
+            raise UploadError(endpoint + "失败: " + str(res_json.get("message")), res_json["code"])
+        return res_json.get("data")
+
+    def _session_data(self):
+        return {
+            "bucket": self.bucket,
+            "key": self.key,
+            "uploadId": self.upload_id,
+            "storageNode": self.storage_node,
+        }
+
+    @property
+    def session(self):
+        """续传所需的会话信息，与upload_request返回的字段名一致"""
+        return {
+            "Bucket": self.bucket,
+            "Key": self.key,
+            "UploadId": self.upload_id,
+            "StorageNode": self.storage_node,
+            "FileId": self.file_id,
+        }
+
+    def list_parts(self):
+        """获取服务端已保存的分片"""
+        return self._post("s3_list_upload_parts", self._session_data())
+
+    def completed_parts(self):
+        """服务端已保存的分片号集合，会话已失效时抛出UploadError"""
+        data = self.list_parts() or {}
+        return {int(part["PartNumber"]) for part in data.get("Parts") or []}
+
+    def presign(self, part_number, count=None):
+        """
+        取出一个分片的上传链接，每个链接只使用一次
+
+        缓存中没有或已过期时，获取从该分片开始的count个（默认url_batch个）链接。
+        """
+        with self._url_lock:
+            url = self._take_url(part_number)
+        if url is None:
+            with self._fetch_lock:
+                # 等待锁期间其他线程可能已经获取到
+                with self._url_lock:
+                    url = self._take_url(part_number)
+                if url is None:
+                    self._fetch_urls(part_number, count or self.url_batch)
+                    with self._url_lock:
+                        url = self._take_url(part_number)
+        if url is None:
+            raise UploadError("未获取到分片%d的上传链接" % part_number)
+        return url
+
+    def prefetch(self, part_number):
+        """确保part_number起一个预读窗口内的分片都已有链接，缺少时从第一个缺少的分片起批量获取"""
+        last = part_number + self.workers * 2
+        if self.part_count is not None:
+            last = min(last, self.part_count)
+        with self._url_lock:
+            missing = next((n for n in range(part_number, last + 1) if n not in self._urls), None)
+        if missing is not None:
+            with self._fetch_lock:
+                self._fetch_urls(missing, self.url_batch)
+
+    def _take_url(self, part_number):
+        entry = self._urls.pop(part_number, None)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    def _fetch_urls(self, start, count):
+        end = start + count
+        if self.part_count is not None:
+            end = max(start + 1, min(end, self.part_count + 1))
+        data = self._post("s3_repare_upload_parts_batch", {
+            "bucket": self.bucket,
+            "key": self.key,
+            "partNumberEnd": end,
+            "partNumberStart": start,
+            "uploadId": self.upload_id,
+            "StorageNode": self.storage_node,
+        })
+        expire_at = time.monotonic() + self.url_ttl
+        with self._url_lock:
+            for number, url in data["presignedUrls"].items():
+                self._urls[int(number)] = (url, expire_at)
+
+    def put_part(self, part_number, data):
+        """上传一个分片，失败时退避后单独重新获取该分片的链接重试"""
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(min(2 ** (attempt - 1), 10))
+            try:
+                url = self.presign(part_number, count=1 if attempt else None)
+                start = time.perf_counter()
+                res = http_transport.put(url, data=data, timeout=self.timeout)
+                if res.status_code == 200:
+                    if self.throughput is not None:
+                        self.throughput.record(len(data), time.perf_counter() - start)
+                    return
+                error = "HTTP " + str(res.status_code)
+            except (requests.RequestException, ValueError, UploadError) as e:
+                error = e
+        raise UploadError("分片%d上传失败（已重试%d次）: %s" % (part_number, self.max_retries, error))
+
+    def upload_file(self, file_path, progress=None, skip=(), on_part=None):
+        """
+        并发上传文件的全部分片
+
+        同时最多workers个分片在传输，另有workers个分片预先读入内存等待上传；
+        读取线程提交分片前补充上传链接。use_mmap时分片为映射区域的切片，
+        由系统按需换入页面，上传完成后即释放。只有一个分片时直接在当前线程上传。
+
+        参数:
+            file_path: 本地文件路径
+            progress: 进度回调，progress(已上传字节数, 文件大小)
+            skip: 服务端已保存、无需再上传的分片号
+            on_part: 分片上传成功后的回调，on_part(分片号)
+        """
+        total = os.path.getsize(file_path)
+        self.part_count = (total + self.part_size - 1) // self.part_size
+        skip = set(skip)
+        uploaded = [sum(min(self.part_size, total - (n - 1) * self.part_size)
+                        for n in skip if 1 <= n <= self.part_count)]
+        lock = threading.Lock()
+
+        def put(part_number, data):
+            try:
+                self.put_part(part_number, data)
+                if on_part is not None:
+                    on_part(part_number)
+                if progress is not None:
+                    with lock:
+                        uploaded[0] += len(data)
+                        progress(uploaded[0], total)
+            finally:
+                if isinstance(data, memoryview):
+                    data.release()
+
+        with open(file_path, "rb") as f:
+            mapped = None
+            if self.use_mmap and total > 0:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                if self.part_count == 1 and 1 not in skip:
+                    put(1, memoryview(mapped) if mapped is not None else f.read())
+                else:
+                    self._upload_parts(f, mapped, put, skip)
+            finally:
+                if mapped is not None:
+                    try:
+                        mapped.close()
+                    except BufferError:
+                        # 仍有未释放的切片（如被取消的分片），交由垃圾回收关闭
+                        pass
+
+    def _upload_parts(self, f, mapped, put, skip):
+        """按顺序读取分片并提交到线程池，mapped不为None时取映射区域的切片"""
+        view = memoryview(mapped) if mapped is not None else None
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = set()
+            try:
+                part_number = 1
+                while True:
+                    if part_number in skip:
+                        part_number += 1
+                        continue
+                    if len(pending) >= self.workers * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
+                    start = (part_number - 1) * self.part_size
+                    if view is not None:
+                        if start >= len(view):
+                            break
+                        data = view[start:start + self.part_size]
+                    else:
+                        f.seek(start)
+                        data = f.read(self.part_size)
+                    if not data:
+                        break
+                    self.prefetch(part_number)
+                    pending.add(pool.submit(put, part_number, data))
+                    data = None
+                    part_number += 1
+                for future in pending:
+                    future.result()
+            finally:
+                # 任一分片最终失败时，取消尚未开始的分片
+                for future in pending:
+                    future.cancel()
+                if view is not None:
+                    try:
+                        view.release()
+                    except BufferError:
+                        pass
+
+    def complete(self, poll_interval=0.5, poll_timeout=60):
+        """
+        合并分片并关闭上传会话
+
+        大文件合并需要时间，upload_complete未完成时按退避间隔轮询，
+        超过poll_timeout秒仍未完成则失败。
+        """
+        self.list_parts()
+        self._post("s3_complete_multipart_upload", self._session_data())
+        deadline = time.monotonic() + poll_timeout
+        while True:
+            res = http_transport.post(
+                FILE_API + "upload_complete",
+                headers=self.headers,
+                data=json.dumps({"fileId": self.file_id}),
+                timeout=10
+            )
+            res_json = res.json()
+            data = res_json.get("data") or {}
+            if res_json["code"] == 0 and data.get("completed", True):
+                return data
+            if time.monotonic() >= deadline:
+                raise UploadError("upload_complete失败: " + str(res_json.get("message")), res_json["code"])
+            time.sleep(poll_interval)
+            poll_interval = min(poll_interval * 2, 5)
+
+
+class ChunkedUpload:
+    """
+    把客户端按chunk_size分块发送的数据转为分片上传
+
+    连续的若干块组成一个分片（不小于DEFAULT_PART_SIZE），一个分片的块到齐后立即上传
+    并释放缓冲，服务端只缓冲正在组装的分片，不保存整个文件。同一块重复发送时忽略。
+    """
+
+    def __init__(self, upload, size, chunk_size, max_buffered_parts=8):
+        """
+        参数:
+            upload: MultipartUpload，其part_size会被调整为chunk_size的整数倍
+            size: 文件大小
+            chunk_size: 客户端每块的大小
+            max_buffered_parts: 同时缓冲的未完成分片数上限
+        """
+        if not isinstance(chunk_size, int) or chunk_size <= 0:
+            raise UploadError("块大小必须是正整数: %r" % (chunk_size,))
+        self.upload = upload
+        self.size = size
+        self.chunk_size = chunk_size
+        self.chunks_per_part = max(1, -(-DEFAULT_PART_SIZE // chunk_size))
+        self.chunk_count = -(-size // chunk_size)
+        self.max_buffered_parts = max_buffered_parts
+        upload.part_size = chunk_size * self.chunks_per_part
+        upload.part_count = -(-self.chunk_count // self.chunks_per_part)
+        self.updated_at = time.time()
+        self._buffers = {}  # 分片号 -> {块序号: 数据}
+        self._done = set()  # 已随分片上传的块序号
+        self._uploading = set()  # 正在上传的分片号，期间收到的重复块直接忽略
+        self._lock = threading.Lock()
+
+    def put_chunk(self, index, data):
+        """接收一块，所在分片的块到齐时上传该分片"""
+        if not 0 <= index < self.chunk_count:
+            raise UploadError("块序号超出范围: %d" % index)
+        expected = min(self.chunk_size, self.size - index * self.chunk_size)
+        if len(data) != expected:
+            raise UploadError("块%d大小不正确: %d，应为%d" % (index, len(data), expected))
+
+        part_number = index // self.chunks_per_part + 1
+        first = (part_number - 1) * self.chunks_per_part
+        last = min(first + self.chunks_per_part, self.chunk_count)
+        with self._lock:
+            self.updated_at = time.time()
+            if index in self._done or part_number in self._uploading:
+                return
+            if part_number not in self._buffers and len(self._buffers) >= self.max_buffered_parts:
+                raise UploadError("缓冲的分片过多，请稍后重试")
+            chunks = self._buffers.setdefault(part_number, {})
+            chunks[index] = data
+            if len(chunks) < last - first:
+                return
+            del self._buffers[part_number]
+            self._uploading.add(part_number)
+
+        try:
+            self.upload.put_part(part_number, b"".join(chunks[i] for i in range(first, last)))
+        except Exception:
+            # 放回其他块，客户端重发本块后再次上传该分片
+            with self._lock:
+                self._uploading.discard(part_number)
+                del chunks[index]
+                self._buffers.setdefault(part_number, {}).update(chunks)
+            raise
+        with self._lock:
+            self._uploading.discard(part_number)
+            self._done.update(range(first, last))
+
+    def missing_chunks(self):
+        """尚未随分片上传的块序号"""
+        with self._lock:
+            return [i for i in range(self.chunk_count) if i not in self._done]
+
+    def complete(self):
+        missing = self.missing_chunks()
+        if missing:
+            raise UploadError("还有%d块未上传" % len(missing))
+        return self.upload.complete()
+
+
+class BatchProgress:
+    """
+    批量上传的汇总进度
+
+    各文件的上传线程报告自己的已上传字节数，汇总后调用callback(snapshot())。
+    """
+
+    def __init__(self, sizes, callback=None):
+        self.sizes = list(sizes)
+        self.callback = callback
+        self.done_files = 0
+        self.failed_files = 0
+        self._uploaded = [0] * len(self.sizes)
+        self._uploaded_bytes = 0
+        self._lock = threading.Lock()
+
+    def update(self, index, uploaded):
+        """第index个文件已上传uploaded字节"""
+        with self._lock:
+            self._uploaded_bytes += uploaded - self._uploaded[index]
+            self._uploaded[index] = uploaded
+            self._notify()
+
+    def finish(self, index, success=True):
+        """第index个文件上传结束，成功时（包括秒传）计为全部上传"""
+        with self._lock:
+            if success:
+                self.done_files += 1
+                self._uploaded_bytes += self.sizes[index] - self._uploaded[index]
+                self._uploaded[index] = self.sizes[index]
+            else:
+                self.failed_files += 1
+            self._notify()
+
+    def snapshot(self):
+        return {
+            "total_files": len(self.sizes),
+            "done_files": self.done_files,
+            "failed_files": self.failed_files,
+            "total_bytes": sum(self.sizes),
+            "uploaded_bytes": self._uploaded_bytes,
+        }
+
+    def _notify(self):
+        # 在锁内回调，保证回调看到的进度单调递增
+        if self.callback is not None:
+            self.callback(self.snapshot())
+
+
+class UploadSessionStore:
+    """
+    未完成的分片上传会话
+
+    保存在本地JSON文件中，按文件MD5与目标文件夹索引。进程中断或网络断开后
+    重新上传同一文件时据此继续原会话，只上传服务端尚未保存的分片。
+
+    已上传的分片先记录在内存中，每flush_parts个分片或每flush_interval秒才写一次文件，
+    大文件不必每上传一个分片就重写整个会话文件。续传时以服务端已保存的分片为准，
+    进程中断时未写入文件的记录不影响续传。
+    """
+
+    def __init__(self, path="upload_sessions.json", max_age=7 * 86400, flush_parts=16, flush_interval=5):
+        """
+        参数:
+            path: 会话文件路径
+            max_age: 会话保存多少秒后不再尝试续传
+            flush_parts: 累计多少个已上传的分片后写入文件
+            flush_interval: 距上次写入多少秒后，下一个分片完成时写入文件
+        """
+        self.path = path
+        self.max_age = max_age
+        self.flush_parts = flush_parts
+        self.flush_interval = flush_interval
+        self._pending = {}  # 会话键 -> 尚未写入文件的分片号
+        self._pending_count = 0
+        self._flushed_at = time.time()
+        self._lock = threading.Lock()
+
+    def get(self, md5, parent_file_id):
+        """
+        返回:
+            {"session": 会话信息, "part_size": 分片大小, "parts": [已上传的分片号], "updated_at": 时间}，
+            没有可续传的会话时返回None
+        """
+        key = self._key(md5, parent_file_id)
+        with self._lock:
+            entry = self._load().get(key)
+            if entry is not None and key in self._pending:
+                entry["parts"] += self._pending[key]
+        if entry is None or entry["updated_at"] + self.max_age <= time.time():
+            return None
+        return entry
+
+    def save(self, md5, parent_file_id, session, part_size):
+        key = self._key(md5, parent_file_id)
+        with self._lock:
+            # 新会话没有已上传的分片，丢弃同一键下旧会话未写入的记录
+            self._discard_pending(key)
+            sessions = self._load()
+            now = time.time()
+            self._apply_pending(sessions, now)
+            sessions = {k: v for k, v in sessions.items() if v["updated_at"] + self.max_age > now}
+            sessions[key] = {
+                "session": session,
+                "part_size": part_size,
+                "parts": [],
+                "updated_at": now,
+            }
+            self._save(sessions)
+
+    def add_part(self, md5, parent_file_id, part_number):
+        """记录一个已上传的分片，累计到一定数量或时间后写入文件"""
+        with self._lock:
+            self._pending.setdefault(self._key(md5, parent_file_id), []).append(part_number)
+            self._pending_count += 1
+            if (self._pending_count >= self.flush_parts
+                    or self._flushed_at + self.flush_interval <= time.time()):
+                self._flush()
+
+    def flush(self):
+        """把内存中已上传分片的记录写入文件"""
+        with self._lock:
+            self._flush()
+
+    def remove(self, md5, parent_file_id):
+        key = self._key(md5, parent_file_id)
+        with self._lock:
+            self._discard_pending(key)
+            sessions = self._load()
+            changed = self._apply_pending(sessions, time.time())
+            if sessions.pop(key, None) is not None or changed:
+                self._save(sessions)
+
+    def _flush(self):
+        if not self._pending:
+            return
+        sessions = self._load()
+        if self._apply_pending(sessions, time.time()):
+            self._save(sessions)
+
+    def _apply_pending(self, sessions, now):
+        """把未写入的分片记录合并到sessions中并清空，返回是否有变化；需持有锁"""
+        changed = False
+        for key, parts in self._pending.items():
+            entry = sessions.get(key)
+            if entry is not None:
+                entry["parts"] += parts
+                entry["updated_at"] = now
+                changed = True
+        self._pending.clear()
+        self._pending_count = 0
+        self._flushed_at = now
+        return changed
+
+    def _discard_pending(self, key):
+        self._pending_count -= len(self._pending.pop(key, ()))
+
+    @staticmethod
+    def _key(md5, parent_file_id):
+        return "%s:%s" % (md5, parent_file_id)
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, sessions):
+        # 先写临时文件再替换，中断时不会留下不完整的会话文件
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(sessions, f)
+        os.replace(tmp_path, self.path)
@@ -1,10 +1,11 @@
 import os
 import sys
 import json
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', '123pan'))
 from pan123 import Pan123
+import http_transport
 
 class Pan123Client:
     _instance = None
@@ -64,8 +65,7 @@ class Pan123Client:
             return {"error": "未登录"}
         try:
             url = "https://www.123pan.com/b/api/user/info"
-            import requests
-            res = requests.get(url, headers=self.client.header_logined, timeout=10)
+            res = http_transport.get(url, headers=self.client.header_logined, timeout=10)
             data = res.json()
             if data.get("code") == 0:
                 return {
@@ -87,14 +87,13 @@ class Pan123Client:
                 folder_id = self._get_file_id_by_path(path)
                 if folder_id is None:
                     return {"error": "路径不存在"}
-                self.client.parent_file_id = folder_id
             else:
-                self.client.parent_file_id = 0
+                folder_id = 0
             
-            self.client.get_dir()
+            items = self._list_dir(folder_id)
             results = {"folder": [], "file": []}
             
-            for item in self.client.list:
+            for item in items:
                 name = item.get("FileName", "")
                 if keyword.lower() in name.lower():
                     if item["Type"] == 1:
@@ -103,12 +102,10 @@ class Pan123Client:
                             "name": name
                         })
                     else:
-                        size = item["Size"]
-                        size_str = self._format_size(size)
                         results["file"].append({
                             "id": str(item["FileId"]),
                             "name": name,
-                            "size": size_str
+                            "size": item["Size"]
                         })
             
             return results
@@ -124,10 +121,8 @@ class Pan123Client:
         for part in parts:
             if not part:
                 continue
-            self.client.parent_file_id = current_id
-            self.client.get_dir()
             found = False
-            for item in self.client.list:
+            for item in self._list_dir(current_id):
                 if item["FileName"] == part:
                     current_id = item["FileId"]
                     found = True
@@ -136,10 +131,8 @@ class Pan123Client:
                 return None
         return current_id
     
-    @staticmethod
-    def _format_size(size_bytes: int) -> str:
-        for unit in ['B', 'KB', 'MB', 'GB']:
-            if size_bytes < 1024.0:
-                return f"{size_bytes:.1f}{unit}"
-            size_bytes /= 1024.0
-        return f"{size_bytes:.1f}TB"
+    def _list_dir(self, parent_id: int) -> List[Dict[str, Any]]:
+        code, items = self.client.fetch_dir(parent_id)
+        if code != 0:
+            raise Exception("获取目录列表失败")
+        return items
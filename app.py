@@ -2,9 +2,13 @@ import json
 import os
 import hashlib
 import re
+import shutil
+import tempfile
 from datetime import datetime, timedelta
 from functools import wraps
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from urllib.parse import quote
+from flask import Flask, Request, Response, request, jsonify, render_template, send_file, send_from_directory, stream_with_context
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
 from flask_cors import CORS
 import jwt
 
@@ -59,6 +63,95 @@ def create_backup():
         print(f"Backup error: {e}")
         return None
 
+# 上传文件暂存后至少保留的磁盘空间
+UPLOAD_DISK_RESERVE = 256 * 1024 * 1024
+
+# 批量上传一次请求的总大小上限，可由config.json的upload.max_batch_size覆盖
+DEFAULT_MAX_BATCH_SIZE = 20 * 1024 ** 3
+BATCH_UPLOAD_PATH = '/api/upload/batch'
+
+class InsufficientStorage(HTTPException):
+    code = 507
+    description = '服务器临时空间不足'
+
+class HashingSpoolFile:
+    """上传文件的暂存文件，接收请求体时同步计算MD5，之后直接交给分片上传"""
+    def __init__(self, suffix=''):
+        self._file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+        self.name = self._file.name
+        self.md5 = hashlib.md5()
+    
+    def write(self, data):
+        self.md5.update(data)
+        return self._file.write(data)
+    
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+class SpoolingRequest(Request):
+    """把上传的文件直接写入HashingSpoolFile，请求结束时删除暂存文件"""
+    @property
+    def max_content_length(self):
+        # 批量上传的请求体包含多个文件，按批量上限限制
+        if self.path == BATCH_UPLOAD_PATH:
+            return self._upload_limit() + 1024 * 1024
+        return super().max_content_length
+    
+    def _upload_limit(self):
+        upload_config = load_config().get('upload', {})
+        if self.path == BATCH_UPLOAD_PATH:
+            return upload_config.get('max_batch_size', DEFAULT_MAX_BATCH_SIZE)
+        return upload_config.get('max_file_size')
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        max_size = self._upload_limit()
+        if max_size and total_content_length and total_content_length > max_size + 1024 * 1024:
+            raise RequestEntityTooLarge()
+        if shutil.disk_usage(tempfile.gettempdir()).free < (total_content_length or 0) + UPLOAD_DISK_RESERVE:
+            raise InsufficientStorage()
+        spool = HashingSpoolFile(os.path.splitext(filename or '')[1])
+        if not hasattr(self, '_spool_files'):
+            self._spool_files = []
+        self._spool_files.append(spool)
+        return spool
+    
+    def detach_spool(self, spool):
+        """请求结束后保留暂存文件（例如交给后台任务），返回其路径，由调用方负责删除"""
+        spool.close()
+        self._spool_files.remove(spool)
+        return spool.name
+    
+    def close(self):
+        super().close()
+        for spool in getattr(self, '_spool_files', []):
+            spool.close()
+            try:
+                os.unlink(spool.name)
+            except OSError:
+                pass
+
+app.request_class = SpoolingRequest
+# 请求体上限为单个文件上限加上表单字段的余量，超出时在读取请求体之前拒绝
+app.config['MAX_CONTENT_LENGTH'] = load_config().get('upload', {}).get('max_file_size', 2 * 1024 ** 3) + 1024 * 1024
+
+def config_etag(section):
+    # 以配置文件的修改时间和大小作为版本号，未修改时无需读取和序列化配置
+    stat = os.stat(CONFIG_PATH)
+    return f'{section}-{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+def not_modified(etag):
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+def conditional_jsonify(payload, etag=None):
+    """返回带强ETag的JSON响应，请求的If-None-Match匹配时返回304；未提供etag时按响应内容计算"""
+    response = jsonify(payload)
+    response.set_etag(etag or hashlib.sha1(response.get_data()).hexdigest())
+    return response.make_conditional(request)
+
 def get_token_from_request():
     auth_header = request.headers.get('Authorization', '')
     if auth_header.startswith('Bearer '):
@@ -110,13 +203,24 @@ def settings():
 
 @app.route('/api/config', methods=['GET'])
 def get_config():
+    try:
+        etag = config_etag('config')
+    except OSError:
+        etag = None
+    if etag:
+        cached = not_modified(etag)
+        if cached:
+            return cached
     config = load_config()
     if "error" in config:
         return jsonify({'code': 500, 'message': config['error'], 'data': None}), 500
     safe_config = config.copy()
     if 'auth' in safe_config:
         del safe_config['auth']
-    return jsonify({'code': 200, 'message': 'success', 'data': safe_config})
+    response = jsonify({'code': 200, 'message': 'success', 'data': safe_config})
+    if etag:
+        response.set_etag(etag)
+    return response
 
 @app.route('/api/config/<section>', methods=['GET'])
 def get_config_section(section):
@@ -200,6 +304,9 @@ def validate_config():
             if 'max_file_size' in config_data['upload']:
                 if not isinstance(config_data['upload']['max_file_size'], int) or config_data['upload']['max_file_size'] <= 0:
                     errors.append('max_file_size 必须是正整数')
+            if 'chunk_size' in config_data['upload']:
+                if not isinstance(config_data['upload']['chunk_size'], int) or config_data['upload']['chunk_size'] <= 0:
+                    errors.append('chunk_size 必须是正整数')
         return jsonify({'code': 200, 'message': '验证完成', 'data': {'valid': len(errors) == 0, 'errors': errors}})
     except Exception as e:
         return jsonify({'code': 500, 'message': str(e), 'data': None}), 500
@@ -251,10 +358,21 @@ def restore_backup(backup_id):
 
 @app.route('/api/config/theme', methods=['GET'])
 def get_theme():
+    try:
+        etag = config_etag('theme')
+    except OSError:
+        etag = None
+    if etag:
+        cached = not_modified(etag)
+        if cached:
+            return cached
     config = load_config()
     if "error" in config:
         return jsonify({'code': 500, 'message': config['error'], 'data': None}), 500
-    return jsonify({'code': 200, 'message': 'success', 'data': config.get('theme', {})})
+    response = jsonify({'code': 200, 'message': 'success', 'data': config.get('theme', {})})
+    if etag:
+        response.set_etag(etag)
+    return response
 
 @app.route('/api/config/theme', methods=['PUT'])
 @require_auth
@@ -327,51 +445,198 @@ def check_auth():
 import sys
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '123pan'))
 import api as pan_api
+from content_cache import ContentCache
+from jobs import JobQueue
+
+# 上传、镜像同步等耗时操作作为后台任务运行，每种任务类型的并发数由config.json的jobs配置
+job_queue = JobQueue(load_config().get('jobs', {}))
+
+def wants_async():
+    return request.args.get('async') == '1' or request.form.get('async') == '1'
+
+def upload_duplicate():
+    """同名文件的处理方式：参数duplicate为1覆盖，2保留两者（默认）；无效时返回None"""
+    value = request.values.get('duplicate', '2')
+    return int(value) if value in ('1', '2') else None
+
+def job_accepted(job):
+    response = jsonify({'code': 202, 'message': '任务已提交', 'data': job_queue.snapshot(job.id)[1]})
+    response.status_code = 202
+    response.headers['Location'] = f'/api/jobs/{job.id}'
+    return response
+
+def remove_after(func, *paths):
+    """任务结束后删除暂存文件"""
+    def run(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            for path in paths:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+    return run
+
+mirror_config = load_config().get('mirror', {})
+if mirror_config.get('enabled'):
+    pan_api.start_mirror(mirror_config.get('db_path', 'mirror.db'), mirror_config.get('sync_interval', 600))
+
+def listing_etag(path, *params):
+    """
+    以镜像中目录的版本号作为ETag，未变化时无需读取和序列化列表；目录不由镜像回答时返回None
+    
+    params为影响响应内容的其他参数（分页、过滤条件），不同参数的响应使用不同的ETag
+    """
+    version = pan_api.listing_version(path)
+    if version is None:
+        return None
+    if not params:
+        return f'list-{version}'
+    digest = hashlib.sha1(json.dumps([version, *params], ensure_ascii=False).encode('utf-8')).hexdigest()
+    return f'page-{digest}'
+
+def get_listing(path):
+    """优先从本地元数据镜像读取目录内容，镜像无法回答时再实时请求"""
+    result = pan_api.mirror_list(path)
+    if result is None:
+        result = pan_api.list_folder(path) if path != '/' else pan_api.list()
+    return result
+
+def stream_listing(path):
+    """以NDJSON逐条输出目录内容，每收到一页就立即发送"""
+    result = pan_api.mirror_list(path)
+    if result is not None:
+        if 'error' in result:
+            return jsonify({'code': 400, 'message': result['error'], 'data': None}), 400
+        entries = [{'type': 'folder', **f} for f in result.get('folder', [])]
+        entries += [{'type': 'file', **f} for f in result.get('file', [])]
+    else:
+        result = pan_api.stream_list(path)
+        if 'error' in result:
+            return jsonify({'code': 400, 'message': result['error'], 'data': None}), 400
+        entries = result['entries']
+    
+    def generate():
+        try:
+            for entry in entries:
+                yield json.dumps(entry, ensure_ascii=False) + '\n'
+        except Exception as e:
+            yield json.dumps({'type': 'error', 'message': str(e)}, ensure_ascii=False) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 @app.route('/api/files', methods=['GET'])
 def list_files():
     try:
         path = request.args.get('path', '/')
-        result = pan_api.list_folder(path) if path != '/' else pan_api.list()
+        if request.args.get('stream') == '1':
+            return stream_listing(path)
+        
+        etag = listing_etag(path)
+        cached = not_modified(etag) if etag else None
+        if cached:
+            return cached
+        
+        result = pan_api.mirror_list(path)
+        if result is None:
+            # 实时读取的目录可能已在123pan上被修改，按响应内容计算ETag
+            etag = None
+            result = pan_api.list_folder(path) if path != '/' else pan_api.list()
+        elif etag != listing_etag(path):
+            # 读取期间镜像完成了同步，无法确定内容对应的版本
+            etag = None
         
         if 'error' in result:
             return jsonify({'code': 400, 'message': result['error'], 'data': None}), 400
         
-        return jsonify({'code': 200, 'message': 'success', 'data': result})
+        return conditional_jsonify({'code': 200, 'message': 'success', 'data': result}, etag)
     except Exception as e:
         return jsonify({'code': 500, 'message': str(e), 'data': None}), 500
 
+def encode_cursor(state):
+    config = load_config()
+    secret = config.get('auth', {}).get('jwt_secret', 'default-secret')
+    return jwt.encode(state, secret, algorithm='HS256')
+
+def decode_cursor(cursor):
+    try:
+        config = load_config()
+        secret = config.get('auth', {}).get('jwt_secret', 'default-secret')
+        return jwt.decode(cursor, secret, algorithms=['HS256'])
+    except jwt.InvalidTokenError:
+        return None
+
 @app.route('/api/list', methods=['GET'])
 def list_files_paginated():
     try:
-        path = request.args.get('path', '/')
-        page = int(request.args.get('page', 1))
-        page_size = int(request.args.get('page_size', 20))
-        keyword = request.args.get('keyword', '')
-        file_type = request.args.get('file_type', '')
-        
-        result = pan_api.list_folder(path) if path != '/' else pan_api.list()
-        
-        if 'error' in result:
-            return jsonify({'code': 400, 'message': result['error'], 'data': None}), 400
-        
-        folders = result.get('folder', [])
-        files = result.get('file', [])
+        cursor = request.args.get('cursor', '')
+        if cursor:
+            state = decode_cursor(cursor)
+            if not state:
+                return jsonify({'code': 400, 'message': '分页游标无效', 'data': None}), 400
+        else:
+            state = {
+                'path': request.args.get('path', '/'),
+                'page': int(request.args.get('page', 1)),
+                'page_size': int(request.args.get('page_size', 20)),
+                'keyword': request.args.get('keyword', ''),
+                'file_type': request.args.get('file_type', '')
+            }
+        path = state['path']
+        page = max(1, state['page'])
+        page_size = max(1, min(state['page_size'], pan_api.MAX_PAGE_SIZE))
+        keyword = state.get('keyword', '')
+        file_type = state.get('file_type', '')
         
-        if keyword:
-            folders = [f for f in folders if keyword.lower() in f.get('name', '').lower()]
-            files = [f for f in files if keyword.lower() in f.get('name', '').lower()]
+        etag_params = (page, page_size, keyword, file_type)
+        etag = listing_etag(path, *etag_params)
+        cached = not_modified(etag) if etag else None
+        if cached:
+            return cached
         
-        if file_type:
-            files = [f for f in files if f.get('name', '').lower().endswith(f'.{file_type.lower()}')]
+        result = pan_api.mirror_list(path)
+        if result is None or etag != listing_etag(path, *etag_params):
+            # 实时读取或读取期间镜像完成了同步时按响应内容计算ETag
+            etag = None
+        if result is None and not keyword and not file_type:
+            # 无过滤条件时把分页下推到123pan，每页只请求一页
+            result = pan_api.list_page(path, page, page_size, folder_id=state.get('folder_id'))
+            if 'error' in result:
+                return jsonify({'code': 400, 'message': result['error'], 'data': None}), 400
+            folders = result.get('folder', [])
+            files = result.get('file', [])
+            total = result['total']
+            state['folder_id'] = result['folder_id']
+        else:
+            if result is None:
+                result = pan_api.list_folder(path) if path != '/' else pan_api.list()
+            if 'error' in result:
+                return jsonify({'code': 400, 'message': result['error'], 'data': None}), 400
+            
+            folders = result.get('folder', [])
+            files = result.get('file', [])
+            
+            if keyword:
+                folders = [f for f in folders if keyword.lower() in f.get('name', '').lower()]
+                files = [f for f in files if keyword.lower() in f.get('name', '').lower()]
+            
+            if file_type:
+                files = [f for f in files if f.get('name', '').lower().endswith(f'.{file_type.lower()}')]
+            
+            # 文件夹排在文件之前，按合并后的顺序切出当前页
+            folder_count = len(folders)
+            total = folder_count + len(files)
+            start = (page - 1) * page_size
+            end = start + page_size
+            folders = folders[start:end]
+            files = files[max(0, start - folder_count):max(0, end - folder_count)]
         
-        all_items = folders + files
-        total = len(all_items)
-        start = (page - 1) * page_size
-        end = start + page_size
-        paginated = all_items[start:end]
+        next_cursor = None
+        if page * page_size < total:
+            next_cursor = encode_cursor({**state, 'page': page + 1, 'page_size': page_size})
         
-        return jsonify({
+        return conditional_jsonify({
             'code': 200,
             'message': 'success',
             'data': {
@@ -379,9 +644,10 @@ def list_files_paginated():
                 'page': page,
                 'page_size': page_size,
                 'folders': folders,
-                'files': files
+                'files': files,
+                'next_cursor': next_cursor
             }
-        })
+        }, etag)
     except Exception as e:
         return jsonify({'code': 500, 'message': str(e), 'data': None}), 500
 
@@ -401,6 +667,122 @@ def download_file():
     except Exception as e:
         return jsonify({'code': 500, 'message': str(e), 'data': None}), 500
 
+# 代理下载时每次从上游读取并发送给客户端的字节数，每个传输只缓冲这么多数据
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# 原样转发给上游的请求头与转发给客户端的响应头
+STREAM_REQUEST_HEADERS = ('Range', 'If-Range')
+STREAM_RESPONSE_HEADERS = ('Content-Length', 'Content-Range', 'Accept-Ranges', 'Content-Type', 'ETag', 'Last-Modified')
+
+# 转发下载的本地内容缓存，由config.json的download_cache配置
+download_cache_config = load_config().get('download_cache', {})
+content_cache = None
+if download_cache_config.get('enabled'):
+    content_cache = ContentCache(download_cache_config.get('path', 'download_cache'),
+                                 download_cache_config.get('max_size', 10 * 1024 ** 3))
+
+def content_disposition(file_name):
+    return "attachment; filename*=UTF-8''" + quote(file_name, safe='')
+
+def is_full_content(upstream, size):
+    """上游响应是否为完整的文件内容（200，或Range从0到末尾的206）"""
+    if upstream.status_code == 200:
+        return upstream.headers.get('Content-Length') == str(size)
+    return upstream.status_code == 206 and upstream.headers.get('Content-Range') == f'bytes 0-{size - 1}/{size}'
+
+def fill_cache(chunks, file_info):
+    """边发送边写入内容缓存，传输完整且校验通过才加入缓存；客户端中途断开时放弃"""
+    fill = content_cache.fill(file_info['FileId'], file_info.get('Etag'), file_info['Size'])
+    if fill is None:
+        yield from chunks
+        return
+    try:
+        for chunk in chunks:
+            fill.write(chunk)
+            yield chunk
+        fill.commit()
+    finally:
+        fill.abort()
+
+def send_cached(path, file_info):
+    """由本地缓存文件响应，Range与If-Range由send_file处理；文件刚被淘汰时返回None"""
+    try:
+        return send_file(path, mimetype='application/octet-stream', as_attachment=True,
+                         download_name=file_info['FileName'], conditional=True, etag=file_info['Etag'])
+    except OSError:
+        return None
+
+@app.route('/api/download/stream', methods=['GET'])
+def download_stream():
+    """
+    由服务端转发文件内容，支持Range/If-Range，供无法访问CDN跳转地址的客户端使用
+    
+    启用内容缓存时，已缓存的文件直接由本地文件响应；未缓存的文件在完整转发时写入缓存。
+    """
+    try:
+        path = request.args.get('path', '')
+        if not path:
+            return jsonify({'code': 400, 'message': '路径不能为空', 'data': None}), 400
+        
+        result = pan_api.stat(path)
+        if 'error' in result:
+            return jsonify({'code': 400, 'message': result['error'], 'data': None}), 400
+        file_info = result['file']
+        
+        if content_cache is not None:
+            cached = content_cache.get(file_info['FileId'], file_info.get('Etag'))
+            response = send_cached(cached, file_info) if cached is not None else None
+            if response is not None:
+                return response
+        
+        headers = {name: request.headers[name] for name in STREAM_REQUEST_HEADERS if name in request.headers}
+        result = pan_api.open_stream(path, headers, file_info=file_info)
+        
+        if 'error' in result:
+            return jsonify({'code': 400, 'message': result['error'], 'data': None}), 400
+        
+        upstream = result['response']
+        if upstream.status_code not in (200, 206, 416):
+            upstream.close()
+            return jsonify({'code': 502, 'message': f'下载地址返回HTTP {upstream.status_code}', 'data': None}), 502
+        
+        body = upstream.iter_content(STREAM_CHUNK_SIZE)
+        if content_cache is not None and is_full_content(upstream, file_info['Size']):
+            body = fill_cache(body, file_info)
+        response = Response(body, status=upstream.status_code, mimetype='application/octet-stream')
+        # 客户端断开或传输结束时归还上游连接
+        response.call_on_close(upstream.close)
+        for name in STREAM_RESPONSE_HEADERS:
+            if name in upstream.headers:
+                response.headers[name] = upstream.headers[name]
+        response.headers.setdefault('Accept-Ranges', 'bytes')
+        response.headers['Content-Disposition'] = content_disposition(result['file']['FileName'])
+        return response
+    except Exception as e:
+        return jsonify({'code': 500, 'message': str(e), 'data': None}), 500
+
+# 单次批量获取下载链接的路径数上限
+MAX_BATCH_DOWNLOAD = 500
+
+@app.route('/api/download/batch', methods=['POST'])
+def download_batch():
+    try:
+        data = request.get_json(silent=True) or {}
+        paths = data.get('paths')
+        if not isinstance(paths, list) or not paths or not all(isinstance(p, str) and p for p in paths):
+            return jsonify({'code': 400, 'message': '路径列表不能为空', 'data': None}), 400
+        if len(paths) > MAX_BATCH_DOWNLOAD:
+            return jsonify({'code': 400, 'message': f'一次最多获取{MAX_BATCH_DOWNLOAD}个下载链接', 'data': None}), 400
+        
+        result = pan_api.parsing_batch(paths)
+        
+        if 'error' in result:
+            return jsonify({'code': 400, 'message': result['error'], 'data': None}), 400
+        
+        return jsonify({'code': 200, 'message': 'success', 'data': result})
+    except Exception as e:
+        return jsonify({'code': 500, 'message': str(e), 'data': None}), 500
+
 @app.route('/api/upload', methods=['POST'])
 @require_auth
 def upload_file():
@@ -414,23 +796,195 @@ def upload_file():
         if file.filename == '':
             return jsonify({'code': 400, 'message': '文件名为空', 'data': None}), 400
         
-        import tempfile
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp:
-            file.save(tmp.name)
-            tmp_path = tmp.name
+        duplicate = upload_duplicate()
+        if duplicate is None:
+            return jsonify({'code': 400, 'message': '同名文件处理方式无效', 'data': None}), 400
         
-        try:
-            result = pan_api.upload(tmp_path, remote_path, file.filename)
-        finally:
-            os.unlink(tmp_path)
+        # 请求体已在接收时写入暂存文件并计算MD5，直接交给分片上传，暂存文件在请求结束时删除
+        spool = file.stream
+        spool.flush()
+        max_concurrent = load_config().get('upload', {}).get('max_concurrent', 3)
+        
+        if wants_async():
+            # 后台任务持有暂存文件，上传结束后删除；进度为 {"uploaded_bytes", "total_bytes"}
+            local_path = request.detach_spool(spool)
+            file_name = file.filename
+            md5 = spool.md5.hexdigest()
+            upload = remove_after(pan_api.upload, local_path)
+            job = job_queue.submit('upload', lambda progress: upload(
+                local_path, remote_path, file_name, max_concurrent=max_concurrent, md5=md5, duplicate=duplicate,
+                progress=lambda uploaded, total: progress({'uploaded_bytes': uploaded, 'total_bytes': total})
+            ), name=file_name)
+            return job_accepted(job)
+        
+        result = pan_api.upload(spool.name, remote_path, file.filename,
+                                max_concurrent=max_concurrent, md5=spool.md5.hexdigest(), duplicate=duplicate)
         
         if 'error' in result:
             return jsonify({'code': 400, 'message': result['error'], 'data': None}), 400
         
         return jsonify({'code': 200, 'message': '上传成功', 'data': result})
+    except HTTPException as e:
+        return jsonify({'code': e.code, 'message': e.description, 'data': None}), e.code
+    except Exception as e:
+        return jsonify({'code': 500, 'message': str(e), 'data': None}), 500
+
+@app.route('/api/upload/init', methods=['POST'])
+@require_auth
+def upload_init():
+    try:
+        data = request.get_json() or {}
+        name = data.get('name', '')
+        size = data.get('size')
+        md5 = str(data.get('md5', '')).lower()
+        
+        if not name:
+            return jsonify({'code': 400, 'message': '文件名为空', 'data': None}), 400
+        if not isinstance(size, int) or size < 0 or not re.match(r'^[0-9a-f]{32}$', md5):
+            return jsonify({'code': 400, 'message': '文件大小或MD5无效', 'data': None}), 400
+        
+        upload_config = load_config().get('upload', {})
+        max_size = upload_config.get('max_file_size')
+        if max_size and size > max_size:
+            return jsonify({'code': 413, 'message': '文件超过大小限制', 'data': None}), 413
+        
+        chunk_size = upload_config.get('chunk_size', 1024 * 1024)
+        if not isinstance(chunk_size, int) or isinstance(chunk_size, bool) or chunk_size <= 0:
+            return jsonify({'code': 500, 'message': '配置项 upload.chunk_size 必须是正整数', 'data': None}), 500
+        
+        result = pan_api.begin_upload(data.get('path', '/'), name, size, md5, chunk_size)
+        if 'error' in result:
+            return jsonify({'code': 400, 'message': result['error'], 'data': None}), 400
+        
+        result['max_concurrent'] = upload_config.get('max_concurrent', 3)
+        return jsonify({'code': 200, 'message': 'success', 'data': result})
     except Exception as e:
         return jsonify({'code': 500, 'message': str(e), 'data': None}), 500
 
+@app.route('/api/upload/chunk', methods=['POST'])
+@require_auth
+def upload_chunk():
+    try:
+        upload_id = request.args.get('upload_id', '')
+        index = request.args.get('index', type=int)
+        if index is None:
+            return jsonify({'code': 400, 'message': '块序号无效', 'data': None}), 400
+        
+        result = pan_api.upload_chunk(upload_id, index, request.get_data(cache=False))
+        if 'error' in result:
+            return jsonify({'code': 400, 'message': result['error'], 'data': None}), 400
+        
+        return jsonify({'code': 200, 'message': 'success', 'data': result})
+    except Exception as e:
+        return jsonify({'code': 500, 'message': str(e), 'data': None}), 500
+
+@app.route('/api/upload/complete', methods=['POST'])
+@require_auth
+def upload_complete():
+    try:
+        data = request.get_json() or {}
+        
+        result = pan_api.complete_upload(data.get('upload_id', ''))
+        if 'error' in result:
+            return jsonify({'code': 400, 'message': result['error'], 'data': None}), 400
+        
+        return jsonify({'code': 200, 'message': '上传成功', 'data': result})
+    except Exception as e:
+        return jsonify({'code': 500, 'message': str(e), 'data': None}), 500
+
+@app.route(BATCH_UPLOAD_PATH, methods=['POST'])
+@require_auth
+def upload_batch():
+    """
+    批量上传：表单字段files为多个文件，paths为对应的相对路径（如文件夹上传时的 相册/2024/1.jpg，
+    缺省时使用文件名），path为远程目标目录；按相对路径创建目录结构后并发上传
+    """
+    try:
+        files = request.files.getlist('files')
+        if not files:
+            return jsonify({'code': 400, 'message': '没有上传文件', 'data': None}), 400
+        
+        paths = request.form.getlist('paths')
+        if paths and len(paths) != len(files):
+            return jsonify({'code': 400, 'message': '文件与路径数量不一致', 'data': None}), 400
+        
+        run_async = wants_async()
+        batch = []
+        for i, file in enumerate(files):
+            spool = file.stream
+            spool.flush()
+            batch.append({
+                'local_path': request.detach_spool(spool) if run_async else spool.name,
+                'path': paths[i] if paths else file.filename,
+                'md5': spool.md5.hexdigest()
+            })
+        
+        upload_config = load_config().get('upload', {})
+        remote_path = request.form.get('path', '/')
+        
+        if run_async:
+            upload_batch = remove_after(pan_api.upload_batch, *[item['local_path'] for item in batch])
+            job = job_queue.submit('upload', upload_batch, batch, remote_path,
+                                   max_concurrent=upload_config.get('max_concurrent', 3),
+                                   upload_config=upload_config, name=f'{len(batch)}个文件')
+            return job_accepted(job)
+        
+        result = pan_api.upload_batch(batch, remote_path,
+                                      max_concurrent=upload_config.get('max_concurrent', 3),
+                                      upload_config=upload_config)
+        if 'error' in result:
+            return jsonify({'code': 400, 'message': result['error'], 'data': result.get('results')}), 400
+        
+        message = '上传成功' if result['status'] == 'success' else '部分文件上传失败'
+        return jsonify({'code': 200, 'message': message, 'data': result})
+    except HTTPException as e:
+        return jsonify({'code': e.code, 'message': e.description, 'data': None}), e.code
+    except Exception as e:
+        return jsonify({'code': 500, 'message': str(e), 'data': None}), 500
+
+@app.route('/api/mirror/sync', methods=['POST'])
+@require_auth
+def mirror_sync():
+    """在后台立即同步一遍元数据镜像"""
+    if not load_config().get('mirror', {}).get('enabled'):
+        return jsonify({'code': 400, 'message': '元数据镜像未启用', 'data': None}), 400
+    return job_accepted(job_queue.submit('mirror', pan_api.sync_mirror, name='镜像同步'))
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@require_auth
+def get_job(job_id):
+    snapshot = job_queue.snapshot(job_id)
+    if snapshot is None:
+        return jsonify({'code': 404, 'message': '任务不存在或已过期', 'data': None}), 404
+    return jsonify({'code': 200, 'message': 'success', 'data': snapshot[1]})
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+@require_auth
+def job_events(job_id):
+    """以server-sent events推送任务状态，每次变化发送一条，任务结束后关闭"""
+    snapshot = job_queue.snapshot(job_id)
+    if snapshot is None:
+        return jsonify({'code': 404, 'message': '任务不存在或已过期', 'data': None}), 404
+    
+    def generate():
+        version = None
+        current = snapshot
+        while current is not None:
+            if current[0] != version:
+                version, state = current
+                yield f'event: {state["status"]}\ndata: {json.dumps(state, ensure_ascii=False)}\n\n'
+                if state['status'] in ('succeeded', 'failed'):
+                    return
+            else:
+                # 长时间无进度时发送注释行，避免代理断开空闲连接
+                yield ': keep-alive\n\n'
+            current = job_queue.wait(job_id, version, timeout=15)
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/api/folder', methods=['POST'])
 @require_auth
 def create_folder():
@@ -496,7 +1050,7 @@ def search_files():
         if not keyword:
             return jsonify({'code': 400, 'message': '搜索关键词不能为空', 'data': None}), 400
         
-        result = pan_api.list_folder(path) if path != '/' else pan_api.list()
+        result = get_listing(path)
         
         if 'error' in result:
             return jsonify({'code': 400, 'message': result['error'], 'data': None}), 400
@@ -576,24 +1130,26 @@ def get_logs():
 @require_auth
 def get_stats():
     try:
-        result = pan_api.list()
+        result = get_listing('/')
         
         if 'error' in result:
             return jsonify({'code': 400, 'message': result['error'], 'data': None}), 400
         
         total_files = len(result.get('file', []))
         total_folders = len(result.get('folder', []))
+        total_size = sum(f.get('size', 0) for f in result.get('file', []))
         
         return jsonify({
             'code': 200,
             'message': 'success',
             'data': {
                 'total_files': total_files,
-                'total_folders': total_folders
+                'total_folders': total_folders,
+                'total_size': total_size
             }
         })
     except Exception as e:
         return jsonify({'code': 500, 'message': str(e), 'data': None}), 500
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=8000)
+    app.run(debug=True, host='0.0.0.0', port=8000, threaded=True)
@@ -6,6 +6,7 @@ from datetime import datetime
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', '123pan'))
 import api as original_api
+from file_entry import format_size
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 from models.permission import UserRole, Permission, check_permission, validate_path_access
@@ -57,14 +58,13 @@ class FileOperationService:
             })
         
         for item in raw_data.get('file', []):
-            size_str = item.get("size", "0B")
-            size_bytes = self._parse_size(size_str)
+            size_bytes = item.get("size", 0)
             formatted["files"].append({
                 "id": item.get("id"),
                 "name": item.get("name"),
                 "type": "file",
                 "size": size_bytes,
-                "size_formatted": size_str,
+                "size_formatted": format_size(size_bytes),
                 "extension": self._get_extension(item.get("name", "")),
                 "path": f"{path.rstrip('/')}/{item.get('name')}"
             })
@@ -73,18 +73,6 @@ class FileOperationService:
         formatted["total_count"] = len(formatted["files"]) + len(formatted["folders"])
         return formatted
     
-    def _parse_size(self, size_str: str) -> int:
-        try:
-            size_str = str(size_str).upper().strip()
-            units = {'B': 1, 'KB': 1024, 'MB': 1024**2, 'GB': 1024**3, 'TB': 1024**4}
-            for unit, multiplier in units.items():
-                if size_str.endswith(unit):
-                    value = float(size_str[:-len(unit)].strip())
-                    return int(value * multiplier)
-            return int(float(size_str))
-        except:
-            return 0
-    
     def _get_extension(self, filename: str) -> str:
         if '.' in filename:
             return filename.rsplit('.', 1)[-1].lower()
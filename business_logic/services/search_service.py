@@ -75,8 +75,7 @@ class FileSearchService:
                 if ext != file_type_filter:
                     continue
             
-            size_str = file_item.get("size", "0B")
-            size_bytes = self._parse_size(size_str)
+            size_bytes = file_item.get("size", 0)
             
             if min_size > 0 and size_bytes < min_size:
                 continue
@@ -87,18 +86,6 @@ class FileSearchService:
         
         return results
     
-    def _parse_size(self, size_str: str) -> int:
-        try:
-            size_str = str(size_str).upper().strip()
-            units = {'B': 1, 'KB': 1024, 'MB': 1024**2, 'GB': 1024**3, 'TB': 1024**4}
-            for unit, multiplier in units.items():
-                if size_str.endswith(unit):
-                    value = float(size_str[:-len(unit)].strip())
-                    return int(value * multiplier)
-            return int(float(size_str))
-        except:
-            return 0
-    
     def search_by_type(
         self,
         user_role: UserRole,
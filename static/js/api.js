@@ -1,6 +1,8 @@
 const API = {
     baseUrl: '/api',
     token: localStorage.getItem('token'),
+    // GET响应的ETag与结果，按请求地址缓存，用于条件请求
+    etagCache: new Map(),
     
     setToken(token) {
         this.token = token;
@@ -10,6 +12,7 @@ const API = {
     clearToken() {
         this.token = null;
         localStorage.removeItem('token');
+        this.etagCache.clear();
     },
     
     getHeaders() {
@@ -32,10 +35,23 @@ const API = {
             options.body = JSON.stringify(data);
         }
         
+        const cached = method === 'GET' ? this.etagCache.get(endpoint) : null;
+        if (cached) {
+            options.headers['If-None-Match'] = cached.etag;
+        }
+        
         try {
             const response = await fetch(`${this.baseUrl}${endpoint}`, options);
+            if (response.status === 304 && cached) {
+                return cached.result;
+            }
             const result = await response.json();
             
+            const etag = response.headers.get('ETag');
+            if (method === 'GET' && etag && response.ok) {
+                this.etagCache.set(endpoint, { etag, result });
+            }
+            
             if (response.status === 401) {
                 this.clearToken();
                 window.dispatchEvent(new CustomEvent('authRequired'));
@@ -128,6 +144,34 @@ const API = {
         return this.get(`/files?${params}`);
     },
     
+    async streamFiles(path = '/', onEntry) {
+        const params = new URLSearchParams({ path, stream: '1' });
+        const response = await fetch(`${this.baseUrl}/files?${params}`, { headers: this.getHeaders() });
+        if (!response.ok) {
+            return response.json();
+        }
+        
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            lines.filter(line => line).forEach(line => onEntry(JSON.parse(line)));
+        }
+        return { code: 200, message: 'success' };
+    },
+    
+    async listFilesPage(path = '/', pageSize = 20, cursor = null) {
+        const params = cursor
+            ? new URLSearchParams({ cursor })
+            : new URLSearchParams({ path, page_size: pageSize });
+        return this.get(`/list?${params}`);
+    },
+    
     async uploadFile(formData, onProgress) {
         return new Promise((resolve, reject) => {
             const xhr = new XMLHttpRequest();
@@ -155,10 +199,105 @@ const API = {
         });
     },
     
+    // 分块上传：先计算MD5发起上传，再并发发送各块，失败的块单独重试，最后确认完成
+    // onProgress(百分比, 阶段)，阶段为'hash'或'upload'
+    async uploadFileChunked(file, path, onProgress) {
+        const md5 = await MD5.hashFile(file, (loaded, total) => {
+            if (onProgress) onProgress(Math.round((loaded / total) * 100), 'hash');
+        });
+        
+        const init = await this.post('/upload/init', { path, name: file.name, size: file.size, md5 });
+        if (init.code !== 200 || init.data.reuse) {
+            return init;
+        }
+        
+        const { upload_id: uploadId, chunk_size: chunkSize, chunk_count: chunkCount } = init.data;
+        const workers = Math.max(1, init.data.max_concurrent || 3);
+        let next = 0;
+        let sent = 0;
+        
+        const sendChunk = async (index) => {
+            const blob = file.slice(index * chunkSize, Math.min((index + 1) * chunkSize, file.size));
+            for (let attempt = 0; ; attempt++) {
+                try {
+                    const response = await fetch(`${this.baseUrl}/upload/chunk?upload_id=${uploadId}&index=${index}`, {
+                        method: 'POST',
+                        headers: {
+                            'Content-Type': 'application/octet-stream',
+                            ...(this.token ? { 'Authorization': `Bearer ${this.token}` } : {})
+                        },
+                        body: blob
+                    });
+                    const result = await response.json();
+                    if (result.code === 200) return;
+                    if (attempt >= 3) throw new Error(result.message || '上传失败');
+                } catch (error) {
+                    if (attempt >= 3) throw error;
+                }
+                await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** attempt));
+            }
+        };
+        
+        const worker = async () => {
+            while (next < chunkCount) {
+                const index = next++;
+                await sendChunk(index);
+                sent++;
+                if (onProgress) onProgress(Math.round((sent / chunkCount) * 100), 'upload');
+            }
+        };
+        
+        try {
+            await Promise.all(Array.from({ length: Math.min(workers, chunkCount) }, worker));
+        } catch (error) {
+            next = chunkCount;
+            return { code: 500, message: error.message || '上传失败', data: null };
+        }
+        
+        return this.post('/upload/complete', { upload_id: uploadId });
+    },
+    
+    // 读取后台任务的事件流（EventSource无法携带认证头，这里用fetch读取），任务结束时返回最终状态
+    async watchJob(jobId, onUpdate) {
+        const response = await fetch(`${this.baseUrl}/jobs/${jobId}/events`, { headers: this.getHeaders() });
+        if (!response.ok) {
+            return response.json();
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let job = null;
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+            events.forEach(event => {
+                const data = event.split('\n').find(line => line.startsWith('data: '));
+                if (data) {
+                    job = JSON.parse(data.slice(6));
+                    if (onUpdate) onUpdate(job);
+                }
+            });
+        }
+        return { code: 200, message: 'success', data: job };
+    },
+
     async downloadFile(path) {
         return this.get(`/download?path=${encodeURIComponent(path)}`);
     },
     
+    // 由服务端转发文件内容的地址，无法访问CDN跳转地址时使用，支持Range
+    downloadStreamUrl(path) {
+        return `${this.baseUrl}/download/stream?path=${encodeURIComponent(path)}`;
+    },
+    
+    async downloadFiles(paths) {
+        return this.post('/download/batch', { paths });
+    },
+    
     async deleteFile(path) {
         return this.delete(`/files?path=${encodeURIComponent(path)}`);
     },
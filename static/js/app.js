@@ -112,7 +112,7 @@ function createFileItem(file, isFolder) {
     div.dataset.type = isFolder ? 'folder' : 'file';
     
     const icon = Utils.getFileIcon(file.name, isFolder);
-    const size = isFolder ? '' : (file.size_formatted || file.size || '');
+    const size = isFolder ? '' : (file.size_formatted || Utils.formatFileSize(file.size || 0));
     
     div.innerHTML = `
         <div class="file-icon">${icon}</div>
@@ -424,13 +424,10 @@ async function handleFileUpload(files) {
         `;
         uploadList.appendChild(item);
         
-        const formData = new FormData();
-        formData.append('file', file);
-        formData.append('path', State.currentPath);
-        
         try {
-            const result = await API.uploadFile(formData, (progress) => {
+            const result = await API.uploadFileChunked(file, State.currentPath, (progress, stage) => {
                 item.querySelector('.progress-bar').style.width = `${progress}%`;
+                item.querySelector('.status').textContent = stage === 'hash' ? '校验中...' : '上传中...';
             });
             
             if (result.code === 200 || result.success) {
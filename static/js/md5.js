@@ -0,0 +1,119 @@
+// 增量MD5，用于分块上传前在浏览器中计算文件的MD5（123pan上传请求需要）
+class MD5 {
+    constructor() {
+        this.state = new Int32Array([0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476]);
+        this.buffer = new Uint8Array(64);
+        this.bufferLength = 0;
+        this.length = 0;
+        this.words = new Int32Array(16);
+    }
+
+    update(bytes) {
+        let offset = 0;
+        this.length += bytes.length;
+
+        if (this.bufferLength > 0) {
+            const take = Math.min(64 - this.bufferLength, bytes.length);
+            this.buffer.set(bytes.subarray(0, take), this.bufferLength);
+            this.bufferLength += take;
+            offset = take;
+            if (this.bufferLength < 64) return this;
+            this._block(this.buffer, 0);
+            this.bufferLength = 0;
+        }
+
+        for (; offset + 64 <= bytes.length; offset += 64) {
+            this._block(bytes, offset);
+        }
+
+        this.buffer.set(bytes.subarray(offset), 0);
+        this.bufferLength = bytes.length - offset;
+        return this;
+    }
+
+    hex() {
+        const bitLength = this.length * 8;
+        const padding = new Uint8Array(((this.bufferLength < 56 ? 56 : 120) - this.bufferLength) + 8);
+        padding[0] = 0x80;
+        const view = new DataView(padding.buffer);
+        view.setUint32(padding.length - 8, bitLength >>> 0, true);
+        view.setUint32(padding.length - 4, Math.floor(bitLength / 0x100000000), true);
+        this.update(padding);
+
+        let out = '';
+        for (let i = 0; i < 4; i++) {
+            for (let j = 0; j < 4; j++) {
+                out += ((this.state[i] >>> (j * 8)) & 0xff).toString(16).padStart(2, '0');
+            }
+        }
+        return out;
+    }
+
+    _block(bytes, offset) {
+        const x = this.words;
+        for (let i = 0; i < 16; i++) {
+            const p = offset + i * 4;
+            x[i] = bytes[p] | (bytes[p + 1] << 8) | (bytes[p + 2] << 16) | (bytes[p + 3] << 24);
+        }
+
+        let [a, b, c, d] = this.state;
+        for (let i = 0; i < 64; i++) {
+            let f, g;
+            if (i < 16) {
+                f = (b & c) | (~b & d);
+                g = i;
+            } else if (i < 32) {
+                f = (d & b) | (~d & c);
+                g = (5 * i + 1) % 16;
+            } else if (i < 48) {
+                f = b ^ c ^ d;
+                g = (3 * i + 5) % 16;
+            } else {
+                f = c ^ (b | ~d);
+                g = (7 * i) % 16;
+            }
+            const sum = (a + f + MD5.K[i] + x[g]) | 0;
+            const s = MD5.S[i];
+            a = d;
+            d = c;
+            c = b;
+            b = (b + ((sum << s) | (sum >>> (32 - s)))) | 0;
+        }
+
+        this.state[0] += a;
+        this.state[1] += b;
+        this.state[2] += c;
+        this.state[3] += d;
+    }
+
+    // 分段读取文件计算MD5，onProgress(已读取字节数, 文件大小)
+    static async hashFile(file, onProgress, sliceSize = 4 * 1024 * 1024) {
+        const md5 = new MD5();
+        for (let start = 0; start < file.size; start += sliceSize) {
+            const slice = file.slice(start, Math.min(start + sliceSize, file.size));
+            md5.update(new Uint8Array(await slice.arrayBuffer()));
+            if (onProgress) onProgress(Math.min(start + sliceSize, file.size), file.size);
+        }
+        return md5.hex();
+    }
+}
+
+MD5.S = [
+    7, 12, 17, 22, 7, 12, 17, 22, 7, 12, 17, 22, 7, 12, 17, 22,
+    5, 9, 14, 20, 5, 9, 14, 20, 5, 9, 14, 20, 5, 9, 14, 20,
+    4, 11, 16, 23, 4, 11, 16, 23, 4, 11, 16, 23, 4, 11, 16, 23,
+    6, 10, 15, 21, 6, 10, 15, 21, 6, 10, 15, 21, 6, 10, 15, 21
+];
+
+MD5.K = new Int32Array([
+    0xd76aa478, 0xe8c7b756, 0x242070db, 0xc1bdceee, 0xf57c0faf, 0x4787c62a, 0xa8304613, 0xfd469501,
+    0x698098d8, 0x8b44f7af, 0xffff5bb1, 0x895cd7be, 0x6b901122, 0xfd987193, 0xa679438e, 0x49b40821,
+    0xf61e2562, 0xc040b340, 0x265e5a51, 0xe9b6c7aa, 0xd62f105d, 0x02441453, 0xd8a1e681, 0xe7d3fbc8,
+    0x21e1cde6, 0xc33707d6, 0xf4d50d87, 0x455a14ed, 0xa9e3e905, 0xfcefa3f8, 0x676f02d9, 0x8d2a4c8a,
+    0xfffa3942, 0x8771f681, 0x6d9d6122, 0xfde5380c, 0xa4beea44, 0x4bdecfa9, 0xf6bb4b60, 0xbebfbc70,
+    0x289b7ec6, 0xeaa127fa, 0xd4ef3085, 0x04881d05, 0xd9d4d039, 0xe6db99e5, 0x1fa27cf8, 0xc4ac5665,
+    0xf4292244, 0x432aff97, 0xab9423a7, 0xfc93a039, 0x655b59c3, 0x8f0ccc92, 0xffeff47d, 0x85845dd1,
+    0x6fa87e4f, 0xfe2ce6e0, 0xa3014314, 0x4e0811a1, 0xf7537e82, 0xbd3af235, 0x2ad7d2bb, 0xeb86d391
+]);
+
+window.MD5 = MD5;
@@ -1,9 +1,57 @@
 import unittest
 import os
 import sys
+import io
 import json
+import hashlib
+import shutil
+import tempfile
+from unittest import mock
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '123pan'))
+
+import http_transport
+import pan123
+from content_cache import ContentCache
+from hash_cache import HashCache
+from pan123 import Pan123
+from uploader import UploadSessionStore
+
+def setUpModule():
+    # 未模拟的请求会实际创建Pan123，其本地MD5缓存写到临时目录，运行测试不在仓库中留下文件
+    global _tmpdir, _patches
+    _tmpdir = tempfile.TemporaryDirectory()
+    _patches = [
+        mock.patch.dict(pan123._shared, clear=True),
+        mock.patch.object(pan123, 'HashCache', side_effect=lambda db_path, use_mmap=False:
+                          HashCache(os.path.join(_tmpdir.name, db_path), use_mmap=use_mmap))
+    ]
+    for patch in _patches:
+        patch.start()
+
+def tearDownModule():
+    for patch in _patches:
+        patch.stop()
+    _tmpdir.cleanup()
+
+def duplicate_name_pan(tmpdir):
+    """上传请求先返回同名文件（5060），再按duplicate重新请求时秒传成功
+    
+    返回 (pan, 上传请求的请求体列表, 替换http_transport.post的patch)
+    """
+    pan = Pan123.__new__(Pan123)
+    pan.header_logined = {}
+    pan.upload_workers = 2
+    pan.upload_sessions = UploadSessionStore(os.path.join(tmpdir, 'sessions.json'))
+    requests = []
+    
+    def post(url, headers=None, data=None, timeout=None):
+        requests.append(json.loads(data) if isinstance(data, str) else dict(data))
+        body = {'code': 5060} if len(requests) == 1 else {'code': 0, 'data': {'Reuse': True}}
+        return mock.Mock(**{'json.return_value': body})
+    
+    return pan, requests, mock.patch.object(http_transport, 'post', side_effect=post)
 
 class TestConfigAPI(unittest.TestCase):
     @classmethod
@@ -28,6 +76,15 @@ class TestConfigAPI(unittest.TestCase):
         self.assertEqual(data['code'], 200)
         self.assertIn('primary_color', data['data'])
     
+    def test_get_config_not_modified(self):
+        response = self.client.get('/api/config')
+        etag = response.headers['ETag']
+        response = self.client.get('/api/config', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        response = self.client.get('/api/config/theme', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+    
     def test_get_config_section_not_found(self):
         response = self.client.get('/api/config/nonexistent')
         self.assertEqual(response.status_code, 404)
@@ -91,5 +148,373 @@ class TestFileAPI(unittest.TestCase):
         response = self.client.get('/api/search')
         self.assertEqual(response.status_code, 400)
 
+class TestListingETag(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        os.environ['FLASK_ENV'] = 'testing'
+        import app as app_module
+        cls.pan_api = app_module.pan_api
+        cls.client = app_module.app.test_client()
+    
+    def test_mirror_listing_not_modified_without_reading(self):
+        listing = {'folder': [], 'file': [{'id': '1', 'name': '1.mp4', 'size': 1}]}
+        with mock.patch.object(self.pan_api, 'listing_version', return_value='v1'), \
+                mock.patch.object(self.pan_api, 'mirror_list', return_value=listing) as mirror_list:
+            response = self.client.get('/api/files?path=/videos')
+            etag = response.headers['ETag']
+            self.assertEqual(etag, '"list-v1"')
+            mirror_list.reset_mock()
+            response = self.client.get('/api/files?path=/videos', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            mirror_list.assert_not_called()
+            
+            # 分页接口的响应内容不同，不能共用ETag；不同分页参数的ETag也不同
+            response = self.client.get('/api/list?path=/videos', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            page_etag = response.headers['ETag']
+            response = self.client.get('/api/list?path=/videos', headers={'If-None-Match': page_etag})
+            self.assertEqual(response.status_code, 304)
+            response = self.client.get('/api/list?path=/videos&keyword=1', headers={'If-None-Match': page_etag})
+            self.assertEqual(response.status_code, 200)
+    
+    def test_live_listing_sees_upstream_changes(self):
+        files = [{'id': '1', 'name': 'a.mp4', 'size': 1}]
+        with mock.patch.object(self.pan_api, 'mirror_list', return_value=None), \
+                mock.patch.object(self.pan_api, 'list_folder',
+                                  side_effect=lambda path: {'folder': [], 'file': list(files)}) as list_folder:
+            response = self.client.get('/api/files?path=/v')
+            etag = response.headers['ETag']
+            # 其他客户端在123pan上新增了文件
+            files.append({'id': '2', 'name': 'b.mp4', 'size': 1})
+            response = self.client.get('/api/files?path=/v', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(json.loads(response.data)['data']['file']), 2)
+            self.assertEqual(list_folder.call_count, 2)
+
+class TestPaginatedListAPI(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        os.environ['FLASK_ENV'] = 'testing'
+        import app as app_module
+        cls.pan_api = app_module.pan_api
+        cls.client = app_module.app.test_client()
+    
+    def setUp(self):
+        self.calls = []
+        
+        def list_page(path, page, page_size, folder_id=None):
+            self.calls.append((path, page, page_size, folder_id))
+            return {
+                'folder': [], 'file': [{'id': str(page), 'name': f'{page}.mp4', 'size': 1}],
+                'total': 45, 'page': page, 'page_size': page_size, 'folder_id': 7
+            }
+        self.patches = [
+            mock.patch.object(self.pan_api, 'mirror_list', return_value=None),
+            mock.patch.object(self.pan_api, 'list_page', side_effect=list_page)
+        ]
+        for patch in self.patches:
+            patch.start()
+    
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+    
+    def test_page_pushed_down(self):
+        response = self.client.get('/api/list?path=/videos&page=2&page_size=20')
+        data = json.loads(response.data)['data']
+        self.assertEqual(self.calls, [('/videos', 2, 20, None)])
+        self.assertEqual(data['total'], 45)
+        self.assertEqual(data['files'][0]['name'], '2.mp4')
+        self.assertIsNotNone(data['next_cursor'])
+    
+    def test_cursor_skips_path_resolution(self):
+        response = self.client.get('/api/list?path=/videos&page=2&page_size=20')
+        cursor = json.loads(response.data)['data']['next_cursor']
+        response = self.client.get('/api/list?cursor=' + cursor)
+        data = json.loads(response.data)['data']
+        self.assertEqual(self.calls[-1], ('/videos', 3, 20, 7))
+        self.assertIsNone(data['next_cursor'])
+    
+    def test_unchanged_page_not_modified(self):
+        response = self.client.get('/api/list?path=/videos&page=2&page_size=20')
+        etag = response.headers['ETag']
+        response = self.client.get('/api/list?path=/videos&page=2&page_size=20',
+            headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/api/list?path=/videos&page=1&page_size=20',
+            headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+    
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/list?cursor=bogus')
+        self.assertEqual(response.status_code, 400)
+
+class TestUploadAPI(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        os.environ['FLASK_ENV'] = 'testing'
+        import app as app_module
+        cls.pan_api = app_module.pan_api
+        cls.client = app_module.app.test_client()
+        cls.headers = {'Authorization': 'Bearer ' + app_module.generate_token('admin')}
+    
+    def test_chunk_index_must_be_integer(self):
+        with mock.patch.object(self.pan_api, 'upload_chunk') as upload_chunk:
+            response = self.client.post('/api/upload/chunk?upload_id=u&index=abc', headers=self.headers, data=b'x')
+        self.assertEqual(response.status_code, 400)
+        upload_chunk.assert_not_called()
+    
+    def test_upload_spooled_once_with_md5(self):
+        content = os.urandom(300 * 1024)
+        seen = {}
+        
+        def upload(local_path, remote_path, file_name, max_concurrent=None, md5=None, duplicate=None):
+            with open(local_path, 'rb') as f:
+                seen['content'] = f.read()
+            seen.update(path=local_path, remote_path=remote_path, file_name=file_name, md5=md5)
+            return {'status': 'success'}
+        
+        with mock.patch.object(self.pan_api, 'upload', side_effect=upload):
+            response = self.client.post('/api/upload', headers=self.headers,
+                data={'file': (io.BytesIO(content), '备份.iso'), 'path': '/videos'},
+                content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(seen['content'], content)
+        self.assertEqual(seen['md5'], hashlib.md5(content).hexdigest())
+        self.assertEqual(seen['file_name'], '备份.iso')
+        self.assertEqual(seen['remote_path'], '/videos')
+        self.assertFalse(os.path.exists(seen['path']))
+    
+    def test_upload_same_name_uses_duplicate_policy(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        pan, requests, post = duplicate_name_pan(tmpdir)
+        
+        with post, mock.patch.object(self.pan_api, '_get_pan_instance', return_value=pan), \
+                mock.patch('builtins.input', side_effect=AssertionError('upload prompted for input')):
+            response = self.client.post('/api/upload', headers=self.headers,
+                data={'file': (io.BytesIO(b'data'), 'a.iso'), 'path': '/', 'duplicate': '1'},
+                content_type='multipart/form-data')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([r['duplicate'] for r in requests], [0, 1])
+            
+            response = self.client.post('/api/upload', headers=self.headers,
+                data={'file': (io.BytesIO(b'data'), 'a.iso'), 'path': '/', 'duplicate': '0'},
+                content_type='multipart/form-data')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(len(requests), 2)
+    
+    def test_batch_upload_keeps_relative_paths(self):
+        seen = {}
+        
+        def upload_batch(files, remote_path, max_concurrent=None, upload_config=None):
+            seen['files'] = [(f['path'], open(f['local_path'], 'rb').read(), f['md5']) for f in files]
+            return {'status': 'success', 'uploaded': len(files), 'failed': [], 'total_size': 3}
+        
+        with mock.patch.object(self.pan_api, 'upload_batch', side_effect=upload_batch):
+            response = self.client.post('/api/upload/batch', headers=self.headers,
+                data={'files': [(io.BytesIO(b'a'), 'a.jpg'), (io.BytesIO(b'bc'), 'b.jpg')],
+                      'paths': ['相册/a.jpg', '相册/2024/b.jpg'], 'path': '/'},
+                content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(seen['files'], [
+            ('相册/a.jpg', b'a', hashlib.md5(b'a').hexdigest()),
+            ('相册/2024/b.jpg', b'bc', hashlib.md5(b'bc').hexdigest())
+        ])
+
+class TestBatchDownloadAPI(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        os.environ['FLASK_ENV'] = 'testing'
+        import app as app_module
+        cls.pan_api = app_module.pan_api
+        cls.client = app_module.app.test_client()
+    
+    def test_batch_results(self):
+        results = {'results': [{'path': '/a/1.mp4', 'url': 'https://cdn/1'}, {'path': '/a/2.mp4', 'error': '没有找到对应文件夹或文件'}]}
+        with mock.patch.object(self.pan_api, 'parsing_batch', return_value=results) as parsing_batch:
+            response = self.client.post('/api/download/batch', json={'paths': ['/a/1.mp4', '/a/2.mp4']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['data'], results)
+        parsing_batch.assert_called_once_with(['/a/1.mp4', '/a/2.mp4'])
+    
+    def test_invalid_paths(self):
+        self.assertEqual(self.client.post('/api/download/batch', json={'paths': []}).status_code, 400)
+        self.assertEqual(self.client.post('/api/download/batch', json={'paths': ['/a'] * 501}).status_code, 400)
+
+class TestStreamDownloadAPI(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        os.environ['FLASK_ENV'] = 'testing'
+        import app as app_module
+        cls.app_module = app_module
+        cls.pan_api = app_module.pan_api
+        cls.client = app_module.app.test_client()
+    
+    def setUp(self):
+        self.body = b'0123456789'
+        self.file_info = {'FileId': 1, 'FileName': '视频 1.mp4', 'Size': 10, 'Etag': hashlib.md5(self.body).hexdigest()}
+        self.patches = [
+            mock.patch.object(self.pan_api, 'stat', return_value={'file': self.file_info}),
+            mock.patch.object(self.app_module, 'content_cache', None),
+        ]
+        for patch in self.patches:
+            patch.start()
+    
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+    
+    def upstream(self, status_code, body=b'', headers=None):
+        upstream = mock.Mock(status_code=status_code, headers=headers or {})
+        upstream.iter_content.side_effect = lambda size: (body[i:i + size] for i in range(0, len(body), size))
+        return upstream
+    
+    def full_upstream(self):
+        return {'response': self.upstream(200, self.body, {'Content-Length': '10'}), 'file': self.file_info}
+    
+    def test_range_passthrough(self):
+        upstream = self.upstream(206, self.body[2:6], {
+            'Content-Length': '4', 'Content-Range': 'bytes 2-5/10', 'ETag': '"e1"', 'Set-Cookie': 'a=b'
+        })
+        result = {'response': upstream, 'file': self.file_info}
+        with mock.patch.object(self.pan_api, 'open_stream', return_value=result) as open_stream:
+            response = self.client.get('/api/download/stream?path=/a/1.mp4',
+                                       headers={'Range': 'bytes=2-5', 'If-Range': '"e1"', 'Cookie': 'c=d'})
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response.data, b'2345')
+            response.close()
+        open_stream.assert_called_once_with('/a/1.mp4', {'Range': 'bytes=2-5', 'If-Range': '"e1"'},
+                                            file_info=self.file_info)
+        self.assertEqual(response.headers['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        self.assertNotIn('Set-Cookie', response.headers)
+        self.assertIn("filename*=UTF-8''%E8%A7%86%E9%A2%91%201.mp4", response.headers['Content-Disposition'])
+        upstream.iter_content.assert_called_once_with(64 * 1024)
+        upstream.close.assert_called_once_with()
+    
+    def test_upstream_error(self):
+        upstream = self.upstream(500)
+        with mock.patch.object(self.pan_api, 'open_stream', return_value={'response': upstream, 'file': {}}):
+            response = self.client.get('/api/download/stream?path=/a/1.mp4')
+        self.assertEqual(response.status_code, 502)
+        upstream.close.assert_called_once_with()
+    
+    def test_not_found(self):
+        with mock.patch.object(self.pan_api, 'stat', return_value={'error': '没有找到对应文件夹或文件'}):
+            self.assertEqual(self.client.get('/api/download/stream?path=/missing').status_code, 400)
+        self.assertEqual(self.client.get('/api/download/stream').status_code, 400)
+    
+    def test_served_from_cache_after_first_download(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        with mock.patch.object(self.app_module, 'content_cache', ContentCache(cache_dir, 1024)):
+            with mock.patch.object(self.pan_api, 'open_stream', return_value=self.full_upstream()):
+                response = self.client.get('/api/download/stream?path=/a/1.mp4')
+                self.assertEqual(response.data, self.body)
+                response.close()
+            
+            with mock.patch.object(self.pan_api, 'open_stream') as open_stream:
+                response = self.client.get('/api/download/stream?path=/a/1.mp4', headers={'Range': 'bytes=2-5'})
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(response.data, b'2345')
+                self.assertEqual(response.headers['Content-Range'], 'bytes 2-5/10')
+                response.close()
+                response = self.client.get('/api/download/stream?path=/a/1.mp4')
+                self.assertEqual(response.data, self.body)
+                response.close()
+            open_stream.assert_not_called()
+    
+    def test_interrupted_download_not_cached(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        cache = ContentCache(cache_dir, 1024)
+        with mock.patch.object(self.app_module, 'content_cache', cache):
+            result = self.full_upstream()
+            result['response'].iter_content.side_effect = lambda size: iter([self.body[:4]])
+            with mock.patch.object(self.pan_api, 'open_stream', return_value=result):
+                self.client.get('/api/download/stream?path=/a/1.mp4').close()
+        self.assertIsNone(cache.get(1, self.file_info['Etag']))
+        self.assertEqual(os.listdir(cache_dir), [])
+
+class TestJobAPI(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        os.environ['FLASK_ENV'] = 'testing'
+        import app as app_module
+        cls.pan_api = app_module.pan_api
+        cls.client = app_module.app.test_client()
+        cls.headers = {'Authorization': 'Bearer ' + app_module.generate_token('admin')}
+    
+    def test_async_upload_returns_job(self):
+        content = os.urandom(1024)
+        seen = {}
+        
+        def upload(local_path, remote_path, file_name, max_concurrent=None, md5=None, progress=None, duplicate=None):
+            with open(local_path, 'rb') as f:
+                seen['content'] = f.read()
+            seen['path'] = local_path
+            progress(len(content), len(content))
+            return {'status': 'success'}
+        
+        with mock.patch.object(self.pan_api, 'upload', side_effect=upload):
+            response = self.client.post('/api/upload?async=1', headers=self.headers,
+                data={'file': (io.BytesIO(content), 'a.iso'), 'path': '/'},
+                content_type='multipart/form-data')
+            self.assertEqual(response.status_code, 202)
+            job_id = response.get_json()['data']['id']
+            self.assertEqual(response.headers['Location'], f'/api/jobs/{job_id}')
+            
+            events = self.client.get(f'/api/jobs/{job_id}/events', headers=self.headers).get_data(as_text=True)
+        
+        self.assertIn('event: succeeded', events)
+        job = self.client.get(f'/api/jobs/{job_id}', headers=self.headers).get_json()['data']
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(job['progress'], {'uploaded_bytes': 1024, 'total_bytes': 1024})
+        self.assertEqual(seen['content'], content)
+        # 暂存文件在任务结束后删除
+        self.assertFalse(os.path.exists(seen['path']))
+    
+    def test_async_upload_with_same_name_finishes(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        pan, requests, post = duplicate_name_pan(tmpdir)
+        
+        # 后台任务中没有终端，等待输入会一直占用上传并发数
+        with post, mock.patch.object(self.pan_api, '_get_pan_instance', return_value=pan), \
+                mock.patch('builtins.input', side_effect=AssertionError('upload prompted for input')):
+            response = self.client.post('/api/upload?async=1', headers=self.headers,
+                data={'file': (io.BytesIO(b'data'), 'a.iso'), 'path': '/'},
+                content_type='multipart/form-data')
+            job_id = response.get_json()['data']['id']
+            events = self.client.get(f'/api/jobs/{job_id}/events', headers=self.headers).get_data(as_text=True)
+        
+        self.assertIn('event: succeeded', events)
+        self.assertEqual([r['duplicate'] for r in requests], [0, 2])
+    
+    def test_unknown_job(self):
+        response = self.client.get('/api/jobs/missing', headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+
+class TestStreamingListAPI(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        os.environ['FLASK_ENV'] = 'testing'
+        import app as app_module
+        cls.pan_api = app_module.pan_api
+        cls.client = app_module.app.test_client()
+    
+    def test_stream_ndjson(self):
+        entries = iter([
+            {'type': 'folder', 'id': '1', 'name': '第三季'},
+            {'type': 'file', 'id': '4', 'name': '1.mp4', 'size': 3758096384}
+        ])
+        with mock.patch.object(self.pan_api, 'mirror_list', return_value=None), \
+                mock.patch.object(self.pan_api, 'stream_list', return_value={'entries': entries}):
+            response = self.client.get('/api/files?path=/a&stream=1')
+            lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual([json.loads(line)['name'] for line in lines], ['第三季', '1.mp4'])
+
 if __name__ == '__main__':
     unittest.main()
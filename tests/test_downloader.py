@@ -0,0 +1,221 @@
+import unittest
+import os
+import sys
+import json
+import hashlib
+import tempfile
+import threading
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '123pan'))
+
+import downloader
+from content_cache import ContentCache
+from downloader import DownloadError, RangedDownload
+
+class FakeResponse:
+    def __init__(self, status_code, body=b"", headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = dict(headers or {})
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class FakeCDN:
+    """模拟支持Range的下载地址，记录请求的分段与同时在传的请求数"""
+    def __init__(self, content, ranged=True, fail_times=None, expired_urls=()):
+        self.content = content
+        self.ranged = ranged
+        self.fail_times = dict(fail_times or {})
+        self.expired_urls = set(expired_urls)
+        self.ranges = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def get(self, url, headers=None, stream=False, timeout=None):
+        if url in self.expired_urls:
+            return FakeResponse(403)
+        size = len(self.content)
+        match = (headers or {}).get("Range")
+        if not self.ranged or match is None:
+            return FakeResponse(200, self.content, {"Content-Length": str(size)})
+        start, end = (int(x) for x in match[len("bytes="):].split("-"))
+        if start >= size:
+            return FakeResponse(416)
+        end = min(end, size - 1)
+        with self.lock:
+            self.ranges.append((start, end))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        threading.Event().wait(0.01)
+        with self.lock:
+            self.in_flight -= 1
+            if self.fail_times.get(start):
+                self.fail_times[start] -= 1
+                return FakeResponse(500)
+        return FakeResponse(206, self.content[start:end + 1],
+                            {"Content-Range": "bytes %d-%d/%d" % (start, end, size)})
+
+class TestRangedDownload(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "image.bin")
+        self.content = os.urandom(1000)
+        self.etag = hashlib.md5(self.content).hexdigest()
+        self.patches = [mock.patch.object(downloader.time, "sleep")]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        for name in os.listdir(self.dir):
+            os.remove(os.path.join(self.dir, name))
+        os.rmdir(self.dir)
+
+    def run_download(self, cdn, urls=None, **kwargs):
+        urls = iter(urls or ["https://cdn/file"])
+        kwargs.setdefault("size", len(cdn.content))
+        kwargs.setdefault("etag", self.etag)
+        task = RangedDownload(lambda: next(urls), self.path, segment_size=100, workers=4, **kwargs)
+        with mock.patch.object(downloader.http_transport, "get", cdn.get):
+            return task.run()
+
+    def read(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def test_segments_downloaded_concurrently(self):
+        cdn = FakeCDN(self.content)
+        self.assertEqual(self.run_download(cdn), self.path)
+        self.assertEqual(self.read(), self.content)
+        # 探测请求加10个分段
+        self.assertEqual(len(cdn.ranges), 11)
+        self.assertGreater(cdn.max_in_flight, 1)
+        self.assertLessEqual(cdn.max_in_flight, 4)
+        self.assertFalse(os.path.exists(self.path + ".part"))
+        self.assertFalse(os.path.exists(self.path + ".part.json"))
+
+    def test_failed_segment_retried(self):
+        cdn = FakeCDN(self.content, fail_times={300: 2})
+        self.run_download(cdn)
+        self.assertEqual(self.read(), self.content)
+        self.assertEqual(cdn.ranges.count((300, 399)), 3)
+
+    def test_resume_from_segment_map(self):
+        cdn = FakeCDN(self.content, fail_times={500: 10})
+        with self.assertRaises(DownloadError):
+            self.run_download(cdn)
+        with open(self.path + ".part.json", encoding="utf-8") as f:
+            done = json.load(f)["done"]
+        self.assertNotIn(5, done)
+        self.assertFalse(os.path.exists(self.path))
+
+        cdn = FakeCDN(self.content)
+        self.run_download(cdn)
+        self.assertEqual(self.read(), self.content)
+        fetched = {start // 100 for start, end in cdn.ranges[1:]}
+        self.assertIn(5, fetched)
+        self.assertFalse(fetched & set(done))
+
+    def test_segment_map_ignored_when_file_changed(self):
+        with open(self.path + ".part", "wb") as f:
+            f.write(b"\0" * 1000)
+        with open(self.path + ".part.json", "w", encoding="utf-8") as f:
+            json.dump({"size": 1000, "etag": "0" * 32, "segment_size": 100, "done": list(range(10))}, f)
+        cdn = FakeCDN(self.content)
+        self.run_download(cdn)
+        self.assertEqual(self.read(), self.content)
+        self.assertEqual(len(cdn.ranges), 11)
+
+    def test_md5_mismatch(self):
+        cdn = FakeCDN(self.content)
+        with self.assertRaises(DownloadError):
+            self.run_download(cdn, etag="0" * 32)
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_expired_link_refreshed(self):
+        cdn = FakeCDN(self.content, expired_urls={"https://cdn/old"})
+        self.run_download(cdn, urls=["https://cdn/old", "https://cdn/new"])
+        self.assertEqual(self.read(), self.content)
+
+    def test_stream_fallback_without_range(self):
+        cdn = FakeCDN(self.content, ranged=False)
+        progress = []
+        task = RangedDownload(lambda: "https://cdn/file", self.path, etag=self.etag, segment_size=100)
+        with mock.patch.object(downloader.http_transport, "get", cdn.get):
+            task.run(lambda done, total: progress.append((done, total)))
+        self.assertEqual(self.read(), self.content)
+        self.assertEqual(progress[-1], (1000, 1000))
+
+    def test_empty_file(self):
+        cdn = FakeCDN(b"")
+        self.run_download(cdn, etag=hashlib.md5(b"").hexdigest())
+        self.assertEqual(self.read(), b"")
+
+class TestContentCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for name in os.listdir(self.dir):
+            os.remove(os.path.join(self.dir, name))
+        os.rmdir(self.dir)
+
+    def add(self, cache, file_id, content):
+        etag = hashlib.md5(content).hexdigest()
+        fill = cache.fill(file_id, etag, len(content))
+        fill.write(content)
+        self.assertTrue(fill.commit())
+        return etag
+
+    def test_lru_within_budget(self):
+        cache = ContentCache(self.dir, 250)
+        etags = [self.add(cache, i, bytes([i]) * 100) for i in range(2)]
+        cache.get(0, etags[0])
+        etags.append(self.add(cache, 2, b"\2" * 100))
+        self.assertIsNone(cache.get(1, etags[1]))
+        with open(cache.get(0, etags[0]), "rb") as f:
+            self.assertEqual(f.read(), b"\0" * 100)
+        self.assertEqual(len(os.listdir(self.dir)), 2)
+
+    def test_reload_keeps_entries(self):
+        cache = ContentCache(self.dir, 1000)
+        etag = self.add(cache, 7, b"data")
+        with open(os.path.join(self.dir, "7_%s.abc.tmp" % etag), "wb") as f:
+            f.write(b"partial")
+        cache = ContentCache(self.dir, 1000)
+        self.assertIsNotNone(cache.get(7, etag))
+        self.assertEqual(os.listdir(self.dir), ["7_" + etag])
+
+    def test_mismatch_rejected(self):
+        cache = ContentCache(self.dir, 1000)
+        etag = hashlib.md5(b"data").hexdigest()
+        fill = cache.fill(1, etag, 4)
+        self.assertIsNone(cache.fill(1, etag, 4))
+        fill.write(b"dat!")
+        self.assertFalse(fill.commit())
+        self.assertIsNone(cache.get(1, etag))
+        self.assertEqual(os.listdir(self.dir), [])
+        # 放弃后可以重新写入
+        self.assertIsNotNone(cache.fill(1, etag, 4))
+
+    def test_uncacheable(self):
+        cache = ContentCache(self.dir, 10)
+        self.assertIsNone(cache.fill(1, hashlib.md5(b"x" * 11).hexdigest(), 11))
+        self.assertIsNone(cache.fill(1, "not-md5", 1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '123pan'))
+
+from jobs import JobQueue
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.queue = JobQueue({"upload": 2, "mirror": 1})
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.queue.shutdown()
+
+    def _wait_finished(self, job):
+        version, state = self.queue.snapshot(job.id)
+        while state["status"] not in ("succeeded", "failed"):
+            version, state = self.queue.wait(job.id, version, timeout=5)
+        return state
+
+    def test_limit_per_job_type(self):
+        running = {"upload": 0, "mirror": 0}
+        peak = {"upload": 0, "mirror": 0}
+        lock = threading.Lock()
+
+        def task(job_type, progress):
+            with lock:
+                running[job_type] += 1
+                peak[job_type] = max(peak[job_type], running[job_type])
+            self.release.wait(0.05)
+            with lock:
+                running[job_type] -= 1
+            return {"status": "success"}
+
+        jobs = [self.queue.submit(t, task, t) for t in ["upload"] * 5 + ["mirror"] * 3]
+        for job in jobs:
+            self.assertEqual(self._wait_finished(job)["status"], "succeeded")
+        self.assertEqual(peak, {"upload": 2, "mirror": 1})
+
+    def test_progress_and_result(self):
+        def task(progress):
+            progress({"uploaded_bytes": 5, "total_bytes": 10})
+            self.release.wait()
+            return {"status": "success"}
+
+        job = self.queue.submit("upload", task, name="a.iso")
+        version, state = self.queue.snapshot(job.id)
+        while state["progress"] is None:
+            version, state = self.queue.wait(job.id, version, timeout=5)
+        self.assertEqual(state["status"], "running")
+        self.assertEqual(state["progress"], {"uploaded_bytes": 5, "total_bytes": 10})
+        self.release.set()
+        state = self._wait_finished(job)
+        self.assertEqual(state["result"], {"status": "success"})
+        self.assertEqual(state["name"], "a.iso")
+
+    def test_error_result_and_exception_fail_job(self):
+        failed = self.queue.submit("upload", lambda progress: {"error": "远程路径不存在"})
+        raised = self.queue.submit("upload", lambda progress: 1 / 0)
+        self.assertEqual(self._wait_finished(failed)["error"], "远程路径不存在")
+        self.assertEqual(self._wait_finished(raised)["status"], "failed")
+
+    def test_finished_jobs_pruned(self):
+        self.queue.keep_finished = 0
+        job = self.queue.submit("upload", lambda progress: None)
+        self._wait_finished(job)
+        self.queue.submit("upload", lambda progress: None)
+        self.assertIsNone(self.queue.get(job.id))
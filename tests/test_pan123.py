@@ -0,0 +1,467 @@
+import unittest
+import os
+import sys
+import time
+import tempfile
+import threading
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '123pan'))
+
+import api as pan_api
+import http_transport
+import pan123
+from hash_cache import HashCache
+from pan123 import Pan123
+from path_index import PathIndex
+from mirror import MetadataMirror
+from file_entry import FileEntry, format_size
+from link_cache import LinkCache, url_expiry
+
+def _folder(file_id, name):
+    return {"FileId": file_id, "FileName": name, "Type": 1, "Size": 0}
+
+def _file(file_id, name, size=0):
+    return {"FileId": file_id, "FileName": name, "Type": 0, "Size": size, "Etag": "e%d" % file_id, "S3KeyFlag": ""}
+
+class FakePan:
+    """按 parent_id 返回固定目录内容的 Pan123 替身，记录列目录次数"""
+    def __init__(self, tree):
+        self.tree = tree
+        self.calls = []
+
+    def fetch_dir(self, parent_file_id):
+        self.calls.append(parent_file_id)
+        return 0, [dict(item) for item in self.tree.get(parent_file_id, [])]
+
+    def link_detail(self, file_detail, showlink=True):
+        self.calls.append(("link", file_detail["FileId"]))
+        return "https://cdn.example/%d?t=%d&s=x" % (file_detail["FileId"], int(time.time()) + 3600)
+
+    def trash_file(self, file_detail, operation=True):
+        self.calls.append(("trash", file_detail["FileId"]))
+
+TREE = {
+    0: [_folder(1, "学习资料"), _file(2, "readme.txt", 10)],
+    1: [_folder(3, "小猪佩奇全集")],
+    3: [_file(4, "1.mp4", 3 * 1024 ** 3)],
+}
+
+class TestPathIndex(unittest.TestCase):
+    def test_put_listing_and_get(self):
+        index = PathIndex(ttl=60)
+        index.put_listing(0, TREE[0])
+        self.assertEqual(index.get(0, "学习资料")["FileId"], 1)
+        self.assertIsNone(index.get(0, "missing"))
+
+    def test_ttl_expired(self):
+        index = PathIndex(ttl=0.01)
+        index.put_listing(0, TREE[0])
+        time.sleep(0.02)
+        self.assertIsNone(index.get(0, "学习资料"))
+
+    def test_invalidate_tree(self):
+        index = PathIndex(ttl=60)
+        index.put_listing(0, TREE[0])
+        index.put_listing(1, TREE[1])
+        index.put_listing(3, TREE[3])
+        index.invalidate_tree(1)
+        self.assertIsNone(index.get(1, "小猪佩奇全集"))
+        self.assertIsNone(index.get(3, "1.mp4"))
+        self.assertIsNotNone(index.get(0, "学习资料"))
+
+    def test_lru_bound(self):
+        index = PathIndex(ttl=60, max_entries=2)
+        index.put_listing(0, TREE[0])
+        index.get(0, "学习资料")
+        index.put_listing(1, TREE[1])
+        self.assertIsNone(index.get(0, "readme.txt"))
+        self.assertIsNotNone(index.get(0, "学习资料"))
+        self.assertIsNotNone(index.get(1, "小猪佩奇全集"))
+
+    def test_expired_listings_purged(self):
+        index = PathIndex(ttl=0.01)
+        index.put_listing(0, TREE[0])
+        index.put_listing(1, TREE[1])
+        time.sleep(0.02)
+        index.put_listing(3, TREE[3])
+        self.assertEqual(set(index._entries), {(3, "1.mp4")})
+        self.assertEqual(set(index._children), {3})
+
+class TestSharedResources(unittest.TestCase):
+    def test_relogin_reuses_pool_and_hash_cache(self):
+        # MD5缓存写到临时目录，共享资源只在本测试内有效，运行测试不在仓库中留下文件
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        
+        def hash_cache(db_path, use_mmap=False):
+            return HashCache(os.path.join(tmpdir.name, db_path), use_mmap=use_mmap)
+        
+        with mock.patch.dict(pan123._shared, clear=True), \
+                mock.patch.object(pan123, "HashCache", side_effect=hash_cache), \
+                mock.patch.object(Pan123, "get_dir", return_value=0):
+            first = Pan123(readfile=False, user_name="u", pass_word="p")
+            second = Pan123(readfile=False, user_name="u", pass_word="p")
+        self.addCleanup(first._dir_pool.shutdown)
+        self.assertIs(first._dir_pool, second._dir_pool)
+        self.assertIs(first.hash_cache, second.hash_cache)
+        self.assertEqual(os.listdir(tmpdir.name), ["hash_cache.db"])
+
+class TestFileEntry(unittest.TestCase):
+    def test_listing_keeps_raw_values(self):
+        result = pan_api._format_listing([_folder(1, "学习资料"), _file(4, "1.mp4", 3 * 1024 ** 3 + 1)])
+        self.assertEqual(result["folder"][0]["id"], "1")
+        self.assertEqual(result["file"][0]["size"], 3 * 1024 ** 3 + 1)
+        self.assertEqual(result["file"][0]["etag"], "e4")
+    
+    def test_format_size(self):
+        self.assertEqual(format_size(512), "512B")
+        self.assertEqual(format_size(1536), "1.5KB")
+        self.assertEqual(format_size(FileEntry.from_item(_file(4, "1.mp4", 3 * 1024 ** 3)).size), "3.0GB")
+
+class TestPathResolution(unittest.TestCase):
+    def setUp(self):
+        self.pan = FakePan(TREE)
+        pan_api._pan_instance = self.pan
+        pan_api._path_index.clear()
+        pan_api._missing_paths.clear()
+
+    def tearDown(self):
+        pan_api._pan_instance = None
+        pan_api._path_index.clear()
+        pan_api._missing_paths.clear()
+
+    def test_repeat_lookup_no_remote_calls(self):
+        self.assertEqual(pan_api._get_file_by_path("/学习资料/小猪佩奇全集/1.mp4"), 4)
+        self.assertEqual(self.pan.calls, [0, 1, 3])
+        self.assertEqual(pan_api._get_file_by_path("/学习资料/小猪佩奇全集/1.mp4"), 4)
+        self.assertEqual(self.pan.calls, [0, 1, 3])
+
+    def test_cold_lookup_lists_missing_segments_only(self):
+        pan_api._get_file_by_path("/学习资料")
+        self.pan.calls.clear()
+        pan_api._get_file_by_path("/学习资料/小猪佩奇全集/1.mp4")
+        self.assertEqual(self.pan.calls, [1, 3])
+
+    def test_missing_path(self):
+        self.assertIsNone(pan_api._get_file_by_path("/学习资料/不存在"))
+
+    def test_repeat_miss_no_remote_calls(self):
+        self.assertIsNone(pan_api._get_file_by_path("/学习资料/不存在"))
+        pan_api._path_index.clear()
+        self.pan.calls.clear()
+        self.assertIsNone(pan_api._get_file_by_path("/学习资料//不存在/"))
+        self.assertIsNone(pan_api._get_file_by_path("/学习资料/不存在/1.mp4"))
+        self.assertEqual(self.pan.calls, [])
+
+    def test_names_containing_dots(self):
+        self.pan.tree = {
+            **TREE,
+            0: TREE[0] + [_file(5, "notes..txt"), _file(6, "notestxt"), _folder(7, "a..b")],
+            7: [_file(8, "Season 1...part2.mkv")],
+        }
+        self.assertEqual(pan_api._get_file_by_path("/notes..txt"), 5)
+        self.assertEqual(pan_api._get_file_by_path("/a..b/Season 1...part2.mkv"), 8)
+        self.assertIsNone(pan_api._get_file_by_path("/a..b/Season 1.part2.mkv"))
+        pan_api._link_cache.clear()
+        results = pan_api.parsing_batch(["/notes..txt", "/a..b/Season 1...part2.mkv"])["results"]
+        self.assertTrue(results[0]["url"].startswith("https://cdn.example/5?"))
+        self.assertTrue(results[1]["url"].startswith("https://cdn.example/8?"))
+
+    def test_delete_dotted_name_trashes_that_file(self):
+        self.pan.tree = {**TREE, 0: TREE[0] + [_file(5, "notes..txt"), _file(6, "notestxt")]}
+        self.assertEqual(pan_api.delete("/notes..txt"), {"status": "success"})
+        self.assertIn(("trash", 5), self.pan.calls)
+        self.assertNotIn(("trash", 6), self.pan.calls)
+
+    def test_no_listing_version_without_mirror(self):
+        # 实时读取的目录没有版本号，123pan上的修改由响应内容判断
+        pan_api._get_file_by_path("/学习资料/小猪佩奇全集")
+        self.pan.calls.clear()
+        self.assertIsNone(pan_api.listing_version("/学习资料"))
+        self.assertEqual(self.pan.calls, [])
+
+    def test_create_under_parent_clears_miss(self):
+        self.assertIsNone(pan_api._get_file_by_path("/学习资料/不存在"))
+        self.pan.tree = {**TREE, 1: TREE[1] + [_folder(9, "不存在")]}
+        pan_api._invalidate(1, "不存在")
+        self.assertEqual(pan_api._get_file_by_path("/学习资料/不存在"), 9)
+
+    def test_invalidated_segment_relists_parent_only(self):
+        pan_api._get_file_by_path("/学习资料/小猪佩奇全集")
+        pan_api._path_index.invalidate(1, "小猪佩奇全集")
+        self.pan.calls.clear()
+        pan_api._get_file_by_path("/学习资料/小猪佩奇全集")
+        self.assertEqual(self.pan.calls, [1])
+
+    def test_concurrent_lookups_do_not_interfere(self):
+        paths = {"/学习资料/小猪佩奇全集/1.mp4": 4, "/readme.txt": 2, "/学习资料": 1}
+        
+        def lookup(path):
+            pan_api._path_index.clear()
+            return pan_api._get_file_by_path(path)
+        
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            jobs = [(path, pool.submit(lookup, path)) for path in paths for _ in range(30)]
+            for path, job in jobs:
+                self.assertEqual(job.result(), paths[path])
+
+class TestLinkCache(unittest.TestCase):
+    def setUp(self):
+        self.pan = FakePan(TREE)
+        pan_api._pan_instance = self.pan
+        pan_api._path_index.clear()
+        pan_api._link_cache.clear()
+
+    def tearDown(self):
+        pan_api._pan_instance = None
+        pan_api._path_index.clear()
+        pan_api._link_cache.clear()
+
+    def test_url_expiry(self):
+        self.assertEqual(url_expiry("https://cdn/a?v=3&t=1900000000&s=ab"), 1900000000)
+        self.assertEqual(url_expiry("https://cdn/a?auth_key=1900000000-0-0-abc"), 1900000000)
+        self.assertEqual(url_expiry("https://s3/a?X-Amz-Date=20300101T000000Z&X-Amz-Expires=600"), 1893456600)
+        self.assertIsNone(url_expiry("https://cdn/a?t=12&filename=1.mp4"))
+
+    def test_expiry_margin_and_etag(self):
+        cache = LinkCache(margin=60)
+        cache.put(4, "e4", "https://cdn/a?t=%d" % (int(time.time()) + 30))
+        self.assertIsNone(cache.get(4, "e4"))
+        cache.put(4, "e4", "https://cdn/a?t=%d" % (int(time.time()) + 3600))
+        self.assertIsNotNone(cache.get(4, "e4"))
+        self.assertIsNone(cache.get(4, "changed"))
+        # 无法识别失效时间时按默认有效期缓存
+        cache.put(2, "e2", "https://cdn/b?t=1")
+        self.assertEqual(cache.get(2, "e2"), "https://cdn/b?t=1")
+
+    def test_lru_eviction(self):
+        cache = LinkCache(max_entries=2)
+        cache.put(1, "", "https://cdn/1")
+        cache.put(2, "", "https://cdn/2")
+        cache.get(1, "")
+        cache.put(3, "", "https://cdn/3")
+        self.assertIsNone(cache.get(2, ""))
+        self.assertIsNotNone(cache.get(1, ""))
+
+    def test_parsing_resolves_link_once(self):
+        first = pan_api.parsing("/学习资料/小猪佩奇全集/1.mp4")
+        self.pan.calls.clear()
+        self.assertEqual(pan_api.parsing("/学习资料/小猪佩奇全集/1.mp4"), first)
+        self.assertEqual(self.pan.calls, [])
+
+    def test_deleted_file_link_dropped(self):
+        pan_api.parsing("/readme.txt")
+        pan_api._invalidate(0, "readme.txt", removed_id=2)
+        self.assertIsNone(pan_api._link_cache.get(2, "e2"))
+
+    def test_stream_refreshes_expired_link(self):
+        responses = [mock.Mock(status_code=403), mock.Mock(status_code=206)]
+        with mock.patch.object(pan_api.http_transport, "get", side_effect=responses) as get:
+            result = pan_api.open_stream("/readme.txt", {"Range": "bytes=0-9"})
+        self.assertIs(result["response"], responses[1])
+        self.assertEqual(result["file"]["FileId"], 2)
+        responses[0].close.assert_called_once_with()
+        self.assertEqual(self.pan.calls.count(("link", 2)), 2)
+        self.assertEqual(get.call_args.kwargs["headers"], {"Range": "bytes=0-9", "Accept-Encoding": "identity"})
+        self.assertTrue(get.call_args.kwargs["stream"])
+
+class TestBatchDownload(unittest.TestCase):
+    def setUp(self):
+        tree = {**TREE, 3: [_file(10 + n, "%d.mp4" % n) for n in range(1, 21)]}
+        self.pan = FakePan(tree)
+        pan_api._pan_instance = self.pan
+        pan_api._path_index.clear()
+        pan_api._missing_paths.clear()
+        pan_api._link_cache.clear()
+
+    def tearDown(self):
+        pan_api._pan_instance = None
+        pan_api._path_index.clear()
+        pan_api._link_cache.clear()
+
+    def test_grouped_by_folder_in_order(self):
+        paths = ["/学习资料/小猪佩奇全集/%d.mp4" % n for n in range(1, 21)]
+        paths += ["/readme.txt", "/学习资料/小猪佩奇全集/99.mp4", "/学习资料", "/不存在/1.mp4"]
+        results = pan_api.parsing_batch(paths, max_workers=4)["results"]
+        self.assertEqual([r["path"] for r in results], paths)
+        self.assertTrue(results[0]["url"].startswith("https://cdn.example/11?"))
+        self.assertIn("url", results[20])
+        self.assertEqual([("error" in r) for r in results[21:]], [True, True, True])
+        # 同一目录下的文件只列出该目录一次
+        listed = [c for c in self.pan.calls if not isinstance(c, tuple)]
+        self.assertEqual((listed.count(1), listed.count(3)), (1, 1))
+        self.assertEqual(len([c for c in self.pan.calls if isinstance(c, tuple)]), 21)
+
+class TestFetchDir(unittest.TestCase):
+    def _make_pan(self, total, server_limit):
+        items = [_file(i, "f%d" % i) for i in range(total)]
+        pan = Pan123.__new__(Pan123)
+        pan.page_size = 100
+        pan.dir_workers = 4
+        pan._dir_pool = ThreadPoolExecutor(max_workers=4)
+        pan.requested = []
+        
+        def get_dir_page(parent_file_id, page, limit):
+            pan.requested.append((page, limit))
+            limit = min(limit, server_limit)
+            start = (page - 1) * limit
+            return 0, {"InfoList": [dict(i) for i in items[start:start + limit]], "Total": total}
+        pan._get_dir_page = get_dir_page
+        return pan
+    
+    def test_pages_merged_in_order(self):
+        pan = self._make_pan(total=450, server_limit=100)
+        code, lists = pan.fetch_dir(0)
+        self.assertEqual(code, 0)
+        self.assertEqual([i["FileId"] for i in lists], list(range(450)))
+        self.assertEqual(sorted(p for p, _ in pan.requested), [1, 2, 3, 4, 5])
+    
+    def test_follows_server_page_limit(self):
+        pan = self._make_pan(total=250, server_limit=50)
+        code, lists = pan.fetch_dir(0)
+        self.assertEqual(len(lists), 250)
+        self.assertEqual([i["FileNum"] for i in lists], list(range(250)))
+        self.assertTrue(all(limit == 50 for page, limit in pan.requested if page > 1))
+
+    def test_iter_dir_yields_first_page_before_fetching_rest(self):
+        pan = self._make_pan(total=1000, server_limit=100)
+        pages = pan.iter_dir(0)
+        first = next(pages)
+        self.assertEqual(len(first), 100)
+        self.assertEqual(pan.requested, [(1, 100)])
+        self.assertEqual(sum(len(p) for p in pages) + len(first), 1000)
+    
+    def test_error_page_reported(self):
+        pan = self._make_pan(total=300, server_limit=100)
+        pan._get_dir_page = lambda parent_file_id, page, limit: (
+            (0, {"InfoList": [_file(page * 1000 + i, "f") for i in range(100)], "Total": 300}) if page == 1 else (401, None)
+        )
+        self.assertEqual(pan.fetch_dir(0), (401, []))
+
+class TestMetadataMirror(unittest.TestCase):
+    def setUp(self):
+        self.tree = {k: [dict(i) for i in v] for k, v in TREE.items()}
+        self.fetched = []
+        
+        def fetch_dir(parent_id):
+            self.fetched.append(parent_id)
+            return 0, [dict(i) for i in self.tree.get(parent_id, [])]
+        self.mirror = MetadataMirror(":memory:", fetch_dir, sync_interval=600)
+    
+    def test_sync_and_resolve(self):
+        self.mirror.sync_once()
+        self.assertEqual(sorted(self.fetched), [0, 1, 3])
+        self.assertEqual(self.mirror.resolve("/学习资料/小猪佩奇全集/1.mp4")["FileId"], 4)
+        self.assertEqual(self.mirror.resolve("/学习资料/不存在"), {})
+        self.assertEqual([i["FileId"] for i in self.mirror.list_dir(3)], [4])
+    
+    def test_fresh_folders_not_refetched(self):
+        self.mirror.sync_once()
+        self.fetched.clear()
+        self.mirror.sync_once()
+        self.assertEqual(self.fetched, [])
+    
+    def test_unsynced_folder_returns_none(self):
+        self.assertIsNone(self.mirror.resolve("/学习资料"))
+        self.assertIsNone(self.mirror.list_dir(0))
+    
+    def test_removed_folder_drops_subtree(self):
+        self.mirror.sync_once()
+        self.tree[0] = [i for i in self.tree[0] if i["FileId"] != 1]
+        self.mirror.mark_dirty(0)
+        self.mirror.sync_once()
+        self.assertEqual(self.mirror.resolve("/学习资料"), {})
+        self.assertIsNone(self.mirror.list_dir(3))
+    
+    def age(self, seconds):
+        with self.mirror._conn:
+            self.mirror._conn.execute("UPDATE folders SET synced_at = synced_at - ?", (seconds,))
+    
+    def test_only_recently_read_folders_refreshed(self):
+        self.mirror.sync_once()
+        self.age(700)
+        self.mirror.list_dir(3)
+        self.fetched.clear()
+        self.mirror.sync_once()
+        self.assertEqual(self.fetched, [3])
+    
+    def test_cold_folder_not_answered(self):
+        self.mirror.sync_once()
+        self.age(1300)
+        self.assertIsNone(self.mirror.list_dir(3))
+        self.fetched.clear()
+        self.mirror.sync_once()
+        self.assertEqual(self.fetched, [3])
+        self.assertEqual([i["FileId"] for i in self.mirror.list_dir(3)], [4])
+    
+    def test_refresh_capped_per_pass(self):
+        self.mirror.max_refresh = 2
+        self.assertEqual(self.mirror.sync_once(), 2)
+        self.assertEqual(self.mirror.sync_once(), 1)
+        self.assertEqual(sorted(self.fetched), [0, 1, 3])
+    
+    def test_mirror_list_formats_listing(self):
+        self.mirror.sync_once()
+        pan_api._mirror = self.mirror
+        try:
+            result = pan_api.mirror_list("/学习资料/小猪佩奇全集")
+        finally:
+            pan_api._mirror = None
+        self.assertEqual(result["file"][0]["name"], "1.mp4")
+        self.assertEqual(result["file"][0]["size"], 3 * 1024 ** 3)
+        self.assertEqual(result["file"][0]["etag"], "e4")
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    peers = set()
+    
+    def do_GET(self):
+        _KeepAliveHandler.peers.add(self.client_address)
+        body = b'{"code": 0}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, *args):
+        pass
+
+class TestHttpTransport(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = "http://127.0.0.1:%d/b/api/test" % cls.server.server_address[1]
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+    
+    def setUp(self):
+        http_transport.configure(pool_maxsize=4)
+        http_transport.reset_stats()
+        _KeepAliveHandler.peers.clear()
+    
+    def test_connections_reused(self):
+        for _ in range(5):
+            self.assertEqual(http_transport.get(self.url, timeout=5).json()["code"], 0)
+        self.assertEqual(len(_KeepAliveHandler.peers), 1)
+    
+    def test_timing_hook_and_stats(self):
+        timings = []
+        hook = lambda method, url, status, elapsed: timings.append((method, status))
+        http_transport.add_timing_hook(hook)
+        try:
+            http_transport.get(self.url, timeout=5)
+        finally:
+            http_transport.remove_timing_hook(hook)
+        self.assertEqual(timings, [("GET", 200)])
+        self.assertEqual(http_transport.get_stats()["/b/api/test"]["count"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,500 @@
+import unittest
+import os
+import sys
+import json
+import hashlib
+import tempfile
+import threading
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '123pan'))
+
+import api as pan_api
+import uploader
+import hash_cache
+from hash_cache import HashCache
+from pan123 import Pan123
+from uploader import (BatchProgress, ChunkedUpload, MultipartUpload, ThroughputMeter, UploadError,
+                      UploadSessionStore, choose_part_size)
+
+SESSION = {"Bucket": "b", "Key": "k", "UploadId": "u", "StorageNode": "s", "FileId": 42}
+
+class FakeS3:
+    """模拟123pan上传相关接口与分片PUT，记录调用与同时在传的分片数"""
+    def __init__(self, fail_times=None, complete_after=1):
+        self.fail_times = dict(fail_times or {})
+        self.complete_after = complete_after
+        self.parts = {}
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.body_types = set()
+        self.lock = threading.Lock()
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        body = json.loads(data) if isinstance(data, str) else data
+        with self.lock:
+            self.calls.append(endpoint)
+        result = {}
+        if endpoint == "s3_repare_upload_parts_batch":
+            result = {"presignedUrls": {
+                str(n): "https://s3/part/%d" % n
+                for n in range(body["partNumberStart"], body["partNumberEnd"])
+            }}
+        elif endpoint == "upload_request":
+            result = dict(SESSION, Reuse=False)
+        elif endpoint == "s3_list_upload_parts":
+            result = {"Parts": [{"PartNumber": str(n)} for n in sorted(self.parts)]}
+        elif endpoint == "upload_complete":
+            result = {"completed": self.calls.count("upload_complete") >= self.complete_after}
+        return mock.Mock(status_code=200, **{"json.return_value": {"code": 0, "data": result}})
+
+    def put(self, url, data=None, timeout=None):
+        part_number = int(url.rsplit("/", 1)[-1])
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        threading.Event().wait(0.01)
+        with self.lock:
+            self.in_flight -= 1
+            if self.fail_times.get(part_number):
+                self.fail_times[part_number] -= 1
+                return mock.Mock(status_code=500)
+            self.body_types.add(type(data))
+            # mmap模式下请求体为上传后即释放的切片，先复制下来
+            self.parts[part_number] = bytes(data)
+        return mock.Mock(status_code=200)
+
+class TestMultipartUpload(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        self.content = bytes(range(256)) * 4 + b"tail"
+        with os.fdopen(fd, "wb") as f:
+            f.write(self.content)
+        self.patches = [mock.patch.object(uploader.time, "sleep")]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        os.unlink(self.path)
+
+    def _upload(self, s3, **kwargs):
+        with mock.patch.object(uploader.http_transport, "post", s3.post), \
+                mock.patch.object(uploader.http_transport, "put", s3.put):
+            upload = MultipartUpload({}, SESSION, part_size=100, **kwargs)
+            upload.upload_file(self.path)
+            upload.complete()
+
+    def test_parts_uploaded_concurrently(self):
+        s3 = FakeS3()
+        self._upload(s3, workers=3)
+        self.assertEqual(b"".join(s3.parts[n] for n in sorted(s3.parts)), self.content)
+        self.assertEqual(sorted(s3.parts), list(range(1, 12)))
+        self.assertGreater(s3.max_in_flight, 1)
+        self.assertLessEqual(s3.max_in_flight, 3)
+
+    def test_mmap_parts_are_slices(self):
+        s3 = FakeS3(fail_times={4: 1})
+        self._upload(s3, workers=3, use_mmap=True)
+        self.assertEqual(b"".join(s3.parts[n] for n in sorted(s3.parts)), self.content)
+        self.assertEqual(s3.body_types, {memoryview})
+
+    def test_failed_part_retried_alone(self):
+        s3 = FakeS3(fail_times={4: 2})
+        self._upload(s3, workers=2)
+        self.assertEqual(len(s3.parts), 11)
+        self.assertEqual(s3.calls.count("s3_repare_upload_parts_batch"), 1 + 2)
+    
+    def test_urls_fetched_in_batches(self):
+        s3 = FakeS3()
+        self._upload(s3, workers=1, url_batch=4)
+        self.assertEqual(len(s3.parts), 11)
+        self.assertEqual(s3.calls.count("s3_repare_upload_parts_batch"), 3)
+    
+    def test_expired_urls_refreshed(self):
+        s3 = FakeS3()
+        with mock.patch.object(uploader.http_transport, "post", s3.post):
+            upload = MultipartUpload({}, SESSION, url_batch=4)
+            upload.prefetch(1)
+            self.assertEqual(upload.presign(1), "https://s3/part/1")
+            upload._urls = {n: (url, 0) for n, (url, _) in upload._urls.items()}
+            self.assertEqual(upload.presign(2), "https://s3/part/2")
+        self.assertEqual(s3.calls.count("s3_repare_upload_parts_batch"), 2)
+
+    def test_exhausted_retries_fail_upload(self):
+        s3 = FakeS3(fail_times={4: 10})
+        with self.assertRaises(UploadError):
+            self._upload(s3, workers=2, max_retries=2)
+        self.assertNotIn("s3_complete_multipart_upload", s3.calls)
+
+    def test_complete_polls_until_done(self):
+        s3 = FakeS3(complete_after=3)
+        self._upload(s3)
+        self.assertEqual(s3.calls.count("upload_complete"), 3)
+
+class TestPartSize(unittest.TestCase):
+    MIB = 1024 * 1024
+
+    def test_small_and_medium_files_use_default(self):
+        self.assertEqual(choose_part_size(1000), uploader.DEFAULT_PART_SIZE)
+        self.assertEqual(choose_part_size(50 * self.MIB, workers=3), uploader.DEFAULT_PART_SIZE)
+
+    def test_large_file_fewer_parts(self):
+        size = choose_part_size(20 * 1024 ** 3, workers=3)
+        self.assertLessEqual(-(-20 * 1024 ** 3 // size), uploader.TARGET_PART_COUNT)
+        self.assertEqual(size % self.MIB, 0)
+
+    def test_throughput_grows_part_within_limit(self):
+        self.assertEqual(choose_part_size(1024 ** 3, throughput=3 * self.MIB, workers=3), 12 * self.MIB)
+        self.assertEqual(choose_part_size(1024 ** 3, throughput=100 * self.MIB, workers=3), uploader.MAX_PART_SIZE)
+        # 仍保证每个上传线程都有分片
+        self.assertEqual(choose_part_size(30 * self.MIB, throughput=100 * self.MIB, workers=3), 10 * self.MIB)
+
+    def test_meter_ignores_small_requests(self):
+        meter = ThroughputMeter(alpha=0.5)
+        meter.record(1000, 0.1)
+        self.assertIsNone(meter.rate)
+        meter.record(4 * self.MIB, 1)
+        meter.record(4 * self.MIB, 0.5)
+        self.assertEqual(meter.rate, 6 * self.MIB)
+
+class TestChunkedUpload(unittest.TestCase):
+    CHUNK = 1024 * 1024
+
+    def setUp(self):
+        self.s3 = FakeS3()
+        self.patches = [
+            mock.patch.object(uploader.time, "sleep"),
+            mock.patch.object(uploader.http_transport, "post", self.s3.post),
+            mock.patch.object(uploader.http_transport, "put", self.s3.put),
+        ]
+        for patch in self.patches:
+            patch.start()
+        self.content = os.urandom(self.CHUNK * 11 + 100)
+        self.chunked = ChunkedUpload(MultipartUpload({}, SESSION), len(self.content), self.CHUNK)
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def _chunk(self, index):
+        return self.content[index * self.CHUNK:(index + 1) * self.CHUNK]
+
+    def test_out_of_order_chunks_become_parts(self):
+        self.assertEqual(self.chunked.chunk_count, 12)
+        for index in reversed(range(12)):
+            self.chunked.put_chunk(index, self._chunk(index))
+        self.chunked.put_chunk(3, self._chunk(3))
+        self.chunked.complete()
+        self.assertEqual(sorted(self.s3.parts), [1, 2, 3])
+        self.assertEqual(len(self.s3.parts[1]), uploader.DEFAULT_PART_SIZE)
+        self.assertEqual(b"".join(self.s3.parts[n] for n in (1, 2, 3)), self.content)
+
+    def test_failed_part_resent_with_chunk(self):
+        self.s3.fail_times[1] = 100
+        for index in range(4):
+            self.chunked.put_chunk(index, self._chunk(index))
+        with self.assertRaises(UploadError):
+            self.chunked.put_chunk(4, self._chunk(4))
+        self.s3.fail_times.clear()
+        self.chunked.put_chunk(4, self._chunk(4))
+        self.assertEqual(self.s3.parts[1], self.content[:uploader.DEFAULT_PART_SIZE])
+
+    def test_duplicate_chunk_during_put_ignored(self):
+        put_part = self.chunked.upload.put_part
+
+        def resend_then_put(part_number, data):
+            # 分片上传期间客户端重发了该分片的块
+            self.chunked.put_chunk(0, self._chunk(0))
+            put_part(part_number, data)
+
+        with mock.patch.object(self.chunked.upload, "put_part", side_effect=resend_then_put):
+            for index in range(5):
+                self.chunked.put_chunk(index, self._chunk(index))
+        self.assertEqual(self.chunked._buffers, {})
+        self.assertEqual(self.s3.parts[1], self.content[:uploader.DEFAULT_PART_SIZE])
+
+    def test_invalid_chunk_size(self):
+        with self.assertRaises(UploadError):
+            ChunkedUpload(MultipartUpload({}, SESSION), 10, 0)
+
+    def test_complete_rejects_missing_chunks(self):
+        self.chunked.put_chunk(0, self._chunk(0))
+        with self.assertRaises(UploadError):
+            self.chunked.complete()
+        with self.assertRaises(UploadError):
+            self.chunked.put_chunk(1, b"short")
+
+    def test_api_session(self):
+        pan = mock.Mock(header_logined={})
+        pan.request_upload.return_value = dict(SESSION)
+        with mock.patch.object(pan_api, "_get_pan_instance", return_value=pan):
+            result = pan_api.begin_upload("/", "a.bin", len(self.content), "0" * 32, self.CHUNK)
+            pan.request_upload.assert_called_once_with("a.bin", 0, len(self.content), "0" * 32, duplicate=2)
+            for index in range(result["chunk_count"]):
+                self.assertEqual(pan_api.upload_chunk(result["upload_id"], index, self._chunk(index)),
+                                 {"status": "success"})
+            self.assertEqual(pan_api.complete_upload(result["upload_id"]), {"status": "success"})
+            self.assertIn("error", pan_api.upload_chunk(result["upload_id"], 0, self._chunk(0)))
+
+    def test_idle_sessions_pruned_on_chunk(self):
+        pan = mock.Mock(header_logined={})
+        pan.request_upload.return_value = dict(SESSION)
+        with mock.patch.object(pan_api, "_get_pan_instance", return_value=pan):
+            idle = pan_api.begin_upload("/", "a.bin", len(self.content), "0" * 32, self.CHUNK)["upload_id"]
+            active = pan_api.begin_upload("/", "b.bin", len(self.content), "0" * 32, self.CHUNK)["upload_id"]
+        pan_api._chunked_uploads[idle][0].updated_at -= pan_api.CHUNKED_UPLOAD_TTL
+        self.assertEqual(pan_api.upload_chunk(active, 0, self._chunk(0)), {"status": "success"})
+        self.assertNotIn(idle, pan_api._chunked_uploads)
+        pan_api._chunked_uploads.pop(active)
+
+class TestHashCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "a.bin")
+        with open(self.path, "wb") as f:
+            f.write(b"first")
+        self.cache = HashCache(":memory:")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_unchanged_file_not_rehashed(self):
+        with mock.patch.object(hash_cache, "file_md5", wraps=hash_cache.file_md5) as file_md5:
+            self.assertEqual(self.cache.md5(self.path), hashlib.md5(b"first").hexdigest())
+            self.assertEqual(self.cache.md5(self.path), hashlib.md5(b"first").hexdigest())
+        self.assertEqual(file_md5.call_count, 1)
+
+    def test_mmap_md5_matches_read(self):
+        empty = os.path.join(self.tmpdir.name, "empty.bin")
+        open(empty, "wb").close()
+        for path in (self.path, empty):
+            self.assertEqual(hash_cache.file_md5(path, use_mmap=True), hash_cache.file_md5(path))
+        self.assertEqual(HashCache(":memory:", use_mmap=True).md5(self.path), hashlib.md5(b"first").hexdigest())
+
+    def test_modified_file_rehashed(self):
+        self.cache.md5(self.path)
+        with open(self.path, "wb") as f:
+            f.write(b"second!")
+        self.assertIsNone(self.cache.get(self.path))
+        self.assertEqual(self.cache.md5(self.path), hashlib.md5(b"second!").hexdigest())
+
+    def test_reuse_upload_sends_no_parts(self):
+        pan = Pan123.__new__(Pan123)
+        pan.header_logined = {}
+        pan.upload_sessions = UploadSessionStore(os.path.join(self.tmpdir.name, "sessions.json"))
+        pan.hash_cache = self.cache
+        pan.upload_workers = 3
+        self.cache.md5(self.path)
+        s3 = FakeS3()
+        reuse = mock.Mock(**{"json.return_value": {"code": 0, "data": {"Reuse": True}}})
+        with mock.patch.object(hash_cache, "file_md5") as file_md5, \
+                mock.patch.object(uploader.http_transport, "post", return_value=reuse) as post, \
+                mock.patch.object(uploader.http_transport, "put", s3.put):
+            pan.up_load(self.path, parent_file_id=0)
+        file_md5.assert_not_called()
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(post.call_args.kwargs["data"]["etag"], hashlib.md5(b"first").hexdigest())
+        self.assertEqual(s3.parts, {})
+
+class TestUploadSessionStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = UploadSessionStore(os.path.join(self.tmpdir.name, "sessions.json"),
+                                        flush_parts=3, flush_interval=3600)
+        self.store.save("a" * 32, 7, SESSION, uploader.DEFAULT_PART_SIZE)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _stored_parts(self):
+        with open(self.store.path, encoding="utf-8") as f:
+            return json.load(f)["%s:7" % ("a" * 32)]["parts"]
+
+    def test_parts_written_in_batches(self):
+        with mock.patch.object(self.store, "_save", wraps=self.store._save) as save:
+            for part_number in (1, 2):
+                self.store.add_part("a" * 32, 7, part_number)
+            save.assert_not_called()
+            self.assertEqual(self.store.get("a" * 32, 7)["parts"], [1, 2])
+            self.store.add_part("a" * 32, 7, 3)
+            self.assertEqual(save.call_count, 1)
+        self.assertEqual(self._stored_parts(), [1, 2, 3])
+
+    def test_flush_and_remove(self):
+        self.store.add_part("a" * 32, 7, 1)
+        self.store.flush()
+        self.assertEqual(self._stored_parts(), [1])
+        self.store.add_part("a" * 32, 7, 2)
+        self.store.remove("a" * 32, 7)
+        self.assertIsNone(self.store.get("a" * 32, 7))
+
+class TestResumableUpload(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "backup.bin")
+        with open(self.path, "wb") as f:
+            f.write(os.urandom(uploader.DEFAULT_PART_SIZE * 2 + 1000))
+        self.pan = Pan123.__new__(Pan123)
+        self.pan.header_logined = {}
+        self.pan.upload_workers = 2
+        self.pan.upload_mmap = True
+        self.pan.upload_throughput = ThroughputMeter()
+        self.pan.upload_sessions = UploadSessionStore(os.path.join(self.tmpdir.name, "sessions.json"))
+        self.pan.hash_cache = HashCache(":memory:")
+        self.sleep = mock.patch.object(uploader.time, "sleep")
+        self.sleep.start()
+
+    def tearDown(self):
+        self.sleep.stop()
+        self.tmpdir.cleanup()
+
+    def _up_load(self, s3):
+        with mock.patch.object(uploader.http_transport, "post", s3.post), \
+                mock.patch.object(uploader.http_transport, "put", s3.put):
+            self.pan.up_load(self.path, parent_file_id=7)
+
+    def test_resume_skips_stored_parts(self):
+        s3 = FakeS3(fail_times={2: 100})
+        with self.assertRaises(UploadError):
+            self._up_load(s3)
+        entry = self.pan.upload_sessions.get(self._md5(), 7)
+        self.assertEqual(entry["session"]["UploadId"], "u")
+        self.assertIn(1, entry["parts"])
+        
+        s3.fail_times.clear()
+        stored = set(s3.parts)
+        s3.put = mock.Mock(side_effect=s3.put)
+        self._up_load(s3)
+        self.assertEqual(s3.calls.count("upload_request"), 1)
+        uploaded = {int(call.args[0].rsplit("/", 1)[-1]) for call in s3.put.call_args_list}
+        self.assertEqual(uploaded, {1, 2, 3} - stored)
+        self.assertIsNone(self.pan.upload_sessions.get(self._md5(), 7))
+
+    def test_invalid_session_starts_over(self):
+        self.pan.upload_sessions.save(self._md5(), 7, SESSION, uploader.DEFAULT_PART_SIZE)
+        s3 = FakeS3()
+        original_post = s3.post
+        
+        def post(url, **kwargs):
+            if url.endswith("s3_list_upload_parts") and "upload_request" not in s3.calls:
+                s3.calls.append("s3_list_upload_parts")
+                return mock.Mock(**{"json.return_value": {"code": 1, "message": "expired"}})
+            return original_post(url, **kwargs)
+        s3.post = post
+        self._up_load(s3)
+        self.assertEqual(s3.calls.count("upload_request"), 1)
+        self.assertEqual(len(s3.parts), 3)
+
+    def test_small_file_single_put(self):
+        with open(self.path, "wb") as f:
+            f.write(b"small")
+        s3 = FakeS3()
+        self._up_load(s3)
+        self.assertEqual(s3.parts, {1: b"small"})
+        # 不查询已上传分块，也不写入续传会话
+        self.assertEqual(s3.calls[:2], ["upload_request", "s3_repare_upload_parts_batch"])
+        self.assertFalse(os.path.exists(self.pan.upload_sessions.path))
+
+    def _md5(self):
+        with open(self.path, "rb") as f:
+            return hashlib.md5(f.read()).hexdigest()
+
+
+class BatchPan:
+    """记录列目录与上传调用的Pan123替身，上传时报告进度并统计同时上传的文件数"""
+    def __init__(self, tree):
+        self.tree = tree
+        self.header_logined = {}
+        self.listed = []
+        self.uploads = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def fetch_dir(self, parent_file_id):
+        self.listed.append(parent_file_id)
+        return 0, [dict(item) for item in self.tree.get(parent_file_id, [])]
+
+    def up_load(self, file_path, file_name=None, parent_file_id=None, workers=None, md5=None, duplicate=None,
+                progress=None):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        threading.Event().wait(0.01)
+        size = os.path.getsize(file_path)
+        progress(size // 2, size)
+        with self.lock:
+            self.in_flight -= 1
+            self.uploads.append((parent_file_id, file_name, duplicate))
+
+class TestBatchUpload(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmpdir.name, "相册")
+        for relative in ("a.jpg", "2024/b.jpg", "2024/c.jpg", "2024/05/d.jpg", "2023/e.jpg"):
+            path = os.path.join(self.root, relative)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(relative.encode())
+        self.pan = BatchPan({0: [{"FileId": 10, "FileName": "相册", "Type": 1}],
+                             10: [{"FileId": 11, "FileName": "2024", "Type": 1}]})
+        pan_api._pan_instance = self.pan
+        pan_api._path_index.clear()
+        pan_api._missing_paths.clear()
+        pan_api._upload_pool = ThreadPoolExecutor(max_workers=2)
+        self.created = []
+        self.lock = threading.Lock()
+        self.post = mock.patch.object(pan_api.http_transport, "post", side_effect=self._create)
+        self.post.start()
+
+    def tearDown(self):
+        self.post.stop()
+        pan_api._upload_pool.shutdown()
+        pan_api._upload_pool = None
+        pan_api._pan_instance = None
+        self.tmpdir.cleanup()
+
+    def _create(self, url, headers=None, data=None, timeout=None):
+        data = json.loads(data)
+        with self.lock:
+            self.created.append((data["parentFileId"], data["fileName"]))
+            file_id = 100 + len(self.created)
+        return mock.Mock(**{"json.return_value": {"code": 0, "data": {"FileId": file_id}}})
+
+    def test_folders_created_once_then_files_uploaded(self):
+        snapshots = []
+        result = pan_api.upload_directory(self.root, "/", progress=snapshots.append)
+        self.assertEqual(result["status"], "success")
+        self.assertEqual(result["uploaded"], 5)
+        # 已存在的相册、2024被复用；新建的2023下无需再列目录
+        self.assertEqual(sorted(self.created), [(10, "2023"), (11, "05")])
+        self.assertEqual(sorted(self.pan.listed), [0, 10, 11])
+        parents = {name: parent for parent, name, _ in self.pan.uploads}
+        self.assertEqual(parents["a.jpg"], 10)
+        self.assertEqual(parents["b.jpg"], 11)
+        self.assertEqual({d for _, _, d in self.pan.uploads}, {2})
+        self.assertLessEqual(self.pan.max_in_flight, 2)
+        self.assertEqual(snapshots[-1]["done_files"], 5)
+        self.assertEqual(snapshots[-1]["uploaded_bytes"], snapshots[-1]["total_bytes"])
+
+    def test_invalid_batch_uploads_nothing(self):
+        result = pan_api.upload_directory(self.root, "/", upload_config={"allowed_types": ["png"]})
+        self.assertIn("error", result)
+        self.assertEqual(len(result["results"]), 5)
+        self.assertEqual(self.created, [])
+        self.assertEqual(self.pan.uploads, [])
+
+    def test_progress_counts_failures(self):
+        progress = BatchProgress([10, 20])
+        progress.update(0, 5)
+        progress.update(0, 8)
+        progress.finish(1, success=False)
+        self.assertEqual(progress.snapshot()["uploaded_bytes"], 8)
+        progress.finish(0)
+        self.assertEqual(progress.snapshot(), {"total_files": 2, "done_files": 1, "failed_files": 1,
+                                               "total_bytes": 30, "uploaded_bytes": 10})